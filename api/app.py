@@ -1,7 +1,29 @@
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+load_dotenv(".env.local")
+
+# model_router 导入时读取 MODEL_BACKENDS / OPENAI_BASE_URL / MODEL_SLOTS，放在 .env.local 加载之后
+import completions_api
+import conversion_api
+import image_search_api
+from model_router import router as model_router
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 图片检索模型在后台加载并常驻，不阻塞启动
+    image_search_api.service.start()
+    model_router.start_health_checks()
+    yield
+    # PDF 转换进程池在第一次转换请求时才启动，这里只负责关闭
+    await conversion_api.service.aclose()
+    await model_router.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 origins = [
     "http://localhost:1421",  # Your Tauri dev server
     "tauri://localhost",  # Often used by Tauri in production
@@ -15,6 +37,10 @@ app.add_middleware(
     allow_methods=["*"],  # Allows all methods (GET, POST, PUT, DELETE, etc.)
     allow_headers=["*"],  # Allows all headers
 )
+app.include_router(image_search_api.router)
+app.include_router(conversion_api.router)
+# 图片描述（background）和 docling VLM 页面（batch）在这个进程的调度器里排队
+app.include_router(completions_api.router)
 
 
 @app.get("/")
@@ -0,0 +1,128 @@
+"""
+转换结果中图片的流式写盘
+图片一交给 ArtifactWriter 就在后台线程池里编码写入磁盘，写完立即释放位图：
+- 最多 max_pending 张图片在等待或编码中，超过时 submit 阻塞，生产方不会在内存里堆积整本文档的位图
+- 支持 WebP（method=0，最快的编码档）和低压缩级别的 PNG，比默认 PNG 编码快得多
+- 文件名是像素内容的 sha256，重复的图片（每页相同的页眉 logo 等）只写一次
+"""
+
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Set
+
+IMAGE_FORMATS = {
+    # 格式 -> (扩展名, mimetype)
+    "webp": ("webp", "image/webp"),
+    "png": ("png", "image/png"),
+}
+
+
+def image_hash(image) -> str:
+    digest = hashlib.sha256(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class ArtifactWriter:
+    def __init__(self, output_dir: str, image_format: str = "webp", quality: int = 80, png_compress_level: int = 1,
+                 workers: int = 4, max_pending: int = 8):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown image format {image_format}, expected one of {', '.join(IMAGE_FORMATS)}")
+        self.output_dir = output_dir
+        self.image_format = image_format
+        self.extension, self.mimetype = IMAGE_FORMATS[image_format]
+        self.quality = quality
+        self.png_compress_level = png_compress_level
+        os.makedirs(output_dir, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="artifact-writer")
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        # 已写入的图片哈希；正在写入的：哈希 -> 写入任务，写完（成功或失败）即移除
+        self._written: Set[str] = set()
+        self._writing: Dict[str, Future] = {}
+        # 上次 flush 之后的写入错误，由下一次 flush 抛出一次
+        self._errors: List[BaseException] = []
+        self.stats = {"written": 0, "deduplicated": 0, "bytes": 0}
+
+    def submit(self, image, close: bool = True) -> str:
+        """交给后台写入，返回文件路径；close=True 时写完（或发现重复）后关闭 image 释放位图"""
+        digest = image_hash(image)
+        path = os.path.join(self.output_dir, f"{digest}.{self.extension}")
+        with self._lock:
+            duplicate = digest in self._written or digest in self._writing or os.path.exists(path)
+            if duplicate:
+                self.stats["deduplicated"] += 1
+            else:
+                # 先登记，同一张图片随后再提交时直接算作重复
+                done = self._writing[digest] = Future()
+        if duplicate:
+            if close:
+                image.close()
+            return path
+        # 在锁外等待空位，写入线程更新统计时也要拿锁
+        self._pending.acquire()
+        try:
+            self._pool.submit(self._write, image, digest, path, close, done)
+        except BaseException as e:
+            # 没交出去（例如 writer 已关闭）：撤销登记并释放空位，否则 flush 会一直等这张图片
+            self._pending.release()
+            with self._lock:
+                del self._writing[digest]
+            done.set_exception(e)
+            if close:
+                image.close()
+            raise
+        return path
+
+    def _write(self, image, digest: str, path: str, close: bool, done: Future):
+        # 进程号：多个转换进程可能同时写同一张图片
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                if self.image_format == "webp":
+                    image.save(f, format="WEBP", quality=self.quality, method=0)
+                else:
+                    image.save(f, format="PNG", compress_level=self.png_compress_level)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self.stats["written"] += 1
+                self.stats["bytes"] += os.path.getsize(path)
+                self._written.add(digest)
+                del self._writing[digest]
+            done.set_result(path)
+        except BaseException as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                # 失败的图片不算写过，再次提交时会重新写
+                del self._writing[digest]
+                self._errors.append(e)
+            done.set_exception(e)
+        finally:
+            if close:
+                image.close()
+            self._pending.release()
+
+    def flush(self):
+        """等待已提交的图片全部写完；上次 flush 之后有写入失败时抛出其中第一个错误"""
+        with self._lock:
+            futures = list(self._writing.values())
+        wait(futures)
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown()
+
+    def __enter__(self) -> "ArtifactWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,128 @@
+"""
+50-turn /api/chat conversation: full history per request vs the server-side conversation store
+Reports request payload per turn, message conversion time, how much of each upstream prompt is a
+byte-identical prefix of the previous one (what the inference server's prompt cache can reuse), and
+a simulated time-to-first-token where only the non-cached part of the prompt is prefilled.
+
+convert_to_openai_messages below mirrors utils/prompt.py of the AI SDK Python template: the client's
+copy of an assistant answer comes back as text parts plus toolInvocations, which is not the message
+sequence the tool loop actually sent upstream.
+
+python benchmark_conversation.py --turns 50 --prefill-tokens-per-sec 1000
+"""
+
+import argparse
+import json
+import time
+from types import SimpleNamespace
+
+from conversation_store import ConversationStore
+from stream_protocol import dumps
+
+
+def convert_to_openai_messages(messages):
+    openai_messages = []
+    for message in messages:
+        parts = [{"type": "text", "text": message.content}]
+        tool_calls = []
+        for tool_invocation in message.toolInvocations or []:
+            tool_calls.append({
+                "id": tool_invocation["toolCallId"],
+                "type": "function",
+                "function": {"name": tool_invocation["toolName"], "arguments": json.dumps(tool_invocation["args"])},
+            })
+        openai_messages.append({"role": message.role, "content": parts, "tool_calls": tool_calls or None})
+        for tool_invocation in message.toolInvocations or []:
+            openai_messages.append({"role": "tool", "tool_call_id": tool_invocation["toolCallId"],
+                                    "content": json.dumps(tool_invocation["result"])})
+    return openai_messages
+
+
+def simulated_turn(i: int):
+    """(client user message, what the tool loop sends upstream as the answer, the client's copy of the answer)"""
+    user = SimpleNamespace(role="user", content=f"Question {i}: " + "please explain this in detail " * 6,
+                           toolInvocations=None)
+    text = f"Answer {i}. " + "Here is a fairly long explanation sentence. " * 14
+    if i % 5 == 0:
+        args = '{"location": "Paris", "unit": "celsius"}'
+        result = {"location": "Paris", "temperature": 18, "unit": "celsius"}
+        generated = [
+            {"role": "assistant", "content": None, "tool_calls": [
+                {"id": f"call_{i}", "type": "function",
+                 "function": {"name": "get_current_weather", "arguments": args}}]},
+            {"role": "tool", "tool_call_id": f"call_{i}", "content": dumps(result).decode()},
+            {"role": "assistant", "content": text},
+        ]
+        invocations = [{"toolCallId": f"call_{i}", "toolName": "get_current_weather",
+                        "args": json.loads(args), "result": result, "state": "result"}]
+    else:
+        generated = [{"role": "assistant", "content": text}]
+        invocations = None
+    return user, generated, SimpleNamespace(role="assistant", content=text, toolInvocations=invocations)
+
+
+def shared_prefix_bytes(previous: list, current: list) -> int:
+    shared = 0
+    for a, b in zip(previous, current):
+        encoded = dumps(a)
+        if encoded != dumps(b):
+            break
+        shared += len(encoded)
+    return shared
+
+
+def run(turns: int, stateful: bool, prefill_tokens_per_sec: float) -> dict:
+    store = ConversationStore()
+    client_messages = []
+    previous_prompt = []
+    payload = convert_seconds = prompt_bytes = cached_bytes = ttft = 0.0
+
+    for i in range(turns):
+        user, generated, client_answer = simulated_turn(i)
+        client_messages.append(user)
+        body = {"id": "chat-1", "message": vars(user)} if stateful else {"messages": [vars(m) for m in client_messages]}
+        payload += len(json.dumps(body))
+
+        start = time.perf_counter()
+        if stateful:
+            prompt = store.append("chat-1", user, convert_to_openai_messages)
+        else:
+            prompt = convert_to_openai_messages(client_messages)
+        convert_seconds += time.perf_counter() - start
+
+        size = sum(len(dumps(m)) for m in prompt)
+        shared = shared_prefix_bytes(previous_prompt, prompt)
+        prompt_bytes += size
+        cached_bytes += shared
+        ttft += (size - shared) / 4 / prefill_tokens_per_sec  # ~4 bytes per token
+
+        if stateful:
+            store.commit("chat-1", generated)
+        client_messages.append(client_answer)
+        # The inference server's cache holds the prompt plus the answer it generated
+        previous_prompt = prompt + generated
+
+    return {
+        "payload_kb": payload / turns / 1024,
+        "convert_ms": convert_seconds / turns * 1000,
+        "cached": cached_bytes / prompt_bytes,
+        "ttft": ttft / turns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the /api/chat conversation store")
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--prefill-tokens-per-sec", type=float, default=1000,
+                        help="Simulated prompt processing speed of the local model")
+    args = parser.parse_args()
+
+    print(f"{args.turns} turns, prefill {args.prefill_tokens_per_sec:.0f} tokens/s")
+    print(f"{'mode':>14} {'payload KB/turn':>16} {'convert ms/turn':>16} {'prompt cached':>14} {'sim TTFT s':>11}")
+    for name, stateful in (("full history", False), ("store", True)):
+        r = run(args.turns, stateful, args.prefill_tokens_per_sec)
+        print(f"{name:>14} {r['payload_kb']:>16.2f} {r['convert_ms']:>16.3f} {r['cached']:>13.1%} {r['ttft']:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+按页分片并行转换基准测试
+同一个 PDF 分别用不同的工作进程数转换，报告模型加载时间、转换时间和 pages/sec；
+workers=1 且页段覆盖整本文档时等同于 test_docling_01.py 的单进程 converter.convert(source)
+不做图片描述（远程 VLM 的耗时和本地 CPU 并行无关）
+--cache 时再测一次转换缓存：冷缓存转换，再次打开（整本命中），以及只改动一页后的重新转换
+
+python benchmark_docling.py manual.pdf --workers 1 2 4 --pages-per-chunk 8
+python benchmark_docling.py manual.pdf --workers 4 --cache /tmp/conversion_cache
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import pypdfium2
+from docling.datamodel.pipeline_options import PdfPipelineOptions
+
+from conversion_cache import ConversionCache
+from docling_conversion import ParallelConverter, page_count
+
+
+def edit_one_page(source: str, target: str):
+    """把中间一页旋转 90 度另存，其它页不变"""
+    pdf = pypdfium2.PdfDocument(source)
+    try:
+        page = pdf[len(pdf) // 2]
+        page.set_rotation((page.get_rotation() + 90) % 360)
+        pdf.save(target)
+    finally:
+        pdf.close()
+
+
+def benchmark_cache(args, pipeline_options, pages: int):
+    cache = ConversionCache(args.cache)
+    cache.clear()
+    with ParallelConverter(pipeline_options, workers=max(args.workers),
+                           pages_per_chunk=args.pages_per_chunk) as converter:
+        converter.start()
+        with tempfile.TemporaryDirectory() as tmp:
+            edited = str(Path(tmp) / Path(args.pdf).name)
+            edit_one_page(args.pdf, edited)
+            print(f"{'cache':>22} {'seconds':>10} {'pages converted':>16}")
+            for label, source in (("cold", args.pdf), ("reopen", args.pdf), ("one page changed", edited)):
+                misses = cache.misses["pages"]
+                start = time.perf_counter()
+                doc = cache.convert(converter, source)
+                seconds = time.perf_counter() - start
+                assert len(doc.pages) == pages
+                print(f"{label:>22} {seconds:>10.3f} {cache.misses['pages'] - misses:>16}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark page-sharded parallel PDF conversion")
+    parser.add_argument("pdf")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--pages-per-chunk", type=int, default=8)
+    parser.add_argument("--images-scale", type=float, default=2.0)
+    parser.add_argument("--no-ocr", action="store_true")
+    parser.add_argument("--cache", default=None, help="Also benchmark the conversion cache in this directory (cleared first)")
+    args = parser.parse_args()
+
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.do_ocr = not args.no_ocr
+    pipeline_options.generate_picture_images = True
+    pipeline_options.images_scale = args.images_scale
+
+    pages = page_count(args.pdf)
+    print(f"{args.pdf}: {pages} pages, {args.pages_per_chunk} pages per chunk")
+    print(f"{'workers':>8} {'startup s':>10} {'convert s':>10} {'pages/sec':>10} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        with ParallelConverter(pipeline_options, workers=workers, pages_per_chunk=args.pages_per_chunk) as converter:
+            start = time.perf_counter()
+            converter.start()
+            startup = time.perf_counter() - start
+            start = time.perf_counter()
+            doc = converter.convert(args.pdf)
+            seconds = time.perf_counter() - start
+        assert len(doc.pages) == pages, f"merged document has {len(doc.pages)} of {pages} pages"
+        rate = pages / seconds
+        baseline = baseline or rate
+        print(f"{workers:>8} {startup:>10.1f} {seconds:>10.1f} {rate:>10.2f} {rate / baseline:>7.2f}x")
+    if args.cache:
+        benchmark_cache(args, pipeline_options, pages)
+
+
+if __name__ == "__main__":
+    main()
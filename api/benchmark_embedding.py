@@ -0,0 +1,69 @@
+"""
+图片嵌入吞吐基准测试
+对同一批图片分别用不同的 batch size 嵌入，报告 images/sec 和峰值 RSS
+每个 batch size 在单独的子进程中运行，峰值 RSS 互不影响
+依赖 mlx / mlx_vlm，只能在 Apple Silicon 的 macOS 上运行
+
+python benchmark_embedding.py ./image_collection --batch-sizes 1 8 32
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 上单位是字节，Linux 上是 KB
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_single(image_directory: str, batch_size: int, limit: int, num_workers: int):
+    from image_retrieval_system import MultimodalRetrievalSystem
+
+    system = MultimodalRetrievalSystem()
+    image_files = system._list_image_files(image_directory)[:limit]
+
+    start = time.perf_counter()
+    _, embeddings = system._embed_images(image_files, use_content_hash=False,
+                                         batch_size=batch_size, num_workers=num_workers)
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        'batch_size': batch_size,
+        'images': len(embeddings),
+        'images_per_sec': len(embeddings) / elapsed,
+        'peak_rss_mb': peak_rss_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched image embedding")
+    parser.add_argument("image_directory")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--limit", type=int, default=256, help="Number of images to embed")
+    parser.add_argument("--num-workers", type=int, default=4, help="Image decoding threads")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        run_single(args.image_directory, args.single, args.limit, args.num_workers)
+        return
+
+    print(f"{'batch':>6} {'images':>7} {'images/s':>9} {'peak RSS MB':>12}")
+    for batch_size in args.batch_sizes:
+        output = subprocess.run(
+            [sys.executable, __file__, args.image_directory, "--single", str(batch_size),
+             "--limit", str(args.limit), "--num-workers", str(args.num_workers)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{result['batch_size']:>6} {result['images']:>7} "
+              f"{result['images_per_sec']:>9.2f} {result['peak_rss_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
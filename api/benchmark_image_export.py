@@ -0,0 +1,99 @@
+"""
+图片导出的峰值内存基准测试
+before：test_docling_01.py 的做法，整本文档一次转换（generate_page_images、generate_picture_images、
+        images_scale=2.0），所有页面位图留在内存里，最后同步逐张保存 PNG
+after： ParallelConverter 按页段转换，每个页段的图片在工作进程里由 ArtifactWriter 后台写盘后释放
+每种方式在单独的子进程里运行，峰值 RSS 取该进程和其工作进程中的最大值（ru_maxrss）
+
+python benchmark_image_export.py manual-200-pages.pdf --workers 2 --pages-per-chunk 4 --image-format webp
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def peak_rss_mb() -> dict:
+    scale = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024  # macOS 为字节，Linux 为 KB
+    return {
+        "main": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "workers": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def pipeline_options(images_scale: float):
+    from docling.datamodel.pipeline_options import PdfPipelineOptions
+
+    options = PdfPipelineOptions()
+    options.generate_page_images = True
+    options.generate_picture_images = True
+    options.images_scale = images_scale
+    return options
+
+
+def run_before(args, output_dir: Path) -> int:
+    from docling_core.types.doc import PictureItem, TableItem
+    from docling_conversion import build_converter
+
+    doc = build_converter(pipeline_options(args.images_scale)).convert(args.pdf).document
+    images = 0
+    for page_no, page in doc.pages.items():
+        with (output_dir / f"page-{page_no}.png").open("wb") as fp:
+            page.image.pil_image.save(fp, format="PNG")
+        images += 1
+    for element, _ in doc.iterate_items():
+        if isinstance(element, (TableItem, PictureItem)):
+            image = element.get_image(doc)
+            if image is not None:
+                with (output_dir / f"element-{images}.png").open("wb") as fp:
+                    image.save(fp, "PNG")
+                images += 1
+    return images
+
+
+def run_after(args, output_dir: Path) -> int:
+    from docling_conversion import ParallelConverter
+
+    with ParallelConverter(pipeline_options(args.images_scale), workers=args.workers,
+                           pages_per_chunk=args.pages_per_chunk, artifacts_dir=str(output_dir),
+                           image_format=args.image_format) as converter:
+        doc = converter.convert(args.pdf)
+    return len(doc.pages) + sum(1 for item in doc.pictures + doc.tables if item.image is not None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark peak memory of image export")
+    parser.add_argument("pdf")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--pages-per-chunk", type=int, default=4)
+    parser.add_argument("--images-scale", type=float, default=2.0)
+    parser.add_argument("--image-format", choices=["webp", "png"], default="webp")
+    parser.add_argument("--mode", choices=["before", "after"], default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            images = (run_before if args.mode == "before" else run_after)(args, Path(tmp))
+            seconds = time.perf_counter() - start
+            written = sum(path.stat().st_size for path in Path(tmp).iterdir())
+        print(json.dumps({"images": images, "seconds": seconds, "mb_written": written / 1e6, **peak_rss_mb()}))
+        return
+
+    print(f"{args.pdf}, images_scale {args.images_scale}")
+    print(f"{'':>7} {'seconds':>8} {'images':>7} {'MB written':>11} {'peak RSS main MB':>17} {'workers MB':>11}")
+    for mode in ("before", "after"):
+        output = subprocess.run([sys.executable, __file__, *sys.argv[1:], "--mode", mode],
+                                check=True, capture_output=True, text=True).stdout
+        r = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>7} {r['seconds']:>8.1f} {r['images']:>7} {r['mb_written']:>11.1f} "
+              f"{r['main']:>17.0f} {r['workers']:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
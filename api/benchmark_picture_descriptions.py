@@ -0,0 +1,74 @@
+"""
+Picture description benchmark against a fake local inference server
+A paper with --figures figures, --duplicates of them repeated (logos, icons) is described with
+different in-flight limits; limit 1 sends one figure after another like docling's built-in stage
+(duplicates still come from the cache). The fake server runs --server-slots generations in parallel with a fixed latency each.
+
+python benchmark_picture_descriptions.py --figures 40 --duplicates 6 --server-slots 4 --limits 1 2 4 8
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+import httpx
+
+from picture_descriptions import DescriptionCache, PictureDescriber
+
+
+class FakeServer:
+    def __init__(self, slots: int, latency: float):
+        self.slots = asyncio.Semaphore(slots)
+        self.latency = latency
+        self.calls = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        async with self.slots:
+            await asyncio.sleep(self.latency)
+        return httpx.Response(200, json={"choices": [{"message": {"content": "A figure."}}]})
+
+
+async def run(args, limit: int, images: list, cache_dir: str) -> dict:
+    server = FakeServer(args.server_slots, args.latency)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(server.handle))
+    describer = PictureDescriber("vlm", max_in_flight=limit, cache=DescriptionCache(cache_dir),
+                                 url="http://api/v1/chat/completions", client=client)
+    start = time.perf_counter()
+    if limit == 1:
+        # Serial baseline: one request per figure, like docling's picture description stage
+        for png in images:
+            await describer.describe_images([png])
+    else:
+        await describer.describe_images(images)
+    return {"calls": server.calls, "seconds": time.perf_counter() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent picture descriptions")
+    parser.add_argument("--figures", type=int, default=40)
+    parser.add_argument("--duplicates", type=int, default=6, help="Figures that repeat an earlier one")
+    parser.add_argument("--server-slots", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per description on the server")
+    parser.add_argument("--limits", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    distinct = args.figures - args.duplicates
+    images = [f"figure-{i % distinct}".encode() for i in range(args.figures)]
+    print(f"{args.figures} figures ({args.duplicates} duplicates), server {args.server_slots} slots x {args.latency:.2f}s")
+    print(f"{'in flight':>10} {'requests':>9} {'seconds':>8} {'speedup':>8}")
+    baseline = None
+    for limit in args.limits:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            r = asyncio.run(run(args, limit, images, cache_dir))
+        baseline = baseline or r["seconds"]
+        print(f"{limit:>10} {r['calls']:>9} {r['seconds']:>8.2f} {baseline / r['seconds']:>7.2f}x")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        asyncio.run(run(args, max(args.limits), images, cache_dir))
+        r = asyncio.run(run(args, max(args.limits), images, cache_dir))
+    print(f"{'cached':>10} {r['calls']:>9} {r['seconds']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
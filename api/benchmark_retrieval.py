@@ -0,0 +1,235 @@
+"""
+检索打分基准测试
+使用随机合成的嵌入，不依赖模型
+
+python benchmark_retrieval.py scoring --sizes 1000 10000 100000   # 逐图片循环 vs 批量 MaxSim 的查询吞吐
+python benchmark_retrieval.py ann --size 50000                     # 两阶段检索 recall@10 与吞吐
+python benchmark_retrieval.py quant --size 5000                    # int8 / PQ 压缩的索引大小与 recall@10
+python benchmark_retrieval.py batch --size 20000                   # 逐个查询 vs 多个查询一起矩阵打分
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from ivf_index import IVFIndex, image_centroids
+from maxsim import maxsim_scores, maxsim_scores_batch, top_k_indices
+from quantization import Int8Codes, ProductQuantizer
+
+IMAGE_TOKENS = 64
+QUERY_TOKENS = 8
+EMBED_DIM = 128
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def synthetic_embeddings(n: int, tokens: int, seed: int = 0) -> np.ndarray:
+    """生成 L2 归一化的随机 token 向量 (n, tokens, EMBED_DIM)"""
+    rng = np.random.default_rng(seed)
+    embeds = rng.standard_normal((n, tokens, EMBED_DIM), dtype=np.float32)
+    # 分块原地归一化：100k 张图片的矩阵有 3.3 GB，np.linalg.norm 的中间结果不能再有整个矩阵那么大
+    for start in range(0, n, 10000):
+        chunk = embeds[start:start + 10000]
+        chunk /= np.linalg.norm(chunk, axis=-1, keepdims=True)
+    return embeds
+
+
+def clustered_embeddings(n: int, topics: int = 512, topics_per_image: int = 3,
+                         chunk_size: int = 10000, seed: int = 0) -> np.ndarray:
+    """生成有主题结构的图片嵌入：每张图片混合几个主题，每个 token 是某个主题中心加噪声"""
+    rng = np.random.default_rng(seed)
+    centers = _normalize(rng.standard_normal((topics, EMBED_DIM), dtype=np.float32))
+    embeds = np.empty((n, IMAGE_TOKENS, EMBED_DIM), dtype=np.float32)
+    for start in range(0, n, chunk_size):
+        m = min(chunk_size, n - start)
+        image_topics = rng.integers(topics, size=(m, topics_per_image))
+        token_topics = np.take_along_axis(
+            image_topics, rng.integers(topics_per_image, size=(m, IMAGE_TOKENS)), axis=1)
+        noise = rng.standard_normal((m, IMAGE_TOKENS, EMBED_DIM), dtype=np.float32)
+        embeds[start:start + m] = _normalize(centers[token_topics] + 0.15 * noise)
+    return embeds
+
+
+def sample_queries(image_embeddings: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """从随机图片中取 QUERY_TOKENS 个 token 加噪声作为查询"""
+    rng = np.random.default_rng(seed)
+    queries = np.empty((count, QUERY_TOKENS, EMBED_DIM), dtype=np.float32)
+    for i, image in enumerate(rng.integers(len(image_embeddings), size=count)):
+        tokens = image_embeddings[image][rng.choice(IMAGE_TOKENS, QUERY_TOKENS, replace=False)]
+        queries[i] = _normalize(tokens + 0.1 * rng.standard_normal(tokens.shape, dtype=np.float32))
+    return queries
+
+
+def loop_search(query: np.ndarray, image_embeddings: np.ndarray, top_k: int) -> np.ndarray:
+    """原实现：逐图片计算分数后整体排序"""
+    results = []
+    for i, image_embed in enumerate(image_embeddings):
+        token_similarities = np.dot(query, image_embed.T)
+        results.append((np.sum(np.max(token_similarities, axis=1)), i))
+    results.sort(reverse=True)
+    return np.array([i for _, i in results[:top_k]])
+
+
+def batched_search(query: np.ndarray, image_embeddings: np.ndarray, top_k: int) -> np.ndarray:
+    return top_k_indices(maxsim_scores(query, image_embeddings), top_k)
+
+
+def two_stage_search(query: np.ndarray, image_embeddings: np.ndarray, top_k: int,
+                     ann_index: IVFIndex, candidate_k: int, nprobe: int) -> np.ndarray:
+    candidates = ann_index.search(query, candidate_k, nprobe)
+    return candidates[top_k_indices(maxsim_scores(query, image_embeddings[candidates]), top_k)]
+
+
+def queries_per_second(search, queries: np.ndarray, image_embeddings: np.ndarray, top_k: int) -> float:
+    search(queries[0], image_embeddings, top_k)  # 预热
+    start = time.perf_counter()
+    for query in queries:
+        search(query, image_embeddings, top_k)
+    return len(queries) / (time.perf_counter() - start)
+
+
+def bench_scoring(args):
+    queries = synthetic_embeddings(args.queries, QUERY_TOKENS, seed=1)
+
+    print(f"{'images':>8} {'loop q/s':>10} {'batched q/s':>12} {'speedup':>8}")
+    for n in args.sizes:
+        image_embeddings = synthetic_embeddings(n, IMAGE_TOKENS)
+        batched_qps = queries_per_second(batched_search, queries, image_embeddings, args.top_k)
+
+        if n <= args.loop_limit:
+            loop_qps = queries_per_second(loop_search, queries[:5], image_embeddings, args.top_k)
+            assert np.array_equal(loop_search(queries[0], image_embeddings, args.top_k),
+                                  batched_search(queries[0], image_embeddings, args.top_k))
+            print(f"{n:>8} {loop_qps:>10.2f} {batched_qps:>12.2f} {batched_qps / loop_qps:>7.1f}x")
+        else:
+            print(f"{n:>8} {'-':>10} {batched_qps:>12.2f} {'-':>8}")
+
+
+def bench_ann(args):
+    image_embeddings = clustered_embeddings(args.size)
+    queries = sample_queries(image_embeddings, args.queries)
+
+    start = time.perf_counter()
+    ann_index = IVFIndex.train(image_centroids(image_embeddings, args.vectors_per_image), nlist=args.nlist)
+    print(f"Trained IVF with {len(ann_index.centroids)} lists on {args.size} images "
+          f"({args.vectors_per_image} vectors per image) in {time.perf_counter() - start:.2f}s")
+
+    exact = [set(batched_search(q, image_embeddings, args.top_k)) for q in queries]
+    exhaustive_qps = queries_per_second(batched_search, queries, image_embeddings, args.top_k)
+    print(f"{'candidate_k':>11} {'recall@' + str(args.top_k):>10} {'q/s':>9} {'speedup':>8}")
+    print(f"{'exhaustive':>11} {1.0:>10.3f} {exhaustive_qps:>9.2f} {1.0:>7.1f}x")
+
+    for candidate_k in args.candidate_k:
+        def search(query, embeddings, top_k):
+            return two_stage_search(query, embeddings, top_k, ann_index, candidate_k, args.nprobe)
+
+        recall = np.mean([
+            len(exact[i] & set(search(q, image_embeddings, args.top_k))) / args.top_k
+            for i, q in enumerate(queries)
+        ])
+        qps = queries_per_second(search, queries, image_embeddings, args.top_k)
+        print(f"{candidate_k:>11} {recall:>10.3f} {qps:>9.2f} {qps / exhaustive_qps:>7.1f}x")
+
+
+def bench_quant(args):
+    image_embeddings = clustered_embeddings(args.size)
+    queries = sample_queries(image_embeddings, args.queries)
+    exact = [set(batched_search(q, image_embeddings, args.top_k)) for q in queries]
+
+    methods = [("float32", None), ("int8", Int8Codes.encode(image_embeddings))]
+    for subspaces in args.subspaces:
+        methods.append((f"pq{subspaces}", ProductQuantizer.train(image_embeddings, subspaces=subspaces)))
+
+    print(f"{'method':>16} {'MB':>9} {'ratio':>7} {'recall@' + str(args.top_k):>10} {'q/s':>8}")
+    for name, quantized in methods:
+        if quantized is None:
+            variants = [(name, image_embeddings.nbytes, batched_search)]
+        else:
+            def search(query, embeddings, top_k, quantized=quantized):
+                return top_k_indices(quantized.maxsim_scores(query), top_k)
+
+            def rerank_search(query, embeddings, top_k, quantized=quantized):
+                # 粗排后只读取 rerank_k 行 float32 嵌入做精排，内存中常驻的仍是压缩编码
+                candidates = np.sort(top_k_indices(quantized.maxsim_scores(query), args.rerank_k))
+                return candidates[top_k_indices(maxsim_scores(query, embeddings[candidates]), top_k)]
+
+            variants = [(name, quantized.nbytes, search),
+                        (f"{name}+rerank{args.rerank_k}", quantized.nbytes, rerank_search)]
+
+        for variant, nbytes, search in variants:
+            recall = np.mean([
+                len(exact[i] & set(search(q, image_embeddings, args.top_k))) / args.top_k
+                for i, q in enumerate(queries)
+            ])
+            qps = queries_per_second(search, queries, image_embeddings, args.top_k)
+            print(f"{variant:>16} {nbytes / 2**20:>9.1f} {image_embeddings.nbytes / nbytes:>6.1f}x "
+                  f"{recall:>10.3f} {qps:>8.2f}")
+
+
+def bench_batch(args):
+    image_embeddings = synthetic_embeddings(args.size, IMAGE_TOKENS)
+    queries = list(synthetic_embeddings(max(args.batch_sizes), QUERY_TOKENS, seed=1))
+
+    print(f"{'batch':>6} {'single q/s':>11} {'batched q/s':>12} {'speedup':>8}")
+    for batch_size in args.batch_sizes:
+        batch = queries[:batch_size]
+        assert np.allclose(maxsim_scores_batch(batch, image_embeddings)[-1],
+                           maxsim_scores(batch[-1], image_embeddings), atol=1e-4)
+
+        start = time.perf_counter()
+        for query in batch:
+            maxsim_scores(query, image_embeddings)
+        single_qps = batch_size / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        maxsim_scores_batch(batch, image_embeddings)
+        batched_qps = batch_size / (time.perf_counter() - start)
+        print(f"{batch_size:>6} {single_qps:>11.2f} {batched_qps:>12.2f} {batched_qps / single_qps:>7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark late-interaction retrieval")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scoring = subparsers.add_parser("scoring", help="Per-image loop vs batched MaxSim")
+    scoring.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    scoring.add_argument("--queries", type=int, default=20, help="Number of queries per size")
+    scoring.add_argument("--top-k", type=int, default=10)
+    scoring.add_argument("--loop-limit", type=int, default=10000,
+                         help="Skip the per-image loop baseline above this index size")
+    scoring.set_defaults(func=bench_scoring)
+
+    ann = subparsers.add_parser("ann", help="Two-stage IVF + MaxSim recall and throughput")
+    ann.add_argument("--size", type=int, default=50000)
+    ann.add_argument("--queries", type=int, default=50)
+    ann.add_argument("--top-k", type=int, default=10)
+    ann.add_argument("--vectors-per-image", type=int, default=4, help="1 = mean pooling")
+    ann.add_argument("--nlist", type=int, default=None, help="Number of IVF lists (default 4*sqrt(N*k))")
+    ann.add_argument("--nprobe", type=int, default=4, help="Lists probed per query token")
+    ann.add_argument("--candidate-k", type=int, nargs="+", default=[50, 100, 200, 500])
+    ann.set_defaults(func=bench_ann)
+
+    quant = subparsers.add_parser("quant", help="Index size and recall of int8 / PQ compressed embeddings")
+    quant.add_argument("--size", type=int, default=5000)
+    quant.add_argument("--queries", type=int, default=50)
+    quant.add_argument("--top-k", type=int, default=10)
+    quant.add_argument("--subspaces", type=int, nargs="+", default=[32, 16],
+                       help="PQ subspaces (bytes per token)")
+    quant.add_argument("--rerank-k", type=int, default=100,
+                       help="Rows re-scored with float32 embeddings after compressed scoring")
+    quant.set_defaults(func=bench_quant)
+
+    batch = subparsers.add_parser("batch", help="Per-query vs multi-query matrix scoring")
+    batch.add_argument("--size", type=int, default=20000)
+    batch.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16])
+    batch.set_defaults(func=bench_batch)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Scheduler simulation: interactive chat next to a PDF conversion on one fake local inference server
+At t=0 a conversion submits its VLM OCR pages (batch, two documents) and picture descriptions
+(background); meanwhile a user sends a chat message every --chat-interval seconds. The fake server
+runs --server-slots generations in parallel and queues the rest in arrival order, like LM Studio.
+Reports chat time-to-first-token and when the background work finished, without and with the scheduler.
+
+python benchmark_scheduler.py --pages 20 --pictures 30 --chats 20 --server-slots 4
+"""
+
+import argparse
+import asyncio
+import time
+
+from model_scheduler import Scheduler
+
+
+class FakeServer:
+    def __init__(self, slots: int, token_delay: float):
+        self.slots = asyncio.Semaphore(slots)
+        self.token_delay = token_delay
+
+    async def generate(self, prefill: float, tokens: int, first_token: asyncio.Future = None):
+        async with self.slots:
+            await asyncio.sleep(prefill)
+            for i in range(tokens):
+                await asyncio.sleep(self.token_delay)
+                if i == 0 and first_token is not None:
+                    first_token.set_result(time.perf_counter())
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run(args, scheduled: bool) -> dict:
+    server = FakeServer(args.server_slots, args.token_delay)
+    limits = {priority: limit for priority, limit in (("background", args.background_limit),
+                                                      ("batch", args.batch_limit)) if limit is not None}
+    scheduler = Scheduler(slots=args.server_slots, reserved=args.reserved, limits=limits)
+    start = time.perf_counter()
+    finished = {}
+
+    async def request(priority: str, tenant: str, prefill: float, tokens: int, first_token=None):
+        release = await scheduler.acquire(priority, tenant) if scheduled else None
+        try:
+            await server.generate(prefill, tokens, first_token)
+        finally:
+            if release is not None:
+                release()
+        finished[priority] = time.perf_counter() - start
+
+    ttft = []
+
+    async def chat(at: float):
+        await asyncio.sleep(at)
+        sent = time.perf_counter()
+        first_token = asyncio.get_running_loop().create_future()
+        await request("interactive", "", args.chat_prefill, args.chat_tokens, first_token)
+        ttft.append(first_token.result() - sent)
+
+    jobs = []
+    for doc in ("a.pdf", "b.pdf"):
+        jobs += [request("batch", doc, args.page_prefill, args.page_tokens) for _ in range(args.pages)]
+    jobs += [request("background", "a.pdf", args.picture_prefill, args.picture_tokens) for _ in range(args.pictures)]
+    jobs += [chat(0.2 + i * args.chat_interval) for i in range(args.chats)]
+    await asyncio.gather(*jobs)
+    return {
+        "ttft_p50": percentile(ttft, 0.5),
+        "ttft_p95": percentile(ttft, 0.95),
+        "ttft_max": max(ttft),
+        "background_done": finished["background"],
+        "batch_done": finished["batch"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the model request scheduler")
+    parser.add_argument("--pages", type=int, default=20, help="OCR pages per document (two documents)")
+    parser.add_argument("--pictures", type=int, default=30, help="Picture descriptions")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--chat-interval", type=float, default=0.5)
+    parser.add_argument("--server-slots", type=int, default=4)
+    parser.add_argument("--reserved", type=int, default=1)
+    parser.add_argument("--background-limit", type=int, default=None, help="Default: all unreserved slots")
+    parser.add_argument("--batch-limit", type=int, default=None, help="Default: all unreserved slots")
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--page-prefill", type=float, default=0.3)
+    parser.add_argument("--page-tokens", type=int, default=150)
+    parser.add_argument("--picture-prefill", type=float, default=0.2)
+    parser.add_argument("--picture-tokens", type=int, default=60)
+    parser.add_argument("--chat-prefill", type=float, default=0.1)
+    parser.add_argument("--chat-tokens", type=int, default=80)
+    args = parser.parse_args()
+
+    print(f"{2 * args.pages} OCR pages + {args.pictures} pictures at t=0, {args.chats} chats every "
+          f"{args.chat_interval:.1f}s, server {args.server_slots} slots")
+    print(f"{'scheduler':>10} {'chat TTFT p50':>14} {'p95':>7} {'max':>7} {'pictures done s':>16} {'pages done s':>13}")
+    for scheduled in (False, True):
+        r = asyncio.run(run(args, scheduled))
+        print(f"{'on' if scheduled else 'off':>10} {r['ttft_p50']:>14.2f} {r['ttft_p95']:>7.2f} {r['ttft_max']:>7.2f} "
+              f"{r['background_done']:>16.1f} {r['batch_done']:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Single-flight benchmark: duplicate-heavy load against a fake local inference server
+Requests pick their prompt from a small set (several UI panels asking for the same picture
+description or tags at once) and arrive over a short window. The fake server has a fixed number of
+generation slots, a prefill delay and a per-token delay, like LM Studio with parallel requests.
+Reports upstream calls, completion latency and wall time with and without single-flight.
+
+python benchmark_single_flight.py --requests 200 --prompts 10 --window 1.0 --slots 4
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from model_router import Backend, ModelRouter
+
+
+class FakeServer:
+    def __init__(self, slots: int, prefill: float, tokens: int, token_delay: float):
+        self.slots = asyncio.Semaphore(slots)
+        self.prefill = prefill
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        return FakeStream(self)
+
+    def client(self):
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self.create)))
+
+
+class FakeStream:
+    def __init__(self, server: FakeServer):
+        self.server = server
+
+    def __aiter__(self):
+        return self._generate()
+
+    async def _generate(self):
+        async with self.server.slots:
+            await asyncio.sleep(self.server.prefill)
+            for i in range(self.server.tokens):
+                await asyncio.sleep(self.server.token_delay)
+                yield i
+
+    async def close(self):
+        pass
+
+
+async def run(args, single_flight: bool) -> dict:
+    server = FakeServer(args.slots, args.prefill, args.tokens, args.token_delay)
+    router = ModelRouter([Backend("fake", "http://127.0.0.1/v1", client=server.client())], single_flight=single_flight)
+    rng = random.Random(0)
+    arrivals = sorted(rng.uniform(0, args.window) for _ in range(args.requests))
+    prompts = [rng.randrange(args.prompts) for _ in range(args.requests)]
+    latencies = []
+
+    async def request(at: float, prompt: int):
+        await asyncio.sleep(at)
+        start = time.perf_counter()
+        stream = await router.chat_completion_stream(
+            model="fake", messages=[{"role": "user", "content": f"Describe picture {prompt}"}])
+        chunks = [chunk async for chunk in stream]
+        assert len(chunks) == args.tokens
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request(at, prompt) for at, prompt in zip(arrivals, prompts)))
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "calls": server.calls,
+        "mean": sum(latencies) / len(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "wall": wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark single-flight request coalescing")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--prompts", type=int, default=10, help="Distinct prompts the requests are drawn from")
+    parser.add_argument("--window", type=float, default=1.0, help="Seconds over which the requests arrive")
+    parser.add_argument("--slots", type=int, default=4, help="Parallel generations of the fake server")
+    parser.add_argument("--prefill", type=float, default=0.2)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests over {args.prompts} prompts in {args.window:.1f}s, "
+          f"server {args.slots} slots, {args.prefill:.2f}s prefill + {args.tokens} x {args.token_delay * 1000:.0f} ms")
+    print(f"{'single-flight':>14} {'upstream calls':>15} {'mean s':>8} {'p95 s':>8} {'wall s':>8}")
+    for single_flight in (False, True):
+        r = asyncio.run(run(args, single_flight))
+        print(f"{'on' if single_flight else 'off':>14} {r['calls']:>15} {r['mean']:>8.2f} {r['p95']:>8.2f} {r['wall']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
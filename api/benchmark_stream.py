@@ -0,0 +1,73 @@
+"""
+Data stream encoding benchmark: per-token str.format/json.dumps lines (old stream_text) vs the
+orjson encoder with frame coalescing. Reports encoded tokens/sec and writes per response; each
+yielded chunk becomes one send() on the socket, so writes approximate syscalls per response.
+Write counts are measured with a paced upstream (asyncio.sleep between deltas) at several token rates.
+
+python benchmark_stream.py --tokens 2000 --paced-tokens 200 --rates 50 200 1000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from stream_protocol import FRAME_MAX_BYTES, FRAME_MAX_DELAY, coalesce, finish_part, text_part
+
+
+def legacy_parts(deltas):
+    for delta in deltas:
+        yield '0:{text}\n'.format(text=json.dumps(delta))
+    yield 'd:{{"finishReason":"{reason}","usage":{{"promptTokens":{prompt},"completionTokens":{completion}}}}}\n'.format(
+        reason="stop", prompt=100, completion=len(deltas))
+
+
+async def encoded_parts(deltas, tokens_per_second: float = None):
+    for delta in deltas:
+        if tokens_per_second:
+            await asyncio.sleep(1 / tokens_per_second)
+        yield text_part(delta)
+    yield finish_part("stop", 100, len(deltas))
+
+
+def coalesced_frames(deltas, tokens_per_second: float = None) -> list:
+    async def collect():
+        return [frame async for frame in coalesce(encoded_parts(deltas, tokens_per_second))]
+    return asyncio.run(collect())
+
+
+def tokens_per_second(encode, deltas, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _ in encode(deltas):
+            pass
+    return repeat * len(deltas) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark data stream protocol encoding")
+    parser.add_argument("--tokens", type=int, default=2000, help="Deltas per response")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--paced-tokens", type=int, default=200, help="Deltas per paced response")
+    parser.add_argument("--rates", type=float, nargs="+", default=[50, 200, 1000],
+                        help="Paced upstream tokens/sec for the write count")
+    args = parser.parse_args()
+
+    words = ["数据", " stream", " \"quoted\"", " token", "\n", " 模型", " tool", "s"]
+    deltas = [words[i % len(words)] for i in range(args.tokens)]
+
+    legacy = tokens_per_second(lambda d: (p.encode() for p in legacy_parts(d)), deltas, args.repeat)
+    encoded = tokens_per_second(coalesced_frames, deltas, args.repeat)
+    print(f"encode tokens/s: legacy {legacy:,.0f}, encoder+coalescing {encoded:,.0f} ({encoded / legacy:.1f}x)")
+
+    print(f"{'upstream tok/s':>14} {'legacy writes':>14} {'coalesced writes':>17} "
+          f"(budget {FRAME_MAX_DELAY * 1000:.0f} ms / {FRAME_MAX_BYTES} B)")
+    paced = deltas[:args.paced_tokens]
+    legacy_writes = sum(1 for _ in legacy_parts(paced))
+    for rate in args.rates:
+        frames = len(coalesced_frames(paced, rate))
+        print(f"{rate:>14.0f} {legacy_writes:>14} {frames:>17}")
+
+
+if __name__ == "__main__":
+    main()
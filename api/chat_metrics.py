@@ -0,0 +1,217 @@
+"""
+/api/chat instrumentation: per-request spans and Prometheus histograms
+A RequestTrace follows one response: message conversion, upstream connect per model call, time to
+first token, inter-token gaps, tool latency and the token usage reported by the upstream. Finished
+traces feed the histograms rendered by GET /metrics and, with CHAT_TRACE_FILE set, are appended to a
+JSONL file. The token loop only takes one perf_counter() reading and one bucket lookup per chunk.
+"""
+
+import bisect
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+INTER_TOKEN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.25, 0.5, 1.0)
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536, 262144)
+
+TRACE_FILE = os.environ.get("CHAT_TRACE_FILE")
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = labelnames
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            suffix = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return "\n".join(lines)
+
+
+REQUESTS = Counter("chat_requests_total", "Finished /api/chat responses", ("status",))
+REQUEST_SECONDS = Histogram("chat_request_seconds", "Whole /api/chat response", LATENCY_BUCKETS)
+CONVERT_SECONDS = Histogram("chat_convert_seconds", "Client to OpenAI message conversion", LATENCY_BUCKETS)
+CONNECT_SECONDS = Histogram("chat_upstream_connect_seconds",
+                            "Upstream request until the stream is open, per model call", LATENCY_BUCKETS)
+TTFT_SECONDS = Histogram("chat_time_to_first_token_seconds", "Request start until the first streamed token",
+                         LATENCY_BUCKETS)
+INTER_TOKEN_SECONDS = Histogram("chat_inter_token_seconds", "Gap between streamed chunks of one model call",
+                                INTER_TOKEN_BUCKETS)
+TOKENS_PER_SECOND = Histogram("chat_tokens_per_second", "Completion tokens per second after the first token",
+                              RATE_BUCKETS)
+TOOL_SECONDS = Histogram("chat_tool_seconds", "Tool call latency", LATENCY_BUCKETS, ("tool",))
+PROMPT_TOKENS = Histogram("chat_prompt_tokens", "Prompt tokens per response (usage chunk)", TOKEN_BUCKETS)
+COMPLETION_TOKENS = Histogram("chat_completion_tokens", "Completion tokens per response (usage chunk)",
+                              TOKEN_BUCKETS)
+
+METRICS = [REQUESTS, REQUEST_SECONDS, CONVERT_SECONDS, CONNECT_SECONDS, TTFT_SECONDS, INTER_TOKEN_SECONDS,
+           TOKENS_PER_SECOND, TOOL_SECONDS, PROMPT_TOKENS, COMPLETION_TOKENS]
+
+# Trace of the response being streamed; tool tasks inherit it from the stream_text context
+current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("current_trace", default=None)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in METRICS) + "\n"
+
+
+def observe_tool(name: str, seconds: float):
+    TOOL_SECONDS.observe(seconds, name)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.tools.append({"name": name, "seconds": seconds})
+
+
+class RequestTrace:
+    def __init__(self, protocol: str = "data"):
+        self.protocol = protocol
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans = {}
+        self.steps = []
+        self.tools = []
+        self.first_token = None
+        self.last_token = None
+        self.chunks = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.finished = False
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + time.perf_counter() - start
+
+    async def create(self, create_stream, messages: list):
+        """Open one model call through create_stream and watch its chunks"""
+        start = time.perf_counter()
+        stream = await create_stream(messages)
+        connect = time.perf_counter() - start
+        CONNECT_SECONDS.observe(connect)
+        self.steps.append({"connect": connect})
+        return self.watch(stream)
+
+    async def watch(self, stream):
+        """Pass chunks through, timing the ones that carry generated tokens and reading the usage chunk"""
+        observe_gap = INTER_TOKEN_SECONDS.observe
+        perf_counter = time.perf_counter
+        last = None
+        chunks = 0
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].finish_reason is None:
+                    now = perf_counter()
+                    if last is None:
+                        if self.first_token is None:
+                            self.first_token = now
+                            TTFT_SECONDS.observe(now - self.start)
+                    else:
+                        observe_gap(now - last)
+                    last = now
+                    chunks += 1
+                elif getattr(chunk, "usage", None) is not None:
+                    self.prompt_tokens += chunk.usage.prompt_tokens
+                    self.completion_tokens += chunk.usage.completion_tokens
+                yield chunk
+        finally:
+            self.chunks += chunks
+            if last is not None:
+                self.last_token = last
+            # Stopped early (client disconnect): close the upstream stream now, not when it is collected
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def tokens_per_second(self) -> Optional[float]:
+        """Decode rate: the tokens after the first one over the time since the first token arrived"""
+        # Without a usage chunk every chunk counts as one token
+        tokens = self.completion_tokens or self.chunks
+        if self.first_token is None or tokens < 2 or self.last_token <= self.first_token:
+            return None
+        return (tokens - 1) / (self.last_token - self.first_token)
+
+    def finish(self, status: str = "completed"):
+        if self.finished:
+            return
+        self.finished = True
+        duration = time.perf_counter() - self.start
+        REQUESTS.inc(status)
+        REQUEST_SECONDS.observe(duration)
+        if "convert" in self.spans:
+            CONVERT_SECONDS.observe(self.spans["convert"])
+        tokens_per_second = self.tokens_per_second()
+        if tokens_per_second is not None:
+            TOKENS_PER_SECOND.observe(tokens_per_second)
+        if self.prompt_tokens or self.completion_tokens:
+            PROMPT_TOKENS.observe(self.prompt_tokens)
+            COMPLETION_TOKENS.observe(self.completion_tokens)
+
+        if TRACE_FILE:
+            record = {
+                "started_at": self.started_at,
+                "protocol": self.protocol,
+                "status": status,
+                "duration": duration,
+                "spans": self.spans,
+                "steps": self.steps,
+                "ttft": None if self.first_token is None else self.first_token - self.start,
+                "tools": self.tools,
+                "chunks": self.chunks,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "tokens_per_second": tokens_per_second,
+            }
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
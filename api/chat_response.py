@@ -0,0 +1,38 @@
+"""
+StreamingResponse for /api/chat that stops the answer as soon as the client goes away
+Starlette only notices a disconnect on the next send (ASGI 2.4) or cancels the sending task without
+closing the body iterator (ASGI < 2.4), which leaves the upstream completion streaming until the
+generator is garbage collected. Here the disconnect is watched for the whole response and the body
+iterator is always closed, which closes the upstream HTTP response within one chunk.
+"""
+
+import asyncio
+
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+class ChatStreamingResponse(StreamingResponse):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        stream = asyncio.ensure_future(self.stream_response(send))
+        disconnect = asyncio.ensure_future(self.listen_for_disconnect(receive))
+        try:
+            await asyncio.wait([stream, disconnect], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stream.cancel()
+            disconnect.cancel()
+            await asyncio.wait([stream, disconnect])
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+        if stream.cancelled():
+            return
+        error = stream.exception()
+        if isinstance(error, OSError):
+            raise ClientDisconnect()
+        if error is not None:
+            raise error
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,147 @@
+"""
+Upstream side of /api/chat: completions are streamed through the shared model router (pooled
+AsyncOpenAI clients per inference server) by the async stream_text generator, so open streams wait
+on sockets instead of holding threadpool workers
+"""
+
+import asyncio
+import functools
+import os
+import time
+from contextlib import aclosing
+from typing import Callable
+
+from chat_metrics import RequestTrace, current_trace
+from model_router import router
+from response_cache import TTLCache, completion_key
+from stream_protocol import agent_stream_parts, aclose_stream, coalesce
+
+CHAT_MODEL = os.environ.get("CHAT_MODEL", "qwen/qwen3-30b-a3b-2507")
+
+# Model calls per response: tool results are fed back to the model server-side until it answers
+# without tools or this many calls were made
+MAX_STEPS = int(os.environ.get("CHAT_MAX_STEPS", "5"))
+
+# Opt-in (CHAT_CACHE=1): completions requested with temperature 0 are recorded and replayed
+# chunk by chunk for identical (model, messages, tools) requests
+completion_cache = TTLCache(
+    max_entries=int(os.environ.get("CHAT_CACHE_SIZE", "256")),
+    ttl=float(os.environ.get("CHAT_CACHE_TTL", "3600")),
+) if os.environ.get("CHAT_CACHE") == "1" else None
+
+TOOLS = [{
+    "type": "function",
+    "function": {
+        "name": "get_current_weather",
+        "description": "Get the current weather in a given location",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "location": {
+                    "type": "string",
+                    "description": "The city and state, e.g. San Francisco, CA",
+                },
+                "unit": {
+                    "type": "string",
+                    "enum": ["celsius", "fahrenheit"]},
+            },
+            "required": ["location", "unit"],
+        },
+    },
+}]
+
+
+async def _replay(chunks: list, start: float):
+    for chunk in chunks:
+        yield chunk
+    completion_cache.record_latency(True, time.perf_counter() - start)
+
+
+async def _record(stream, key: str, start: float):
+    chunks = []
+    async with aclosing(stream) as upstream:
+        async for chunk in upstream:
+            chunks.append(chunk)
+            yield chunk
+    # Only completions that streamed to the end are cached
+    completion_cache.set(key, chunks)
+    completion_cache.record_latency(False, time.perf_counter() - start)
+
+
+async def create_stream(messages: list, temperature: float = None):
+    cacheable = completion_cache is not None and temperature == 0
+    if cacheable:
+        start = time.perf_counter()
+        key = completion_key(CHAT_MODEL, messages, TOOLS, temperature)
+        chunks = completion_cache.get(key)
+        if chunks is not None:
+            return _replay(chunks, start)
+
+    stream = await router.chat_completion_stream(
+        messages=messages,
+        model=CHAT_MODEL,
+        # The final usage chunk carries prompt/completion tokens for the d: part and the metrics
+        stream_options={"include_usage": True},
+        tools=TOOLS,
+        **({} if temperature is None else {"temperature": temperature}),
+    )
+    return _record(stream, key, start) if cacheable else stream
+
+
+async def stream_text(messages: list, available_tools: dict, protocol: str = 'data', max_steps: int = MAX_STEPS,
+                      on_finish: Callable[[list], None] = None, temperature: float = None,
+                      trace: RequestTrace = None):
+    """Stream the answer in the AI SDK text or data protocol; on_finish receives the generated
+    OpenAI messages once the response completed, trace records the timings of the response"""
+    if trace is None:
+        trace = RequestTrace(protocol)
+    current_trace.set(trace)
+    status = "error"
+    try:
+        async with aclosing(_stream_text(messages, available_tools, protocol, max_steps, on_finish, temperature,
+                                         trace)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+        status = "completed"
+    except (GeneratorExit, asyncio.CancelledError):
+        # Client went away: Starlette cancels the response task or closes the generator
+        status = "disconnected"
+        raise
+    finally:
+        trace.finish(status)
+
+
+async def _stream_text(messages: list, available_tools: dict, protocol: str, max_steps: int,
+                       on_finish: Callable[[list], None], temperature: float, trace: RequestTrace):
+    new_messages = []
+    create = functools.partial(trace.create, functools.partial(create_stream, temperature=temperature))
+
+    # When protocol is set to "text", you will send a stream of plain text chunks
+    # https://ai-sdk.dev/docs/ai-sdk-ui/stream-protocol#text-stream-protocol
+
+    if (protocol == 'text'):
+        stream = await create(messages)
+        text = []
+        try:
+            async for chunk in stream:
+                for choice in chunk.choices:
+                    if choice.finish_reason == "stop":
+                        break
+                    elif choice.delta.content:
+                        text.append(choice.delta.content)
+                        yield choice.delta.content
+        finally:
+            await aclose_stream(stream)
+        new_messages.append({"role": "assistant", "content": "".join(text)})
+
+    # When protocol is set to "data", you will send a stream data part chunks
+    # https://ai-sdk.dev/docs/ai-sdk-ui/stream-protocol#data-stream-protocol
+
+    elif (protocol == 'data'):
+        parts = agent_stream_parts(create, messages, available_tools, max_steps, new_messages)
+        async with aclosing(coalesce(parts)) as frames:
+            async for frame in frames:
+                yield frame
+
+    if on_finish is not None:
+        on_finish(new_messages)
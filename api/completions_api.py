@@ -0,0 +1,48 @@
+"""
+Scheduled OpenAI-compatible passthrough to the model router, mounted on both app.py (the desktop
+sidecar on port 60316) and index.py, so whichever process holds the port serves it
+    POST /v1/chat/completions   non-streaming completion that waits for a slot of its X-Priority class
+    GET  /api/models            backends, single-flight counters and scheduler queues
+The process's model_router.router owns the one Scheduler: /api/chat streams (interactive), picture
+descriptions of /documents/convert (background) and docling VLM pages (batch) all queue there.
+"""
+
+import openai
+from fastapi import APIRouter, Body, Header, HTTPException
+from fastapi.responses import JSONResponse
+
+from model_router import router as model_router
+
+router = APIRouter()
+
+
+@router.get("/api/models")
+async def model_backends():
+    """Inference servers behind /api/chat: health, outstanding streams, the models they serve, how many
+    identical requests shared an upstream stream and the scheduler queues"""
+    return {
+        "backends": model_router.status(),
+        "single_flight": model_router.single_flight_stats(),
+        "scheduler": model_router.scheduler.stats() if model_router.scheduler is not None else None,
+    }
+
+
+@router.post("/v1/chat/completions")
+async def scheduled_chat_completions(body: dict = Body(...), x_priority: str = Header("batch"),
+                                     x_tenant: str = Header("")):
+    """OpenAI-compatible passthrough for docling (PictureDescriptionApiOptions / ApiVlmOptions url)
+
+    The request waits for a slot of its X-Priority class (background, batch), so document conversions
+    only use the capacity /api/chat leaves free. X-Tenant (e.g. the document name) makes concurrent
+    conversions take turns.
+    """
+    if body.get("stream"):
+        raise HTTPException(status_code=400, detail="Streaming is only available through /api/chat")
+    try:
+        return await model_router.chat_completion(body, priority=x_priority, tenant=x_tenant)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except openai.APIStatusError as e:
+        return JSONResponse(e.body if e.body is not None else {"error": str(e)}, status_code=e.status_code)
+    except openai.APIConnectionError as e:
+        raise HTTPException(status_code=502, detail=str(e))
@@ -0,0 +1,91 @@
+"""
+Server-side /api/chat history keyed by chat id
+Keeps the OpenAI messages exactly as they were sent upstream (including the assistant messages and
+tool results produced by the tool loop), so every turn's prompt is the previous prompt plus the
+new messages, byte for byte, and the local inference server can reuse its KV/prompt cache.
+Client messages are converted once, when they first arrive.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+
+class Conversation:
+    def __init__(self):
+        self.messages: List[dict] = []
+        # Number of client-side messages (user + assistant) already represented in self.messages
+        self.client_count = 0
+        # Position and fingerprint of the last client message converted here; committed responses have
+        # no client-side form yet, so an edit is detected on the last message the client itself sent
+        self.last_client: Optional[tuple] = None
+
+
+def _plain(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if hasattr(value, "__dict__"):
+        return vars(value)
+    return str(value)
+
+
+def fingerprint(client_message) -> str:
+    """Hash of a client message (pydantic model, dict or plain object)"""
+    encoded = json.dumps(client_message, sort_keys=True, default=_plain)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class ConversationStore:
+    def __init__(self, max_conversations: int = 256):
+        self.max_conversations = max_conversations
+        self._conversations: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def get(self, chat_id: str) -> Conversation:
+        conversation = self._conversations.pop(chat_id, None) or Conversation()
+        self._conversations[chat_id] = conversation
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+        return conversation
+
+    def sync(self, chat_id: str, client_messages: list, convert: Callable[[list], list]) -> list:
+        """Full history from the client: only messages past the stored ones are converted
+
+        A shorter history than stored (regenerate, edit of an earlier message) or a changed last client
+        message (edit that keeps the length) resets the conversation. An empty history leaves it as is.
+        """
+        conversation = self.get(chat_id)
+        if not client_messages:
+            return list(conversation.messages)
+        if len(client_messages) < conversation.client_count or not self._unchanged(conversation, client_messages):
+            conversation.messages, conversation.client_count, conversation.last_client = [], 0, None
+        new_messages = client_messages[conversation.client_count:]
+        if new_messages:
+            conversation.messages.extend(convert(new_messages))
+            conversation.client_count = len(client_messages)
+            conversation.last_client = (len(client_messages) - 1, fingerprint(client_messages[-1]))
+        return list(conversation.messages)
+
+    @staticmethod
+    def _unchanged(conversation: Conversation, client_messages: list) -> bool:
+        if conversation.last_client is None:
+            return True
+        index, digest = conversation.last_client
+        return fingerprint(client_messages[index]) == digest
+
+    def append(self, chat_id: str, client_message, convert: Callable[[list], list]) -> list:
+        """Only the new message from the client (useChat experimental_prepareRequestBody)"""
+        conversation = self.get(chat_id)
+        conversation.messages.extend(convert([client_message]))
+        conversation.last_client = (conversation.client_count, fingerprint(client_message))
+        conversation.client_count += 1
+        return list(conversation.messages)
+
+    def commit(self, chat_id: str, response_messages: list):
+        """Store the messages generated for a completed response; the client shows them as one assistant message"""
+        conversation = self.get(chat_id)
+        conversation.messages.extend(response_messages)
+        conversation.client_count += 1
@@ -0,0 +1,244 @@
+"""
+PDF 转换 HTTP 接口，挂载在 app.py 上
+    POST /documents/convert   请求体是 PDF 文件本身，按页流式返回 NDJSON 事件：
+                              {"type": "start", "pages": 12}
+                              {"type": "page", "page_no": 1, "markdown": "...", "figures": [...]}
+                              {"type": "progress", "pages_done": 1, "pages": 12}
+                              {"type": "done", "seconds": 8.1} 或 {"type": "error", "detail": "..."}
+    GET  /documents/status    转换进程池的状态
+设置了 PICTURE_DESCRIPTION_MODEL 时，每页的图片由 picture_descriptions.PictureDescriber 并发请求描述
+（在进程内经模型路由器的调度器，background 优先级），描述写进该页 figures 的 descriptions；等描述的同时后面的页照常转换。
+进程池和模型在第一次转换请求时才启动（DOCUMENT_WORKERS 个进程，默认 2），只用图片检索的用户不为它付出内存。
+转换在 docling_conversion.ParallelConverter 的进程池里按页段进行（没命中缓存的连续页合成最多 pages_per_chunk
+页的页段），每个页段一完成就逐页输出；转换过的页拆开存在 conversion_cache 的单页缓存里，同一文档（或只改了几页的
+文档）再次上传时命中的页立即输出。
+同时在转换或等待输出的页有上限，页面位图不生成，图片在输出后随页一起释放，内存占用与文档页数无关
+"""
+
+import asyncio
+import os
+from collections import deque
+import shutil
+import tempfile
+import time
+
+import orjson
+from fastapi import APIRouter, HTTPException, Query, Request
+
+from chat_response import ChatStreamingResponse
+
+# 每个进程各自加载版面和表格模型
+DOCUMENT_WORKERS = int(os.environ.get("DOCUMENT_WORKERS", "2"))
+# 等图片描述时最多积压几页（它们的描述请求同时进行），积压满了才等最前面的那页
+DESCRIBE_AHEAD = int(os.environ.get("DOCUMENT_DESCRIBE_AHEAD", "4"))
+
+
+def page_events(doc, first_figure: int, include_images: bool):
+    """一页或一个页段的 DoclingDocument 里每页的 Markdown 和图片信息"""
+    from docling_core.types.doc import ImageRefMode
+
+    figure_no = first_figure
+    for page_no in sorted(doc.pages):
+        figures = []
+        for picture in doc.pictures:
+            if not picture.prov or picture.prov[0].page_no != page_no:
+                continue
+            figure_no += 1
+            figure = {
+                "figure_no": figure_no,
+                "caption": picture.caption_text(doc),
+                "bbox": list(picture.prov[0].bbox.as_tuple()),
+                "descriptions": [annotation.text for annotation in picture.annotations if hasattr(annotation, "text")],
+            }
+            if picture.image is not None:
+                figure["size"] = [picture.image.size.width, picture.image.size.height]
+                if include_images:
+                    figure["image"] = str(picture.image.uri)
+            figures.append(figure)
+        markdown = doc.export_to_markdown(page_no=page_no, image_mode=ImageRefMode.PLACEHOLDER,
+                                          image_placeholder="<!-- image -->")
+        yield {"type": "page", "page_no": page_no, "markdown": markdown, "figures": figures}
+
+
+class DocumentConversionService:
+    def __init__(self, workers: int = DOCUMENT_WORKERS):
+        self.workers = workers
+        self.state = "not_loaded"  # not_loaded / loading / ready / error
+        self.error = None
+        self.converter = None
+        self.cache = None
+        self.describer = None
+        self.active = 0
+        self._start_lock = asyncio.Lock()
+
+    async def ensure_started(self):
+        """第一次调用时在线程里启动进程池并加载模型，并发的请求一起等它；启动失败后一直返回 503"""
+        if self.state != "ready":
+            async with self._start_lock:
+                if self.state == "not_loaded":
+                    self.state = "loading"
+                    await asyncio.to_thread(self._load)
+        self._require_converter()
+
+    def _load(self):
+        try:
+            # docling 是可选依赖，延迟导入，未安装时 app.py 的其它接口照常工作
+            from docling.datamodel.pipeline_options import PdfPipelineOptions
+            from conversion_cache import ConversionCache
+            from docling_conversion import ParallelConverter
+            from picture_descriptions import PICTURE_DESCRIPTION_MODEL, PictureDescriber
+
+            pipeline_options = PdfPipelineOptions()
+            pipeline_options.generate_page_images = False
+            pipeline_options.generate_picture_images = True
+            converter = ParallelConverter(pipeline_options, workers=self.workers)
+            converter.start()
+            self.cache = ConversionCache()
+            if PICTURE_DESCRIPTION_MODEL:
+                self.describer = PictureDescriber(PICTURE_DESCRIPTION_MODEL,
+                                                  params=dict(temperature=0.2, max_completion_tokens=250))
+            self.converter = converter
+            self.state = "ready"
+        except Exception as e:
+            print(f"Error starting document converter: {e}")
+            self.error = str(e)
+            self.state = "error"
+
+    async def aclose(self):
+        if self.converter is not None:
+            self.converter.close()
+        if self.describer is not None:
+            await self.describer.aclose()
+
+    def _require_converter(self):
+        if self.state != "ready":
+            detail = f"Document converter is {self.state}"
+            if self.error:
+                detail += f": {self.error}"
+            raise HTTPException(status_code=503, detail=detail)
+
+    async def convert_events(self, path: str, include_images: bool):
+        """NDJSON 行的异步生成器；转换是阻塞的，每一步在线程里执行
+
+        客户端断开时 ChatStreamingResponse 会关闭这个生成器：正在转换的那一步结束后关闭转换
+        （取消还没开始的页），然后删除临时文件
+        """
+        events = self._events(path, include_images, asyncio.get_running_loop(), tenant=os.path.basename(path))
+        step = None
+
+        def cleanup(_=None):
+            events.close()
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+        self.active += 1
+        try:
+            while True:
+                step = asyncio.ensure_future(asyncio.to_thread(next, events, None))
+                # shield：被取消时这一步仍在线程里跑完，不能在它执行时关闭生成器
+                event = await asyncio.shield(step)
+                if event is None:
+                    break
+                yield orjson.dumps(event) + b"\n"
+        finally:
+            self.active -= 1
+            if step is not None and not step.done():
+                step.add_done_callback(cleanup)
+            else:
+                cleanup()
+
+    def _events(self, path: str, include_images: bool, loop: asyncio.AbstractEventLoop, tenant: str = ""):
+        """在线程里运行；图片描述请求作为协程提交到 loop 上并发执行"""
+        from docling_core.types.doc import DoclingDocument
+        from pdf_pages import page_count
+        from picture_descriptions import annotate, picture_images
+
+        start = time.perf_counter()
+        pages_done = 0
+        figures = 0
+        # 已转换、等待输出的页：(文档, 图片, 描述请求或 None)
+        ahead = deque()
+
+        def emit(doc, pictures, described):
+            nonlocal pages_done, figures
+            if described is not None:
+                try:
+                    annotate(pictures, described.result(), self.describer.model)
+                except Exception as e:
+                    print(f"Error describing pictures of {path}: {e}")
+            for event in page_events(doc, figures, include_images):
+                figures += len(event["figures"])
+                pages_done += 1
+                yield event
+                yield {"type": "progress", "pages_done": pages_done, "pages": pages}
+
+        try:
+            pages = page_count(path)
+            yield {"type": "start", "pages": pages}
+            converted = self.cache.iter_pages(self.converter, path)
+            try:
+                for _, part in converted:
+                    doc = DoclingDocument.model_validate(part)
+                    # 这一页的 dict 到这里就不再被引用，文档（含图片）在输出后释放
+                    del part
+                    pictures, described = [], None
+                    if self.describer is not None:
+                        pictures, images = picture_images(doc)
+                        if images:
+                            described = asyncio.run_coroutine_threadsafe(
+                                self.describer.describe_images(images, tenant=tenant), loop)
+                    ahead.append((doc, pictures, described))
+                    # 描述已完成（或不需要描述）的页立即输出，其余的最多积压 DESCRIBE_AHEAD 页
+                    while ahead and (ahead[0][2] is None or ahead[0][2].done() or len(ahead) > DESCRIBE_AHEAD):
+                        yield from emit(*ahead.popleft())
+                while ahead:
+                    yield from emit(*ahead.popleft())
+            finally:
+                # 提前结束时取消还没转换的页和还在进行的描述请求
+                converted.close()
+                for _, _, described in ahead:
+                    if described is not None:
+                        described.cancel()
+            yield {"type": "done", "seconds": round(time.perf_counter() - start, 3)}
+        except Exception as e:
+            print(f"Error converting {path}: {e}")
+            yield {"type": "error", "detail": str(e)}
+
+    def status(self) -> dict:
+        converter = self.converter
+        return {
+            "state": self.state,
+            "error": self.error,
+            "workers": converter.workers if converter is not None else self.workers,
+            "active": self.active,
+            "picture_descriptions": ({"model": self.describer.model, **self.describer.stats}
+                                     if self.describer is not None else None),
+        }
+
+
+service = DocumentConversionService()
+router = APIRouter(prefix="/documents")
+
+
+@router.post("/convert")
+async def convert_document(request: Request, filename: str = Query("document.pdf"),
+                           include_images: bool = Query(False, description="Include figure images as data URIs")):
+    await service.ensure_started()
+    # 上传内容边收边写到临时文件，不整个读进内存
+    tmp_dir = tempfile.mkdtemp(prefix="document-")
+    path = os.path.join(tmp_dir, os.path.basename(filename) or "document.pdf")
+    try:
+        with open(path, "wb") as f:
+            async for chunk in request.stream():
+                f.write(chunk)
+        if os.path.getsize(path) == 0:
+            raise HTTPException(status_code=400, detail="Empty request body, expected a PDF")
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    # 客户端断开时立即关闭事件生成器（停止转换、删除临时文件），而不是等垃圾回收
+    return ChatStreamingResponse(service.convert_events(path, include_images), media_type="application/x-ndjson")
+
+
+@router.get("/status")
+def document_status():
+    return service.status()
@@ -0,0 +1,156 @@
+"""
+按内容寻址的 PDF 转换缓存
+    documents/<key>/document.json    整本文档的 DoclingDocument，图片作为引用存在旁边的 artifacts 目录
+    pages/<key>.json                 单页的转换结果（export_to_dict），图片以 data URI 内嵌
+整本文档的 key 由 (文件内容 sha256, 转换选项 sha256, 模型 id) 决定，单页的 key 把文件哈希换成该页
+单独导出为 PDF 后的哈希（见 pdf_pages.page_hashes）。文档改了一页时整本缓存失效，但只有改动的那一页需要重新转换；
+页面的插入删除也不影响其它页命中（命中后按新位置改写页码）
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import Iterator, Optional, Tuple, Union
+
+import orjson
+from docling_core.types.doc import DoclingDocument, ImageRefMode
+
+from docling_conversion import ParallelConverter, merge_documents, split_pages
+from image_index_store import file_sha256
+from pdf_pages import page_hashes
+from response_cache import canonical_json
+
+_log = logging.getLogger(__name__)
+
+CONVERSION_CACHE_DIR = os.environ.get("CONVERSION_CACHE_DIR", "conversion_cache")
+DOCUMENT_FILE = "document.json"
+
+
+def default_model_id() -> str:
+    """版面、表格模型随 docling 版本发布，版本变化时缓存自然失效"""
+    try:
+        return f"docling-{version('docling')}"
+    except PackageNotFoundError:
+        return "docling"
+
+
+def options_hash(pipeline_options) -> str:
+    # 线程数等加速选项不影响转换结果；不能序列化成 JSON 的字段（如动态 prompt 函数）按 str() 参与哈希
+    options = pipeline_options.model_dump(exclude={"accelerator_options"})
+    return hashlib.sha256(canonical_json(options).encode()).hexdigest()
+
+
+def _renumber(node, page_no: int):
+    """单页文档里的页码（pages 的键、页面和 prov 中的 page_no）改成 page_no"""
+    if isinstance(node, dict):
+        return {key: page_no if key == "page_no" else _renumber(value, page_no) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_renumber(value, page_no) for value in node]
+    return node
+
+
+class ConversionCache:
+    def __init__(self, cache_dir: str = CONVERSION_CACHE_DIR, model_id: str = None):
+        self.cache_dir = Path(cache_dir)
+        self.model_id = model_id or default_model_id()
+        self.hits = {"documents": 0, "pages": 0}
+        self.misses = {"documents": 0, "pages": 0}
+
+    def _key(self, content_hash: str, pipeline_options) -> str:
+        return hashlib.sha256(canonical_json([content_hash, options_hash(pipeline_options), self.model_id]).encode()).hexdigest()
+
+    def document_key(self, source: Union[str, Path], pipeline_options) -> str:
+        return self._key(file_sha256(str(source)), pipeline_options)
+
+    def load_document(self, key: str) -> Optional[DoclingDocument]:
+        path = self.cache_dir / "documents" / key / DOCUMENT_FILE
+        if not path.exists():
+            self.misses["documents"] += 1
+            return None
+        self.hits["documents"] += 1
+        return DoclingDocument.load_from_json(path)
+
+    def save_document(self, key: str, doc: DoclingDocument):
+        final_dir = self.cache_dir / "documents" / key
+        tmp_dir = final_dir.with_name(f"{key}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        # 图片写成 artifacts/ 下的 PNG 文件，JSON 里只留相对路径，读取时不用解码 base64
+        doc.save_as_json(tmp_dir / DOCUMENT_FILE, artifacts_dir=Path("artifacts"), image_mode=ImageRefMode.REFERENCED)
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.rename(tmp_dir, final_dir)
+
+    def _page_path(self, key: str) -> Path:
+        return self.cache_dir / "pages" / f"{key}.json"
+
+    def has_page(self, key: str) -> bool:
+        if self._page_path(key).exists():
+            self.hits["pages"] += 1
+            return True
+        self.misses["pages"] += 1
+        return False
+
+    def load_page(self, key: str, page_no: int) -> dict:
+        """读取 has_page 命中的页，页码改写成它在当前文档里的位置"""
+        part = orjson.loads(self._page_path(key).read_bytes())
+        part["pages"] = {str(page_no): page for page in part.get("pages", {}).values()}
+        return _renumber(part, page_no)
+
+    def save_page(self, key: str, part: dict):
+        path = self._page_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_bytes(orjson.dumps(part))
+        os.replace(tmp_path, path)
+
+    def iter_pages(self, converter: ParallelConverter, source: Union[str, Path]) -> Iterator[Tuple[int, dict]]:
+        """按页序逐页产出 (页码, 单页文档 dict)：命中缓存的页轮到它时才读取，其余的页按页段转换，拆成单页写入缓存"""
+        page_keys = [self._key(page_hash, converter.pipeline_options) for page_hash in page_hashes(source)]
+        cached = [self.has_page(key) for key in page_keys]
+        _log.info(f"{source}: {sum(cached)} of {len(page_keys)} pages cached")
+
+        # 连续没命中的页合成页段，每段最多 pages_per_chunk 页，和整本转换时一样分摊每个页段的开销
+        ranges = []
+        for page_no, hit in enumerate(cached, start=1):
+            if hit:
+                continue
+            if ranges and ranges[-1][1] == page_no - 1 and page_no - ranges[-1][0] < converter.pages_per_chunk:
+                ranges[-1] = (ranges[-1][0], page_no)
+            else:
+                ranges.append((page_no, page_no))
+        converted = converter.iter_ranges(source, ranges)
+        try:
+            chunk_end, parts = 0, {}
+            for page_no, key in enumerate(page_keys, start=1):
+                if cached[page_no - 1]:
+                    yield page_no, self.load_page(key, page_no)
+                    continue
+                if page_no > chunk_end:
+                    (_, chunk_end), chunk = next(converted)
+                    parts = split_pages(chunk)
+                    del chunk
+                    for converted_page_no, part in parts.items():
+                        self.save_page(page_keys[converted_page_no - 1], part)
+                part = parts.pop(page_no, None)
+                if part is None:
+                    _log.warning(f"{source}: page {page_no} was not converted")
+                    continue
+                yield page_no, part
+        finally:
+            converted.close()
+
+    def convert(self, converter: ParallelConverter, source: Union[str, Path]) -> DoclingDocument:
+        """先查整本文档，再逐页查缓存，只转换没命中的页"""
+        document_key = self.document_key(source, converter.pipeline_options)
+        doc = self.load_document(document_key)
+        if doc is not None:
+            return doc
+        doc = merge_documents([part for _, part in self.iter_pages(converter, source)], name=Path(source).stem)
+        self.save_document(document_key, doc)
+        return doc
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
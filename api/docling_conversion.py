@@ -0,0 +1,278 @@
+"""
+按页分片的并行 PDF 转换
+把文档切成若干页段（PageRange），在进程池里并行转换，每个工作进程只创建一次 DocumentConverter
+（版面/表格模型常驻，后续页段和文档直接复用），最后按页序把各页段的 DoclingDocument 合并成一个
+给了 artifacts_dir 时，图片在工作进程里每转换完一个页段就由 ArtifactWriter 写盘并释放，
+文档里只留文件路径，主进程和工作进程都不会持有整本文档的位图
+
+    with ParallelConverter(pipeline_options, workers=4) as converter:
+        doc = converter.convert("manual.pdf")
+"""
+
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from docling.datamodel.base_models import InputFormat
+from docling.datamodel.pipeline_options import PdfPipelineOptions
+from docling.datamodel.settings import PageRange
+from docling.document_converter import DocumentConverter, PdfFormatOption
+from docling_core.types.doc import DoclingDocument, ImageRef, PictureItem, TableItem
+
+from artifact_writer import ArtifactWriter
+from pdf_pages import page_count
+
+DEFAULT_PAGES_PER_CHUNK = 8
+# 序列化文档里存放节点的列表，节点之间用 "#/texts/3" 这样的 JSON pointer 互相引用
+ITEM_LISTS = ("groups", "texts", "pictures", "tables", "key_value_items", "form_items")
+_REF = re.compile(r"^#/(\w+)/(\d+)$")
+
+# 工作进程内常驻的转换器和图片写入器，由 _init_worker 创建
+_converter: Optional[DocumentConverter] = None
+_writer: Optional[ArtifactWriter] = None
+
+
+def page_ranges(num_pages: int, pages_per_chunk: int) -> List[PageRange]:
+    """1 起始、两端包含的页段，和 converter.convert(page_range=...) 一致"""
+    if pages_per_chunk < 1:
+        raise ValueError(f"pages_per_chunk must be positive, got {pages_per_chunk}")
+    return [(start, min(start + pages_per_chunk - 1, num_pages))
+            for start in range(1, num_pages + 1, pages_per_chunk)]
+
+
+def build_converter(pipeline_options: PdfPipelineOptions, pipeline_cls=None) -> DocumentConverter:
+    format_option = PdfFormatOption(pipeline_options=pipeline_options)
+    if pipeline_cls is not None:
+        format_option = PdfFormatOption(pipeline_options=pipeline_options, pipeline_cls=pipeline_cls)
+    converter = DocumentConverter(format_options={InputFormat.PDF: format_option})
+    # 立即加载模型，而不是等到第一个页段
+    converter.initialize_pipeline(InputFormat.PDF)
+    return converter
+
+
+def export_images(doc: DoclingDocument, writer: ArtifactWriter) -> int:
+    """页面、图片和表格的位图交给 writer 写盘，ImageRef 换成指向文件的引用（不再持有位图和 data URI）"""
+    holders = list(doc.pages.values())
+    holders += [item for item, _ in doc.iterate_items() if isinstance(item, (PictureItem, TableItem))]
+    exported = 0
+    for holder in holders:
+        image = holder.image
+        if image is None or image.pil_image is None:
+            continue
+        path = writer.submit(image.pil_image)
+        holder.image = ImageRef(mimetype=writer.mimetype, dpi=image.dpi, size=image.size, uri=Path(path))
+        exported += 1
+    return exported
+
+
+def _init_worker(pipeline_options: PdfPipelineOptions, pipeline_cls, artifacts: Optional[dict]):
+    global _converter, _writer
+    _converter = build_converter(pipeline_options, pipeline_cls)
+    if artifacts is not None:
+        _writer = ArtifactWriter(**artifacts)
+
+
+def _worker_ready() -> int:
+    return os.getpid()
+
+
+def _convert_range(source: str, page_range: PageRange) -> dict:
+    result = _converter.convert(source, page_range=page_range)
+    if _writer is not None:
+        export_images(result.document, _writer)
+        # 页段返回时它的图片都已落盘
+        _writer.flush()
+    # dict 比 DoclingDocument 对象传回主进程更省事：图片已编码成 data URI，页面位图留在工作进程里释放
+    return result.document.export_to_dict()
+
+
+def _shift_refs(node, offsets: dict):
+    if isinstance(node, dict):
+        return {key: _shift_ref(value, offsets) if key in ("$ref", "self_ref") else _shift_refs(value, offsets)
+                for key, value in node.items()}
+    if isinstance(node, list):
+        return [_shift_refs(value, offsets) for value in node]
+    return node
+
+
+def _shift_ref(ref, offsets: dict):
+    match = _REF.match(ref) if isinstance(ref, str) else None
+    if match is None or match.group(1) not in offsets:
+        return ref
+    return f"#/{match.group(1)}/{int(match.group(2)) + offsets[match.group(1)]}"
+
+
+def merge_documents(parts: List[dict], name: Optional[str] = None) -> DoclingDocument:
+    """按页序合并各页段的文档（export_to_dict 的结果）
+
+    页段转换出的 page_no 已经是原文档中的页码，合并时只需要把后面页段的节点追加到列表末尾，
+    并把它们的引用下标平移
+    """
+    if not parts:
+        raise ValueError("Nothing to merge")
+    merged = parts[0]
+    for part in parts[1:]:
+        offsets = {key: len(merged.get(key, [])) for key in ITEM_LISTS}
+        part = _shift_refs(part, offsets)
+        for key in ITEM_LISTS:
+            merged.setdefault(key, []).extend(part.get(key, []))
+        for tree in ("body", "furniture"):
+            if tree in merged and tree in part:
+                merged[tree]["children"].extend(part[tree].get("children", []))
+        merged.setdefault("pages", {}).update(part.get("pages", {}))
+    if name is not None:
+        merged["name"] = name
+    return DoclingDocument.model_validate(merged)
+
+
+def _remap_refs(node, new_refs: dict):
+    """引用换成新下标；列表里引用别的页上节点的项（如跨页的 captions）去掉"""
+    if isinstance(node, dict):
+        return {key: new_refs.get(value, value) if key == "$ref" else _remap_refs(value, new_refs)
+                for key, value in node.items()}
+    if isinstance(node, list):
+        return [_remap_refs(value, new_refs) for value in node
+                if not (isinstance(value, dict) and "$ref" in value and value["$ref"] not in new_refs)]
+    return node
+
+
+def split_pages(part: dict) -> Dict[int, dict]:
+    """多页页段的文档（export_to_dict 的结果）拆成单页文档，merge_documents 的逆操作
+
+    节点按 prov 里的页码归页，没有 prov 的分组跟随它的第一个有页码的子孙；跨页分组在后面那页上的
+    子节点挂到那一页的根下，和单独转换那一页的结果一致
+    """
+    nodes = {f"#/{key}/{i}": item for key in ITEM_LISTS for i, item in enumerate(part.get(key, []))}
+    page_nos = sorted(int(page_no) for page_no in part.get("pages", {}))
+    if not page_nos:
+        return {}
+    pages = {}
+    for page_no in page_nos:
+        page = {key: value for key, value in part.items() if key not in ITEM_LISTS}
+        page.update({key: [] for key in ITEM_LISTS if key in part})
+        page["pages"] = {str(page_no): part["pages"][str(page_no)]}
+        for tree in ("body", "furniture"):
+            if tree in part:
+                page[tree] = dict(part[tree], children=[])
+        pages[page_no] = page
+
+    def first_page(ref: str) -> Optional[int]:
+        item = nodes[ref]
+        if item.get("prov"):
+            return item["prov"][0]["page_no"]
+        return next(filter(None, (first_page(child["$ref"]) for child in item.get("children", []))), None)
+
+    # 先按阅读顺序（先序）给每个节点分页，父节点总在子节点之前
+    placed = []
+
+    def place(ref: str, parent_ref: str, parent_page: int, root: str):
+        page_no = first_page(ref)
+        if page_no not in pages:
+            page_no = parent_page
+        placed.append((page_no, ref, parent_ref if page_no == parent_page else f"#/{root}"))
+        for child in nodes[ref].get("children", []):
+            place(child["$ref"], ref, page_no, root)
+
+    for root in ("body", "furniture"):
+        for child in part.get(root, {}).get("children", []):
+            place(child["$ref"], f"#/{root}", page_nos[0], root)
+
+    def resolve(page: dict, ref: str) -> dict:
+        match = _REF.match(ref)
+        return page[ref[2:]] if match is None else page[match.group(1)][int(match.group(2))]
+
+    # 新下标是节点在它那一页列表中的位置；所有下标定下来之后才能改写 captions 等前后引用
+    new_refs = {page_no: {"#/body": "#/body", "#/furniture": "#/furniture"} for page_no in page_nos}
+    for page_no, ref, _ in placed:
+        page, refs = pages[page_no], new_refs[page_no]
+        key = _REF.match(ref).group(1)
+        refs[ref] = f"#/{key}/{len(page[key])}"
+        page[key].append(None)
+    for page_no, ref, parent in placed:
+        page, refs = pages[page_no], new_refs[page_no]
+        item = _remap_refs(dict(nodes[ref], children=[]), refs)
+        item.update(self_ref=refs[ref], parent={"$ref": refs[parent]})
+        page[_REF.match(ref).group(1)][int(_REF.match(refs[ref]).group(2))] = item
+        resolve(page, refs[parent])["children"].append({"$ref": refs[ref]})
+    return pages
+
+
+class ParallelConverter:
+    def __init__(self, pipeline_options: PdfPipelineOptions, workers: int = None,
+                 pages_per_chunk: int = DEFAULT_PAGES_PER_CHUNK, pipeline_cls=None,
+                 artifacts_dir: str = None, image_format: str = "webp"):
+        self.workers = workers or os.cpu_count() or 1
+        self.pages_per_chunk = pages_per_chunk
+        self.pipeline_cls = pipeline_cls
+        # 每个工作进程自己的写入线程池；文件名是内容哈希，进程之间不会冲突
+        self.artifacts = None
+        if artifacts_dir is not None:
+            self.artifacts = {"output_dir": os.path.abspath(artifacts_dir), "image_format": image_format,
+                              "workers": 2, "max_pending": 4}
+        # 每个进程的模型都会开多线程推理，平分 CPU 核心，避免互相争抢
+        self.pipeline_options = pipeline_options.model_copy(deep=True)
+        self.pipeline_options.accelerator_options.num_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self._pool = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn：torch/onnxruntime 的线程池在 fork 出来的子进程里不可用，macOS 上也是默认方式
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"),
+                                             initializer=_init_worker,
+                                             initargs=(self.pipeline_options, self.pipeline_cls, self.artifacts))
+        return self._pool
+
+    def start(self):
+        """启动全部工作进程并加载模型；不调用时在第一次转换时启动"""
+        pool = self._executor()
+        list(pool.map(_worker_ready, range(self.workers)))
+
+    def iter_chunks(self, source: Union[str, Path], pages: Tuple[int, int] = None) -> Iterator[Tuple[PageRange, dict]]:
+        """按页序逐个产出 (页段, 文档 dict)，pages 为 (首页, 末页)，默认整本文档"""
+        first, last = pages or (1, page_count(source))
+        ranges = [(start + first - 1, end + first - 1)
+                  for start, end in page_ranges(last - first + 1, self.pages_per_chunk)]
+        return self.iter_ranges(source, ranges)
+
+    def iter_ranges(self, source: Union[str, Path], ranges: List[PageRange]) -> Iterator[Tuple[PageRange, dict]]:
+        """按给定顺序转换任意页段
+
+        最多 2 * workers 个页段在转换或等待被取走，调用方处理得慢时不会在内存里堆积整本文档
+        """
+        pool = self._executor()
+        remaining = iter(ranges)
+        pending = deque()
+        for page_range in remaining:
+            pending.append((page_range, pool.submit(_convert_range, str(source), page_range)))
+            if len(pending) >= 2 * self.workers:
+                break
+        try:
+            while pending:
+                page_range, future = pending.popleft()
+                part = future.result()
+                page_range_next = next(remaining, None)
+                if page_range_next is not None:
+                    pending.append((page_range_next, pool.submit(_convert_range, str(source), page_range_next)))
+                yield page_range, part
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def convert(self, source: Union[str, Path], pages: Tuple[int, int] = None) -> DoclingDocument:
+        parts = [part for _, part in self.iter_chunks(source, pages)]
+        return merge_documents(parts, name=Path(source).stem)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def __enter__(self) -> "ParallelConverter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,268 @@
+"""
+图片索引的磁盘格式
+一个索引是一个目录：
+    header.json      格式版本、模型 id、向量维度、每张图片的 token 数、图片数量
+    embeddings.npy   (N, tokens_per_image, embed_dim) float32 嵌入矩阵，按 memmap 懒加载
+    metadata.json    按列存储的元数据表：path / filename / mtime / size / sha256 / deleted
+    ann.npz          可选的 IVF 近似最近邻索引（见 ivf_index.py）
+    quantized.npz    可选的 int8 / PQ 压缩嵌入（见 quantization.py）
+
+增量更新时新行直接追加到 embeddings.npy 末尾，删除或修改的图片只在 deleted 列记为墓碑，
+header.json 最后写入，其中的 count 是提交点：超出 count 的行（中断的追加）会被忽略。
+墓碑过多时用 compact_index 重写索引。
+"""
+
+import hashlib
+import io
+import json
+import os
+import pickle
+import shutil
+from typing import Dict, List, Tuple
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+FORMAT_VERSION = 1
+HEADER_FILE = "header.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.json"
+ANN_FILE = "ann.npz"
+QUANT_FILE = "quantized.npz"
+# 附属文件中按图片行存储的数组，压缩索引时需要和嵌入一起重排
+ROW_ARRAYS = {
+    ANN_FILE: ('vectors', 'assignments'),
+    QUANT_FILE: ('codes', 'scales'),
+}
+METADATA_COLUMNS = ("path", "filename", "mtime", "size", "sha256", "deleted")
+
+
+def empty_metadata() -> Dict[str, list]:
+    return {column: [] for column in METADATA_COLUMNS}
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_record(path: str, with_hash: bool = True) -> Dict:
+    """生成一张图片的元数据记录"""
+    stat = os.stat(path)
+    return {
+        'path': path,
+        'filename': os.path.basename(path),
+        'mtime': stat.st_mtime,
+        'size': stat.st_size,
+        'sha256': file_sha256(path) if with_hash else "",
+        'deleted': False,
+    }
+
+
+def live_rows(metadata: Dict[str, list], directory: str) -> Tuple[Dict[str, int], List[int]]:
+    """目录下未删除的行：(绝对路径 -> 行号, 重复的行号)，不修改 metadata
+
+    按绝对路径匹配，"./imgs" 和 "imgs" 是同一个目录，旧索引里的相对路径也能对上；
+    以前用不同写法更新同一目录会留下同一图片的多行，只有最新的一行在字典里，其余作为重复行返回
+    """
+    directory_prefix = os.path.join(os.path.abspath(directory), '')
+    rows, duplicates = {}, []
+    for row, path in enumerate(metadata['path']):
+        path = os.path.abspath(path)
+        if not metadata['deleted'][row] and path.startswith(directory_prefix):
+            if path in rows:
+                duplicates.append(rows[path])
+            rows[path] = row
+    return rows, duplicates
+
+
+def append_record(metadata: Dict[str, list], record: Dict):
+    for column in METADATA_COLUMNS:
+        metadata[column].append(record[column])
+
+
+def write_index(index_dir: str, embeddings: np.ndarray, metadata: Dict[str, list], model_id: str):
+    """原子地写出索引目录：先写到临时目录，再替换旧索引"""
+    count, tokens_per_image, embed_dim = embeddings.shape
+    if any(len(metadata[column]) != count for column in METADATA_COLUMNS):
+        raise ValueError("Metadata columns must have one entry per embedding")
+
+    tmp_dir = f"{index_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, EMBEDDINGS_FILE), np.ascontiguousarray(embeddings, dtype=np.float32))
+    _write_json(os.path.join(tmp_dir, METADATA_FILE), _metadata_table(metadata))
+    _write_json(os.path.join(tmp_dir, HEADER_FILE), {
+        'format_version': FORMAT_VERSION,
+        'model_id': model_id,
+        'embed_dim': embed_dim,
+        'tokens_per_image': tokens_per_image,
+        'count': count,
+        'dtype': 'float32',
+    }, indent=2)
+
+    old_dir = f"{index_dir}.old"
+    if os.path.exists(index_dir):
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.rename(index_dir, old_dir)
+    os.rename(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def _write_json(path: str, data: Dict, indent: int = None):
+    """先写临时文件再替换，保证读者看到的总是完整文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp_path, path)
+
+
+def _metadata_table(metadata: Dict[str, list]) -> Dict[str, list]:
+    return {column: metadata[column] for column in METADATA_COLUMNS}
+
+
+def _append_rows(embeddings_path: str, rows: np.ndarray, count: int):
+    """把 rows 追加到 .npy 文件的前 count 行之后，并原地更新文件头中的 shape"""
+    with open(embeddings_path, 'r+b') as f:
+        version = npy_format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = npy_format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = npy_format.read_array_header_2_0(f)
+        offset = f.tell()
+        row_bytes = dtype.itemsize * int(np.prod(shape[1:]))
+        if rows.shape[1:] != shape[1:]:
+            raise ValueError(f"Cannot append rows of shape {rows.shape[1:]} to index of shape {shape[1:]}")
+
+        new_shape = (count + len(rows),) + tuple(shape[1:])
+        header = io.BytesIO()
+        npy_format.write_array_header_1_0(header, {
+            'descr': npy_format.dtype_to_descr(dtype),
+            'fortran_order': fortran_order,
+            'shape': new_shape,
+        })
+        if len(header.getvalue()) == offset:
+            # 丢弃中断追加留下的多余行，再写入新行
+            f.truncate(offset + count * row_bytes)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(rows, dtype=dtype).tobytes())
+            f.seek(0)
+            f.write(header.getvalue())
+            return
+
+    # 文件头放不下新的 shape，退回到整体重写
+    existing = np.load(embeddings_path, mmap_mode='r')[:count]
+    tmp_path = f"{embeddings_path}.tmp.npy"
+    np.save(tmp_path, np.concatenate([existing, rows.astype(existing.dtype)]))
+    os.replace(tmp_path, embeddings_path)
+
+
+def append_to_index(index_dir: str, rows: np.ndarray, metadata: Dict[str, list]):
+    """增量提交：追加新行的嵌入，写回完整的元数据表（包含新行和更新后的 deleted 列），最后更新 header"""
+    header = read_header(index_dir)
+    count = header['count'] + len(rows)
+    if any(len(metadata[column]) != count for column in METADATA_COLUMNS):
+        raise ValueError("Metadata columns must have one entry per embedding")
+
+    if len(rows) > 0:
+        _append_rows(os.path.join(index_dir, EMBEDDINGS_FILE), rows, header['count'])
+    _write_json(os.path.join(index_dir, METADATA_FILE), _metadata_table(metadata))
+    header['count'] = count
+    _write_json(os.path.join(index_dir, HEADER_FILE), header, indent=2)
+
+
+def compact_index(index_dir: str):
+    """去掉墓碑行，重写整个索引"""
+    header, metadata, embeddings = read_index(index_dir)
+    keep = np.flatnonzero(~np.array(metadata['deleted'], dtype=bool))
+    compacted = {column: [metadata[column][i] for i in keep] for column in METADATA_COLUMNS}
+
+    sidecars = {}
+    for filename, row_arrays in ROW_ARRAYS.items():
+        path = os.path.join(index_dir, filename)
+        if not os.path.exists(path):
+            continue
+        with np.load(path) as data:
+            # 只覆盖部分行的附属文件（增量追加后还未补齐）直接丢弃
+            if len(data[row_arrays[0]]) >= header['count']:
+                sidecars[filename] = {
+                    name: data[name][keep] if name in row_arrays else data[name] for name in data.files
+                }
+
+    write_index(index_dir, embeddings[keep], compacted, header['model_id'])
+    for filename, arrays in sidecars.items():
+        np.savez(os.path.join(index_dir, filename), **arrays)
+    print(f"Compacted {index_dir}: removed {header['count'] - len(keep)} deleted images")
+
+
+def read_header(index_dir: str) -> Dict:
+    with open(os.path.join(index_dir, HEADER_FILE), encoding='utf-8') as f:
+        header = json.load(f)
+    if header.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format version {header.get('format_version')} in {index_dir}")
+    return header
+
+
+def same_model(a: str, b: str) -> bool:
+    """模型 id 是否指同一个模型：本地模型目录按实际路径比较（"./colqwen" 和它的绝对路径相同）"""
+    if a == b:
+        return True
+    return os.path.isdir(a) and os.path.isdir(b) and os.path.realpath(a) == os.path.realpath(b)
+
+
+def read_index(index_dir: str, model_id: str = None) -> Tuple[Dict, Dict[str, list], np.ndarray]:
+    """读取索引目录，嵌入矩阵以只读 memmap 返回，由操作系统页缓存按需加载"""
+    header = read_header(index_dir)
+    if model_id is not None and not same_model(header['model_id'], model_id):
+        raise ValueError(f"Index {index_dir} was built with {header['model_id']}, not {model_id}")
+
+    count = header['count']
+    embeddings = np.load(os.path.join(index_dir, EMBEDDINGS_FILE), mmap_mode='r')
+    expected_shape = (header['tokens_per_image'], header['embed_dim'])
+    if embeddings.shape[0] < count or embeddings.shape[1:] != expected_shape:
+        raise ValueError(f"Embedding matrix shape {embeddings.shape} does not match header {(count,) + expected_shape}")
+
+    with open(os.path.join(index_dir, METADATA_FILE), encoding='utf-8') as f:
+        metadata = json.load(f)
+    metadata.setdefault('deleted', [False] * len(metadata['path']))
+    metadata = {column: values[:count] for column, values in _metadata_table(metadata).items()}
+    return header, metadata, embeddings[:count]
+
+
+def migrate_pickle_index(pkl_path: str, index_dir: str, model_id: str):
+    """把旧的 image_index.pkl 一次性转换为索引目录"""
+    with open(pkl_path, 'rb') as f:
+        data = pickle.load(f)
+
+    if isinstance(data, list):
+        paths = [item['path'] for item in data]
+        embeddings = [item['embedding'] for item in data]
+    else:
+        paths = data['paths']
+        embeddings = data['embeddings']
+
+    metadata = empty_metadata()
+    for path in paths:
+        if os.path.exists(path):
+            append_record(metadata, file_record(path))
+        else:
+            # 原图已不存在，保留嵌入但指纹置空
+            append_record(metadata, {'path': path, 'filename': os.path.basename(path),
+                                     'mtime': 0.0, 'size': 0, 'sha256': "", 'deleted': False})
+
+    if len(paths) == 0:
+        stacked = np.empty((0, 64, 128), dtype=np.float32)
+    else:
+        stacked = np.stack(embeddings)
+    write_index(index_dir, stacked, metadata, model_id)
+    print(f"Migrated {len(paths)} images from {pkl_path} to {index_dir}")
+
+
+def index_dir_for(path: str) -> str:
+    """旧的 .pkl 路径对应的索引目录（去掉扩展名）"""
+    root, ext = os.path.splitext(path)
+    return root if ext == '.pkl' else path
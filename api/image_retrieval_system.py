@@ -0,0 +1,511 @@
+"""
+多模态图片检索系统
+支持批量图片索引和文本查询检索
+"""
+
+import mlx.core as mx
+from mlx_embeddings.utils import load
+import numpy as np
+from PIL import Image
+import copy
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Tuple
+from transformers import AutoImageProcessor
+from maxsim import maxsim_scores, maxsim_scores_batch, sharded_top_k, top_k_indices
+from ivf_index import IVFIndex, image_centroids
+from quantization import Int8Codes, ProductQuantizer, load_quantized, save_quantized
+import image_index_store as store
+
+# 每张图片的 token 数和向量维度
+IMAGE_TOKENS = 64
+EMBED_DIM = 128
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff'}
+# 使用压缩嵌入时，粗排后从 float32 矩阵读取这么多行做精确重排
+QUANTIZED_RERANK_K = 100
+
+class MultimodalRetrievalSystem:
+    def __init__(self, model_path="./colqwen2.5-v0.2-mlx", query_cache_size: int = 1024,
+                 scoring_threads: int = None):
+        """初始化检索系统"""
+        print("Loading multimodal model...")
+        self.model, self.processor = load(model_path)
+        # 图片预处理器只加载一次，所有批次共用
+        self.image_processor = AutoImageProcessor.from_pretrained(model_path, use_fast=True)
+        # 本地模型目录记录绝对路径，换个工作目录或写法启动时索引仍然匹配
+        self.model_id = os.path.abspath(model_path) if os.path.isdir(model_path) else model_path
+        # 索引：连续的 (N, 64, 128) 嵌入矩阵 + 按列存储的元数据表（path/filename/mtime/size/sha256）
+        self.image_metadata: Dict[str, list] = store.empty_metadata()
+        self.image_embeddings = np.empty((0, IMAGE_TOKENS, EMBED_DIM), dtype=np.float32)
+        self.deleted_mask = np.zeros(0, dtype=bool)
+        # 可选的两阶段检索索引，见 build_ann_index
+        self.ann_index: IVFIndex = None
+        # 可选的压缩嵌入（Int8Codes / ProductQuantizer），存在时代替 float32 矩阵打分，见 quantize_index
+        self.quantized = None
+        # 查询嵌入的 LRU 缓存，键为 (模型 id, 规范化后的查询文本)
+        self.embeddings_cache: OrderedDict = OrderedDict()
+        self.query_cache_size = query_cache_size
+        # 穷举检索时索引按行分片，在线程池中并行打分
+        self.scoring_threads = scoring_threads or os.cpu_count() or 1
+        self._scoring_pool = ThreadPoolExecutor(max_workers=self.scoring_threads) if self.scoring_threads > 1 else None
+        # 增量更新和后台压缩不能同时改写同一个索引目录
+        self._index_lock = threading.Lock()
+        # 模型前向计算和查询缓存在索引任务和并发查询之间串行化
+        self._model_lock = threading.Lock()
+        print("Model loaded successfully!")
+    
+    @staticmethod
+    def _load_image(image_path: str):
+        """解码并缩放一张图片，失败时返回 None"""
+        try:
+            return Image.open(image_path).convert('RGB').resize((224, 224))
+        except Exception as e:
+            print(f"Error loading image {image_path}: {e}")
+            return None
+    
+    def _embed_batch(self, images: List) -> np.ndarray:
+        """一次前向计算嵌入一批图片，返回 (B, 64, 128)"""
+        # 使用与late_interaction.py相同的图片处理逻辑
+        processed_images = self.image_processor(images=images, return_tensors="pt")
+        pixel_values = processed_images['pixel_values']
+        if hasattr(pixel_values, 'numpy'):
+            pixel_values = pixel_values.numpy()
+        pixel_values = mx.array(pixel_values)
+        
+        # 创建image_grid_thw，每张图片一行
+        image_grid_thw = mx.array([[1, 28, 28]] * len(images))
+        
+        # 创建mock输入
+        image_token_id = 151655
+        image_input_ids = mx.full((len(images), IMAGE_TOKENS), image_token_id, dtype=mx.int32)
+        
+        # 生成图片嵌入
+        with self._model_lock:
+            image_embeddings = self.model(
+                input_ids=image_input_ids,
+                pixel_values=pixel_values,
+                image_grid_thw=image_grid_thw
+            )
+            return np.array(image_embeddings.image_embeds)
+    
+    def _process_image(self, image_path: str) -> np.ndarray:
+        """处理单张图片，返回嵌入向量 (1, 64, 128)"""
+        image = self._load_image(image_path)
+        if image is None:
+            return None
+        try:
+            return self._embed_batch([image])
+        except Exception as e:
+            print(f"Error processing image {image_path}: {e}")
+            return None
+    
+    def _decoded_batches(self, image_files: List[str], batch_size: int, num_workers: int):
+        """在线程池中预先解码图片，按批产出 (paths, images)
+        
+        预取量限制在两批以内，解码和模型计算重叠进行，内存中不会堆积整个目录的图片
+        """
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            pending = deque()
+            files = iter(image_files)
+            
+            def prefetch():
+                while len(pending) < 2 * batch_size:
+                    image_path = next(files, None)
+                    if image_path is None:
+                        return
+                    pending.append((image_path, pool.submit(self._load_image, image_path)))
+            
+            prefetch()
+            batch_paths, batch_images = [], []
+            while pending:
+                image_path, future = pending.popleft()
+                prefetch()
+                image = future.result()
+                if image is None:
+                    continue
+                batch_paths.append(image_path)
+                batch_images.append(image)
+                if len(batch_images) == batch_size:
+                    yield batch_paths, batch_images
+                    batch_paths, batch_images = [], []
+            if batch_images:
+                yield batch_paths, batch_images
+    
+    @staticmethod
+    def _list_image_files(image_directory: str) -> List[str]:
+        """递归列出目录下的所有图片（绝对路径，同一目录不论怎么写都得到相同的路径）"""
+        image_files = []
+        for root, _, files in os.walk(os.path.abspath(image_directory)):
+            for f in files:
+                if os.path.splitext(f.lower())[1] in IMAGE_EXTENSIONS:
+                    image_files.append(os.path.join(root, f))
+        image_files.sort()
+        return image_files
+    
+    def _embed_images(self, image_files: List[str], use_content_hash: bool = True,
+                      batch_size: int = 8, num_workers: int = 4,
+                      progress: Callable[[int, int], None] = None) -> Tuple[Dict[str, list], np.ndarray]:
+        """嵌入一批图片，返回它们的元数据和 (M, 64, 128) 嵌入矩阵；progress(已处理数, 总数) 在每批之后调用"""
+        metadata = store.empty_metadata()
+        embeddings = np.empty((len(image_files), IMAGE_TOKENS, EMBED_DIM), dtype=np.float32)
+        count = 0
+        for batch_paths, batch_images in self._decoded_batches(image_files, batch_size, num_workers):
+            try:
+                batch_embeddings = self._embed_batch(batch_images)
+            except Exception as e:
+                print(f"Error processing batch starting at {batch_paths[0]}: {e}")
+                continue
+            
+            for image_path, embedding in zip(batch_paths, batch_embeddings):
+                store.append_record(metadata, store.file_record(image_path, with_hash=use_content_hash))
+                embeddings[count] = embedding
+                count += 1
+            print(f"Processed {count}/{len(image_files)} images")
+            if progress is not None:
+                progress(count, len(image_files))
+        
+        return metadata, embeddings[:count]
+    
+    def build_image_index(self, image_directory: str, save_path: str = "image_index", batch_size: int = 8,
+                          progress: Callable[[int, int], None] = None):
+        """批量构建图片索引"""
+        print(f"Building image index from {image_directory}...")
+        
+        image_files = self._list_image_files(image_directory)
+        print(f"Found {len(image_files)} images to process...")
+        
+        metadata, embeddings = self._embed_images(image_files, batch_size=batch_size, progress=progress)
+        
+        # 保存索引，然后以 memmap 方式重新打开
+        with self._index_lock:
+            store.write_index(save_path, embeddings, metadata, self.model_id)
+        self.load_image_index(save_path)
+        
+        print(f"Image index built successfully! {len(self.image_metadata['path'])} images indexed.")
+        print(f"Index saved to {save_path}")
+    
+    def update_image_index(self, image_directory: str, index_path: str = "image_index",
+                           use_content_hash: bool = False, compact_ratio: float = 0.2, batch_size: int = 8,
+                           progress: Callable[[int, int], None] = None):
+        """增量更新图片索引
+        
+        按 mtime+size（可选内容哈希）判断文件是否变化，只嵌入新增或修改的图片，
+        已删除或被替换的旧行记为墓碑；墓碑比例超过 compact_ratio 时在后台线程压缩索引。
+        """
+        if not os.path.isdir(index_path):
+            return self.build_image_index(image_directory, index_path, batch_size=batch_size, progress=progress)
+        
+        print(f"Updating image index {index_path} from {image_directory}...")
+        with self._index_lock:
+            _, metadata, _ = store.read_index(index_path, self.model_id)
+            
+            live_rows, duplicates = store.live_rows(metadata, image_directory)
+            # 以前用不同写法更新同一目录留下的重复行
+            for row in duplicates:
+                metadata['deleted'][row] = True
+            
+            changed_files = []
+            for image_path in self._list_image_files(image_directory):
+                row = live_rows.pop(image_path, None)
+                if row is not None:
+                    stat = os.stat(image_path)
+                    if metadata['mtime'][row] == stat.st_mtime and metadata['size'][row] == stat.st_size:
+                        continue
+                    if (use_content_hash and metadata['size'][row] == stat.st_size
+                            and metadata['sha256'][row] == store.file_sha256(image_path)):
+                        # 只是 touch 过，内容未变
+                        metadata['mtime'][row] = stat.st_mtime
+                        continue
+                    metadata['deleted'][row] = True
+                changed_files.append(image_path)
+            
+            # 剩下的是已经从磁盘上删除的图片
+            for row in live_rows.values():
+                metadata['deleted'][row] = True
+            
+            print(f"{len(changed_files)} new or changed images, {len(live_rows)} deleted images")
+            new_metadata, new_embeddings = self._embed_images(changed_files, use_content_hash, batch_size=batch_size,
+                                                              progress=progress)
+            for column in store.METADATA_COLUMNS:
+                metadata[column].extend(new_metadata[column])
+            store.append_to_index(index_path, new_embeddings, metadata)
+        
+        self.load_image_index(index_path)
+        
+        deleted_count = int(np.count_nonzero(self.deleted_mask))
+        if deleted_count > compact_ratio * max(len(self.deleted_mask), 1):
+            threading.Thread(target=self._compact_index, args=(index_path,), daemon=False).start()
+    
+    def _compact_index(self, index_path: str):
+        """后台压缩：重写索引去掉墓碑行；内存中的索引保持不变，下次加载时生效"""
+        with self._index_lock:
+            store.compact_index(index_path)
+    
+    def load_image_index(self, index_path: str = "image_index"):
+        """加载预构建的图片索引（目录格式；旧的 .pkl 文件会先迁移为目录）
+        
+        持有索引锁：后台压缩替换目录时不会读到一半，补齐的附属文件也不会写进刚压缩过的目录
+        """
+        with self._index_lock:
+            self._load_image_index(index_path)
+    
+    def _load_image_index(self, index_path: str):
+        index_dir = store.index_dir_for(index_path)
+        if index_path.endswith('.pkl') and os.path.isfile(index_path) and not os.path.isdir(index_dir):
+            store.migrate_pickle_index(index_path, index_dir, self.model_id)
+        
+        try:
+            _, self.image_metadata, self.image_embeddings = store.read_index(index_dir, self.model_id)
+            self.deleted_mask = np.array(self.image_metadata['deleted'], dtype=bool)
+            print(f"Loaded image index with {len(self.image_metadata['path']) - int(self.deleted_mask.sum())} images")
+        except FileNotFoundError:
+            print(f"Index {index_dir} not found. Please build index first.")
+            return
+        
+        self.ann_index = None
+        ann_path = os.path.join(index_dir, store.ANN_FILE)
+        if os.path.exists(ann_path):
+            ann_index = IVFIndex.load(ann_path)
+            covered = len(ann_index.assignments)
+            count = len(self.image_embeddings)
+            if covered < count:
+                # 增量索引追加的新行，分配到已有的簇
+                ann_index.add(image_centroids(self.image_embeddings[covered:], ann_index.vectors_per_image))
+                ann_index.save(ann_path)
+            if covered <= count:
+                self.ann_index = ann_index
+        
+        self.quantized = None
+        quant_path = os.path.join(index_dir, store.QUANT_FILE)
+        if os.path.exists(quant_path):
+            quantized = load_quantized(quant_path)
+            covered = len(quantized)
+            count = len(self.image_embeddings)
+            if covered < count:
+                quantized.append(self.image_embeddings[covered:])
+                save_quantized(quant_path, quantized)
+            if covered <= count:
+                self.quantized = quantized
+    
+    def quantize_index(self, index_path: str = "image_index", method: str = "int8", subspaces: int = 16):
+        """压缩已加载的索引，之后的检索直接在压缩形式上打分
+        
+        method="int8" 约压缩 4 倍；method="pq" 每个 token 占 subspaces 字节（16 对应 32 倍，32 对应 16 倍）
+        """
+        if method == "int8":
+            self.quantized = Int8Codes.encode(self.image_embeddings)
+        elif method == "pq":
+            self.quantized = ProductQuantizer.train(self.image_embeddings, subspaces=subspaces)
+        else:
+            raise ValueError(f"Unknown quantization method {method}")
+        with self._index_lock:
+            if self._loaded_rows_on_disk(index_path):
+                save_quantized(os.path.join(store.index_dir_for(index_path), store.QUANT_FILE), self.quantized)
+        print(f"Quantized index with {method}: {self.image_embeddings.nbytes / 2**20:.1f} MB -> "
+              f"{self.quantized.nbytes / 2**20:.1f} MB")
+    
+    def build_ann_index(self, index_path: str = "image_index", vectors_per_image: int = 4, nlist: int = None):
+        """为已加载的索引训练 IVF 近似最近邻索引，并保存到索引目录
+        
+        vectors_per_image=1 时每张图片只保留均值池化向量，更大的值在图片内部聚类出多个中心向量，召回率更高
+        """
+        print("Building ANN index from per-image centroid vectors...")
+        vectors = image_centroids(self.image_embeddings, vectors_per_image)
+        self.ann_index = IVFIndex.train(vectors, nlist=nlist)
+        with self._index_lock:
+            if self._loaded_rows_on_disk(index_path):
+                self.ann_index.save(os.path.join(store.index_dir_for(index_path), store.ANN_FILE))
+        print(f"ANN index built with {len(self.ann_index.centroids)} lists")
+    
+    def _loaded_rows_on_disk(self, index_path: str) -> bool:
+        """磁盘上的索引行是否还是已加载的这些（持有索引锁时调用）；压缩后行号变了，附属文件不能再写进去"""
+        index_dir = store.index_dir_for(index_path)
+        if os.path.isdir(index_dir) and store.read_header(index_dir)['count'] != len(self.image_embeddings):
+            print(f"Index {index_dir} changed on disk (compacted), reload it before saving sidecar files")
+            return False
+        return True
+    
+    def snapshot(self) -> "MultimodalRetrievalSystem":
+        """返回当前索引的只读快照，与原对象共用模型和查询缓存
+        
+        build/update/load 只会重新绑定索引属性，不会原地修改数组，所以之后在原对象上重建索引不影响快照上的检索
+        """
+        return copy.copy(self)
+    
+    @staticmethod
+    def _normalize_query(query_text: str) -> str:
+        return ' '.join(unicodedata.normalize('NFKC', query_text).split())
+    
+    def _embed_queries(self, query_texts: List[str]) -> List[np.ndarray]:
+        """生成多个查询文本的 token 嵌入，命中缓存的直接返回，其余的一次前向计算完成"""
+        keys = [(self.model_id, self._normalize_query(q)) for q in query_texts]
+        with self._model_lock:
+            missing = list(dict.fromkeys(key for key in keys if key not in self.embeddings_cache))
+            
+            if missing:
+                # 处理查询文本
+                text_inputs = self.processor(text=[text for _, text in missing], padding=True, return_tensors="np")
+                attention_mask = np.asarray(text_inputs.attention_mask).astype(bool)
+                
+                # 生成文本嵌入
+                text_embeddings = self.model(
+                    input_ids=mx.array(text_inputs.input_ids),
+                    attention_mask=mx.array(attention_mask.astype(np.int32)),
+                )
+                text_embeds = np.array(text_embeddings.text_embeds)  # (B, L, 128)
+                for key, embed, mask in zip(missing, text_embeds, attention_mask):
+                    # 去掉 padding 位置，避免它们参与 MaxSim 求和
+                    self.embeddings_cache[key] = embed[mask]
+            
+            results = []
+            for key in keys:
+                self.embeddings_cache.move_to_end(key)
+                results.append(self.embeddings_cache[key])
+            while len(self.embeddings_cache) > self.query_cache_size:
+                self.embeddings_cache.popitem(last=False)
+        return results
+    
+    def _embed_query(self, query_text: str) -> np.ndarray:
+        """生成查询文本的 token 嵌入"""
+        return self._embed_queries([query_text])[0]
+    
+    def _score_query(self, text_embed: np.ndarray, top_k: int, candidate_k: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """对一个查询打分，返回 (候选行号, 对应的分数)"""
+        if candidate_k and self.ann_index is not None:
+            candidates = self.ann_index.search(text_embed, candidate_k, exclude=self.deleted_mask)
+            if self.quantized is not None:
+                scores = self.quantized.maxsim_scores(text_embed, rows=candidates)
+            else:
+                scores = maxsim_scores(text_embed, self.image_embeddings[candidates])
+        else:
+            # Late interaction相似度计算：对整个索引分块批量打分
+            candidates = np.arange(len(self.image_embeddings))
+            if self.quantized is not None:
+                scores = self.quantized.maxsim_scores(text_embed)
+            else:
+                scores = maxsim_scores(text_embed, self.image_embeddings)  # (N,)
+            scores[self.deleted_mask] = -np.inf  # 跳过墓碑行
+        
+        if self.quantized is not None:
+            # 压缩形式上粗排，只从磁盘上的 float32 矩阵读取少量候选行精排
+            rerank = top_k_indices(scores, max(top_k, QUANTIZED_RERANK_K))
+            candidates = np.sort(candidates[rerank[np.isfinite(scores[rerank])]])
+            scores = maxsim_scores(text_embed, self.image_embeddings[candidates])
+        
+        return candidates, scores
+    
+    def _score_all_queries(self, text_embeds: List[np.ndarray]) -> np.ndarray:
+        """对多个查询做穷举打分，返回 (B, N)，所有查询共用一次索引扫描"""
+        scores = maxsim_scores_batch(text_embeds, self.image_embeddings)
+        scores[:, self.deleted_mask] = -np.inf  # 跳过墓碑行
+        return scores
+    
+    def _top_results(self, candidates: np.ndarray, scores: np.ndarray, top_k: int, score_threshold: float,
+                     matched: int = None) -> List[Dict]:
+        # 只对前top_k个结果排序
+        top_indices = top_k_indices(scores, top_k, score_threshold)
+        top_results = [
+            {
+                'path': self.image_metadata['path'][candidates[i]],
+                'filename': self.image_metadata['filename'][candidates[i]],
+                'score': float(scores[i]),
+            }
+            for i in top_indices
+        ]
+        
+        if matched is None:
+            matched = int(np.count_nonzero(scores >= score_threshold))
+        print(f"Found {matched} images above threshold {score_threshold}")
+        print(f"Returning top {len(top_results)} results:")
+        for i, result in enumerate(top_results):
+            print(f"  {i+1}. {result['filename']}: {result['score']:.4f}")
+        
+        return top_results
+    
+    def search_images(self, query_text: str, top_k: int = 10, score_threshold: float = 2.0,
+                      candidate_k: int = None) -> List[Dict]:
+        """文本查询检索图片
+        
+        candidate_k 不为空且已建立 ANN 索引时使用两阶段检索：先用 IVF 和近似 MaxSim 召回 candidate_k 个候选，
+        再只对候选计算精确的 MaxSim 分数；否则对整个索引做穷举打分
+        """
+        if len(self.image_metadata['path']) == 0:
+            print("No image index loaded. Please build or load an index first.")
+            return []
+        
+        print(f"Searching for: '{query_text}'")
+        
+        text_embed = self._embed_query(query_text)  # (8, 128)
+        if self.quantized is None and not (candidate_k and self.ann_index is not None):
+            # 穷举打分：分片并行，每个分片取 top_k 后堆归并
+            rows, scores, matched = sharded_top_k(text_embed, self.image_embeddings, top_k, score_threshold,
+                                                  self.deleted_mask, self._scoring_pool, self.scoring_threads)
+            return self._top_results(rows, scores, top_k, score_threshold, matched)
+        
+        candidates, scores = self._score_query(text_embed, top_k, candidate_k)
+        return self._top_results(candidates, scores, top_k, score_threshold)
+    
+    def search_images_batch(self, query_texts: List[str], top_k: int = 10, score_threshold: float = 2.0,
+                            candidate_k: int = None) -> List[List[Dict]]:
+        """批量文本查询：一次前向计算生成所有查询嵌入，穷举打分时所有查询作为一个矩阵一起计算"""
+        if len(self.image_metadata['path']) == 0:
+            print("No image index loaded. Please build or load an index first.")
+            return [[] for _ in query_texts]
+        
+        print(f"Searching for {len(query_texts)} queries")
+        text_embeds = self._embed_queries(query_texts)
+        
+        if (candidate_k and self.ann_index is not None) or self.quantized is not None:
+            scored = [self._score_query(text_embed, top_k, candidate_k) for text_embed in text_embeds]
+        else:
+            candidates = np.arange(len(self.image_embeddings))
+            scored = [(candidates, scores) for scores in self._score_all_queries(text_embeds)]
+        
+        return [self._top_results(candidates, scores, top_k, score_threshold) for candidates, scores in scored]
+    
+    def evaluate_threshold(self, test_queries: List[str], thresholds: List[float], top_k: int = 100):
+        """评估不同阈值的效果：每个查询只嵌入和打分一次，再在分数上扫描所有阈值"""
+        print("Evaluating different thresholds...")
+        
+        scores = self._score_all_queries(self._embed_queries(test_queries))  # (B, N)
+        
+        for threshold in thresholds:
+            results_per_query = np.minimum(np.count_nonzero(scores >= threshold, axis=1), top_k)
+            avg_results = results_per_query.sum() / len(test_queries)
+            print(f"Threshold {threshold}: Average {avg_results:.1f} results per query")
+
+# 使用示例
+if __name__ == "__main__":
+    # 初始化系统
+    retrieval_system = MultimodalRetrievalSystem()
+    
+    # 构建图片索引（首次运行）
+    # retrieval_system.build_image_index("./image_collection", "my_image_index")
+    
+    # 加载预构建的索引（旧的 my_image_index.pkl 会自动迁移为 my_image_index/ 目录）
+    # retrieval_system.load_image_index("my_image_index")
+    
+    # 查询示例
+    queries = [
+        "a cat sitting on a chair",
+        "books on a shelf",
+        "evaluation results chart",
+        "historical document"
+    ]
+    
+    for query, results in zip(queries, retrieval_system.search_images_batch(queries, top_k=5, score_threshold=2.0)):
+        print(f"\n{'='*50}")
+        if results:
+            print(f"Top results for '{query}':")
+            for i, result in enumerate(results):
+                print(f"  {i+1}. {result['filename']} (score: {result['score']:.4f})")
+        else:
+            print(f"No results found for '{query}'")
+    
+    # 阈值评估
+    print(f"\n{'='*50}")
+    retrieval_system.evaluate_threshold(queries, [1.5, 2.0, 2.5, 3.0])
@@ -0,0 +1,172 @@
+"""
+图片检索 HTTP 接口，挂载在 app.py 上
+    POST /images/index   后台构建/增量更新索引，立即返回任务状态
+    POST /images/search  文本查询检索图片
+    GET  /images/status  模型、索引和当前索引任务的状态
+模型在启动时加载一次并常驻；检索总是在只读快照上进行，索引任务完成后才换成新的快照
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+
+IMAGE_MODEL_PATH = os.environ.get("IMAGE_MODEL_PATH", "./colqwen2.5-v0.2-mlx")
+IMAGE_INDEX_PATH = os.environ.get("IMAGE_INDEX_PATH", "image_index")
+
+
+class IndexRequest(BaseModel):
+    image_directory: str
+    rebuild: bool = False  # True 时全量重建，否则按 mtime+size 增量更新
+    use_content_hash: bool = False
+    batch_size: int = 8
+
+
+class SearchRequest(BaseModel):
+    query: str
+    top_k: int = 10
+    score_threshold: float = 2.0
+    candidate_k: Optional[int] = None
+
+
+class ImageSearchService:
+    def __init__(self, model_path: str = IMAGE_MODEL_PATH, index_path: str = IMAGE_INDEX_PATH):
+        self.model_path = model_path
+        self.index_path = index_path
+        self.model_state = "not_loaded"  # not_loaded / loading / ready / error
+        self.model_error = None
+        self.index_error = None
+        # 索引任务使用的系统对象，检索只读 self.snapshot
+        self.system = None
+        self.snapshot = None
+        self.job = None
+        self._job_lock = threading.Lock()
+
+    def start(self):
+        """在后台线程加载模型，服务启动不被阻塞"""
+        if self.model_state in ("loading", "ready"):
+            return
+        self.model_state = "loading"
+        threading.Thread(target=self._load_model, daemon=True).start()
+
+    def _load_model(self):
+        try:
+            # mlx 只在 macOS 上可用，延迟导入，未安装时 app.py 的其它接口照常工作
+            from image_retrieval_system import MultimodalRetrievalSystem
+
+            system = MultimodalRetrievalSystem(self.model_path)
+        except Exception as e:
+            print(f"Error loading image retrieval model: {e}")
+            self.model_error = str(e)
+            self.model_state = "error"
+            return
+        if os.path.isdir(self.index_path):
+            # 索引读不出来（模型 id 不符、文件损坏）不影响模型：状态里报告错误，仍可通过 /images/index 重建
+            try:
+                system.load_image_index(self.index_path)
+            except Exception as e:
+                print(f"Error loading image index {self.index_path}: {e}")
+                self.index_error = str(e)
+        self.system = system
+        self.snapshot = system.snapshot()
+        self.model_state = "ready"
+
+    def _require_model(self):
+        if self.model_state != "ready":
+            detail = f"Image model is {self.model_state}"
+            if self.model_error:
+                detail += f": {self.model_error}"
+            raise HTTPException(status_code=503, detail=detail)
+
+    def start_index_job(self, request: IndexRequest) -> dict:
+        self._require_model()
+        if not os.path.isdir(request.image_directory):
+            raise HTTPException(status_code=400, detail=f"{request.image_directory} is not a directory")
+        with self._job_lock:
+            if self.job is not None and self.job["state"] == "running":
+                raise HTTPException(status_code=409, detail="An indexing job is already running")
+            self.job = {
+                "state": "running",
+                "image_directory": request.image_directory,
+                "rebuild": request.rebuild,
+                "processed": 0,
+                "total": None,
+                "started_at": time.time(),
+                "finished_at": None,
+                "error": None,
+            }
+            job = self.job
+        threading.Thread(target=self._run_index_job, args=(request, job), daemon=True).start()
+        return dict(job)
+
+    def _run_index_job(self, request: IndexRequest, job: dict):
+        def progress(processed: int, total: int):
+            job["processed"] = processed
+            job["total"] = total
+
+        try:
+            if request.rebuild:
+                self.system.build_image_index(request.image_directory, self.index_path,
+                                              batch_size=request.batch_size, progress=progress)
+            else:
+                self.system.update_image_index(request.image_directory, self.index_path,
+                                               use_content_hash=request.use_content_hash,
+                                               batch_size=request.batch_size, progress=progress)
+            # 新索引已完整写入磁盘并加载，原子地替换检索用的快照
+            self.snapshot = self.system.snapshot()
+            self.index_error = None
+            job["state"] = "finished"
+        except Exception as e:
+            print(f"Error indexing {request.image_directory}: {e}")
+            job["error"] = str(e)
+            job["state"] = "failed"
+        finally:
+            job["finished_at"] = time.time()
+
+    def search(self, request: SearchRequest) -> dict:
+        self._require_model()
+        snapshot = self.snapshot
+        results = snapshot.search_images(request.query, top_k=request.top_k,
+                                         score_threshold=request.score_threshold,
+                                         candidate_k=request.candidate_k)
+        return {"query": request.query, "results": results}
+
+    def status(self) -> dict:
+        snapshot = self.snapshot
+        indexed = 0
+        if snapshot is not None:
+            indexed = len(snapshot.deleted_mask) - int(snapshot.deleted_mask.sum())
+        return {
+            "model": {"path": self.model_path, "state": self.model_state, "error": self.model_error},
+            "index": {
+                "path": self.index_path,
+                "error": self.index_error,
+                "images": indexed,
+                "ann": snapshot is not None and snapshot.ann_index is not None,
+                "quantized": snapshot.quantized.kind if snapshot is not None and snapshot.quantized is not None else None,
+            },
+            "job": dict(self.job) if self.job is not None else None,
+        }
+
+
+service = ImageSearchService()
+router = APIRouter(prefix="/images")
+
+
+# 同步接口由 FastAPI 放在线程池中执行，多个检索请求可以并发打分
+@router.post("/index", status_code=202)
+def index_images(request: IndexRequest):
+    return service.start_index_job(request)
+
+
+@router.post("/search")
+def search_images(request: SearchRequest):
+    return service.search(request)
+
+
+@router.get("/status")
+def image_status():
+    return service.status()
@@ -1,19 +1,36 @@
-import os
-import json
-from typing import List
+from contextlib import asynccontextmanager
+from typing import List, Optional
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from fastapi import FastAPI, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from openai import OpenAI
+from fastapi.responses import PlainTextResponse
 from utils.prompt import ClientMessage, convert_to_openai_messages
 from utils.tools import get_current_weather
+from tool_executor import cache_result, tool_cache
 
 
 load_dotenv(".env.local")
 
-app = FastAPI()
+# model_router / chat_stream read MODEL_BACKENDS, OPENAI_BASE_URL and CHAT_MODEL, import them after .env.local is loaded
+import chat_metrics
+import chat_stream
+import completions_api
+from chat_response import ChatStreamingResponse
+from conversation_store import ConversationStore
+from model_router import router
+
+conversations = ConversationStore()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    router.start_health_checks()
+    yield
+    await router.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], # Or, to allow all origins (less secure, use with caution)
@@ -21,124 +38,44 @@ app.add_middleware(
     allow_methods=["*"],    # Allows all methods (GET, POST, PUT, DELETE, etc.)
     allow_headers=["*"],    # Allows all headers
 )
-client = OpenAI(
-    api_key="sk-xxx",
-    base_url="http://localhost:1234/v1",
-)
+app.include_router(completions_api.router)
 
 
 class Request(BaseModel):
-    messages: List[ClientMessage]
+    # Chat id from useChat; with an id the converted history is kept server-side and the client
+    # may send only the new `message` instead of the full `messages` list
+    id: Optional[str] = None
+    messages: List[ClientMessage] = []
+    message: Optional[ClientMessage] = None
+    # temperature 0 makes the completion eligible for the response cache (CHAT_CACHE=1)
+    temperature: Optional[float] = None
 
 
 available_tools = {
-    "get_current_weather": get_current_weather,
+    "get_current_weather": cache_result(ttl=600)(get_current_weather),
 }
 
 
-def stream_text(messages: List[ClientMessage], protocol: str = 'data'):
-    stream = client.chat.completions.create(
-        messages=messages,
-        model="qwen/qwen3-30b-a3b-2507",
-        stream=True,
-        tools=[{
-            "type": "function",
-            "function": {
-                "name": "get_current_weather",
-                "description": "Get the current weather in a given location",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "location": {
-                            "type": "string",
-                            "description": "The city and state, e.g. San Francisco, CA",
-                        },
-                        "unit": {
-                            "type": "string",
-                            "enum": ["celsius", "fahrenheit"]},
-                    },
-                    "required": ["location", "unit"],
-                },
-            },
-        }]
-    )
-
-    # When protocol is set to "text", you will send a stream of plain text chunks
-    # https://ai-sdk.dev/docs/ai-sdk-ui/stream-protocol#text-stream-protocol
-
-    if (protocol == 'text'):
-        for chunk in stream:
-            for choice in chunk.choices:
-                if choice.finish_reason == "stop":
-                    break
-                else:
-                    yield "{text}".format(text=choice.delta.content)
-
-    # When protocol is set to "data", you will send a stream data part chunks
-    # https://ai-sdk.dev/docs/ai-sdk-ui/stream-protocol#data-stream-protocol
-
-    elif (protocol == 'data'):
-        draft_tool_calls = []
-        draft_tool_calls_index = -1
-
-        for chunk in stream:
-            for choice in chunk.choices:
-                if choice.finish_reason == "stop":
-                    continue
-
-                elif choice.finish_reason == "tool_calls":
-                    for tool_call in draft_tool_calls:
-                        yield '9:{{"toolCallId":"{id}","toolName":"{name}","args":{args}}}\n'.format(
-                            id=tool_call["id"],
-                            name=tool_call["name"],
-                            args=tool_call["arguments"])
-
-                    for tool_call in draft_tool_calls:
-                        tool_result = available_tools[tool_call["name"]](
-                            **json.loads(tool_call["arguments"]))
-
-                        yield 'a:{{"toolCallId":"{id}","toolName":"{name}","args":{args},"result":{result}}}\n'.format(
-                            id=tool_call["id"],
-                            name=tool_call["name"],
-                            args=tool_call["arguments"],
-                            result=json.dumps(tool_result))
-
-                elif choice.delta.tool_calls:
-                    for tool_call in choice.delta.tool_calls:
-                        id = tool_call.id
-                        name = tool_call.function.name
-                        arguments = tool_call.function.arguments
-
-                        if (id is not None):
-                            draft_tool_calls_index += 1
-                            draft_tool_calls.append(
-                                {"id": id, "name": name, "arguments": ""})
-
-                        else:
-                            draft_tool_calls[draft_tool_calls_index]["arguments"] += arguments
-
-                else:
-                    yield '0:{text}\n'.format(text=json.dumps(choice.delta.content))
-
-            if chunk.choices == []:
-                usage = chunk.usage
-                prompt_tokens = usage.prompt_tokens
-                completion_tokens = usage.completion_tokens
-
-                yield 'd:{{"finishReason":"{reason}","usage":{{"promptTokens":{prompt},"completionTokens":{completion}}}}}\n'.format(
-                    reason="tool-calls" if len(
-                        draft_tool_calls) > 0 else "stop",
-                    prompt=prompt_tokens,
-                    completion=completion_tokens
-                )
-
-
 @app.post("/api/chat")
 async def handle_chat_data(request: Request, protocol: str = Query('data')):
-    messages = request.messages
-    openai_messages = convert_to_openai_messages(messages)
-
-    response = StreamingResponse(stream_text(openai_messages, protocol))
+    on_finish = None
+    trace = chat_metrics.RequestTrace(protocol)
+    with trace.span("convert"):
+        if request.id is None:
+            openai_messages = convert_to_openai_messages(request.messages)
+        elif request.message is not None:
+            openai_messages = conversations.append(request.id, request.message, convert_to_openai_messages)
+        else:
+            openai_messages = conversations.sync(request.id, request.messages, convert_to_openai_messages)
+
+    if request.id is not None:
+        def on_finish(new_messages):
+            conversations.commit(request.id, new_messages)
+
+    # Closing the webview cancels the upstream completion instead of generating the rest of the answer
+    response = ChatStreamingResponse(chat_stream.stream_text(openai_messages, available_tools, protocol,
+                                                             on_finish=on_finish, temperature=request.temperature,
+                                                             trace=trace))
     response.headers['Content-Type'] = 'text/event-stream'
     response.headers['Cache-Control'] = 'no-cache'
     response.headers['Connection'] = 'keep-alive'
@@ -147,6 +84,21 @@ async def handle_chat_data(request: Request, protocol: str = Query('data')):
     response.headers['x-vercel-ai-data-stream'] = 'v1'
     return response
 
+
+@app.get("/api/cache")
+async def cache_stats():
+    return {
+        "completions": chat_stream.completion_cache.stats() if chat_stream.completion_cache is not None else None,
+        "tools": tool_cache.stats(),
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text format: TTFT, inter-token latency, tokens/sec, tool latency, token usage"""
+    return PlainTextResponse(chat_metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=60316, log_level="info")
\ No newline at end of file
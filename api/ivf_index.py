@@ -0,0 +1,125 @@
+"""
+两阶段检索的第一阶段：倒排文件（IVF）近似最近邻索引
+每张图片的 64 个 token 向量先在图片内部聚成少量中心向量（vectors_per_image=1 时即均值池化），
+所有中心向量再做 k-means 建立倒排表。查询时每个查询 token 只扫描最接近的 nprobe 个簇，
+对命中的图片用中心向量计算近似 MaxSim，返回候选交给精确 MaxSim 重排
+"""
+
+import numpy as np
+
+from maxsim import maxsim_scores
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def image_centroids(image_embeddings: np.ndarray, vectors_per_image: int = 4,
+                    iterations: int = 5, chunk_size: int = 2048) -> np.ndarray:
+    """(N, T, D) -> (N, k, D)：每张图片的 token 向量做 k-means 得到 k 个归一化中心，按块读取以适配 memmap"""
+    n, t, d = image_embeddings.shape
+    k = vectors_per_image
+    result = np.empty((n, k, d), dtype=np.float32)
+    for start in range(0, n, chunk_size):
+        tokens = np.asarray(image_embeddings[start:start + chunk_size], dtype=np.float32)
+        if k == 1:
+            result[start:start + len(tokens)] = _normalize(tokens.mean(axis=1, keepdims=True))
+            continue
+        # 以均匀间隔的 token 初始化，所有图片同时迭代
+        centers = tokens[:, np.linspace(0, t - 1, k).astype(int)]
+        for _ in range(iterations):
+            assignments = np.argmax(np.einsum('mtd,mkd->mtk', tokens, centers), axis=2)
+            one_hot = np.eye(k, dtype=np.float32)[assignments]
+            centers = _normalize(np.einsum('mtk,mtd->mkd', one_hot, tokens))
+        result[start:start + len(tokens)] = centers
+    return result
+
+
+def _kmeans(vectors: np.ndarray, nlist: int, iterations: int, seed: int) -> np.ndarray:
+    """球面 k-means，返回 (nlist, D) 归一化的聚类中心"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=nlist)
+        # 空簇重新随机取一个点
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, vectors: np.ndarray, assignments: np.ndarray):
+        self.centroids = centroids        # (nlist, D) 倒排表的聚类中心
+        self.vectors = vectors            # (N, k, D) 每张图片的中心向量
+        self.assignments = assignments    # (N, k) 每个中心向量所属的簇
+        self._build_lists()
+
+    @property
+    def vectors_per_image(self) -> int:
+        return self.vectors.shape[1]
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, nlist: int = None, iterations: int = 10,
+              train_size: int = 100000, seed: int = 0) -> "IVFIndex":
+        """在（采样的）中心向量上训练倒排表的聚类中心，并分配全部向量"""
+        flat = vectors.reshape(-1, vectors.shape[-1])
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(len(flat))))
+        nlist = min(nlist, len(flat))
+        rng = np.random.default_rng(seed)
+        sample = flat if len(flat) <= train_size else flat[rng.choice(len(flat), train_size, replace=False)]
+        centroids = _kmeans(sample, nlist, iterations, seed)
+        return cls(centroids, vectors, cls._assign(centroids, vectors))
+
+    @staticmethod
+    def _assign(centroids: np.ndarray, vectors: np.ndarray, chunk_size: int = 16384) -> np.ndarray:
+        assignments = np.empty(vectors.shape[:2], dtype=np.int32)
+        for start in range(0, len(vectors), chunk_size):
+            assignments[start:start + chunk_size] = np.argmax(
+                vectors[start:start + chunk_size] @ centroids.T, axis=2)
+        return assignments
+
+    def _build_lists(self):
+        # 按簇排序的向量下标（除以 k 即图片下标） + 每个簇的起始偏移
+        flat = self.assignments.ravel()
+        self.list_order = np.argsort(flat, kind="stable")
+        counts = np.bincount(flat, minlength=len(self.centroids))
+        self.list_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def add(self, vectors: np.ndarray):
+        """追加新图片（例如增量索引新增的行），沿用已有聚类中心"""
+        self.vectors = np.concatenate([self.vectors, vectors])
+        self.assignments = np.concatenate([self.assignments, self._assign(self.centroids, vectors)])
+        self._build_lists()
+
+    def search(self, query_embed: np.ndarray, candidate_k: int, nprobe: int = 4,
+               exclude: np.ndarray = None) -> np.ndarray:
+        """返回近似 MaxSim 得分最高的 candidate_k 个候选图片下标（升序）
+
+        每个查询 token 扫描最接近的 nprobe 个簇；exclude 是 (N,) 布尔掩码，为 True 的图片（如墓碑）不会成为候选
+        """
+        nprobe = min(nprobe, len(self.centroids))
+        probe_scores = query_embed @ self.centroids.T  # (Q, nlist)
+        probes = np.unique(np.argpartition(-probe_scores, nprobe - 1, axis=1)[:, :nprobe])
+
+        lists = [self.list_order[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probes]
+        candidates = np.unique(np.concatenate(lists) // self.vectors_per_image)
+        if exclude is not None and exclude.any():
+            candidates = candidates[~exclude[candidates]]
+        if len(candidates) > candidate_k:
+            scores = maxsim_scores(query_embed, self.vectors[candidates])
+            candidates = np.sort(candidates[np.argpartition(-scores, candidate_k - 1)[:candidate_k]])
+        return candidates
+
+    def save(self, path: str):
+        np.savez(path, centroids=self.centroids, vectors=self.vectors, assignments=self.assignments)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data['centroids'], data['vectors'], data['assignments'])
@@ -0,0 +1,196 @@
+"""
+/api/chat concurrency load test against a local fake OpenAI-compatible server
+Starts three processes: a fake /v1/chat/completions server that streams tokens at a fixed pace, the
+chat app (async: chat_stream.stream_text; sync: the previous OpenAI client + sync generator), and
+the client side here, which opens N concurrent streams and reports completed streams and latency.
+
+python loadtest_chat.py --clients 10 100 500 --modes sync async
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+UPSTREAM_PORT = 61316
+APP_PORT = 61317
+MESSAGES = [{"role": "user", "content": "Tell me a story"}]
+
+
+def fake_upstream_app(tokens: int, token_delay: float):
+    import orjson
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+
+    def chunk(delta: dict, finish_reason=None) -> bytes:
+        return b"data: " + orjson.dumps({
+            "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }) + b"\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        await request.body()
+
+        async def events():
+            yield chunk({"role": "assistant", "content": ""})
+            for i in range(tokens):
+                await asyncio.sleep(token_delay)
+                yield chunk({"content": f" token{i}"})
+            yield chunk({}, "stop")
+            yield b"data: " + orjson.dumps({
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+                "choices": [], "usage": {"prompt_tokens": 10, "completion_tokens": tokens, "total_tokens": tokens + 10},
+            }) + b"\n\n"
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def chat_app(mode: str):
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+
+    if mode == "async":
+        import chat_stream
+        from chat_response import ChatStreamingResponse
+
+        @app.post("/api/chat")
+        async def handle_chat_data(request: Request):
+            body = await request.json()
+            return ChatStreamingResponse(chat_stream.stream_text(body["messages"], {}))
+    else:
+        import json
+        from openai import OpenAI
+
+        client = OpenAI(api_key="sk-xxx", base_url=os.environ["OPENAI_BASE_URL"])
+
+        # The previous stream_text: sync client + sync generator, run in Starlette's threadpool
+        def stream_text(messages):
+            stream = client.chat.completions.create(messages=messages, model="fake", stream=True)
+            for chunk in stream:
+                for choice in chunk.choices:
+                    if choice.finish_reason is None and choice.delta.content:
+                        yield '0:{text}\n'.format(text=json.dumps(choice.delta.content))
+
+        @app.post("/api/chat")
+        async def handle_chat_data(request: Request):
+            body = await request.json()
+            return StreamingResponse(stream_text(body["messages"]))
+
+    return app
+
+
+def serve(role: str, args):
+    import uvicorn
+
+    if role == "upstream":
+        app, port = fake_upstream_app(args.tokens, args.token_delay), UPSTREAM_PORT
+    else:
+        app, port = chat_app(role), APP_PORT
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+
+
+def start(role: str, args) -> subprocess.Popen:
+    # Every client sends the same prompt: keep single-flight off so each one is a real upstream stream,
+    # and the fake upstream has no generation slots for the scheduler to protect
+    env = dict(os.environ, OPENAI_BASE_URL=f"http://127.0.0.1:{UPSTREAM_PORT}/v1", MODEL_SINGLE_FLIGHT="0",
+               MODEL_SLOTS="100000")
+    process = subprocess.Popen(
+        [sys.executable, __file__, "--serve", role, "--tokens", str(args.tokens),
+         "--token-delay", str(args.token_delay)], env=env)
+    port = UPSTREAM_PORT if role == "upstream" else APP_PORT
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs", timeout=0.5)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{role} server did not start")
+
+
+async def one_stream(client: httpx.AsyncClient, results: list):
+    start = time.perf_counter()
+    first = None
+    try:
+        async with client.stream("POST", f"http://127.0.0.1:{APP_PORT}/api/chat",
+                                 json={"messages": MESSAGES}) as response:
+            async for _ in response.aiter_bytes():
+                if first is None:
+                    first = time.perf_counter() - start
+        results.append((first, time.perf_counter() - start))
+    except httpx.HTTPError:
+        results.append(None)
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+async def run_clients(clients: int, timeout: float) -> dict:
+    results = []
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one_stream(client, results) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+    done = [r for r in results if r is not None]
+    return {
+        "ok": len(done),
+        "elapsed": elapsed,
+        "ttft_p50": percentile([f for f, _ in done], 0.5),
+        "ttft_p95": percentile([f for f, _ in done], 0.95),
+        "total_p95": percentile([t for _, t in done], 0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/chat with a fake OpenAI-compatible upstream")
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+    parser.add_argument("--tokens", type=int, default=50, help="Tokens per fake response")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between fake tokens")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args)
+        return
+
+    upstream = start("upstream", args)
+    try:
+        print(f"fake upstream: {args.tokens} tokens every {args.token_delay * 1000:.0f} ms "
+              f"(ideal stream time {args.tokens * args.token_delay:.1f}s)")
+        print(f"{'mode':>6} {'clients':>8} {'ok':>5} {'wall s':>7} {'streams/s':>10} "
+              f"{'TTFT p50':>9} {'TTFT p95':>9} {'total p95':>10}")
+        for mode in args.modes:
+            app = start(mode, args)
+            try:
+                for clients in args.clients:
+                    r = asyncio.run(run_clients(clients, args.timeout))
+                    print(f"{mode:>6} {clients:>8} {r['ok']:>5} {r['elapsed']:>7.2f} "
+                          f"{r['ok'] / r['elapsed']:>10.1f} {r['ttft_p50']:>9.3f} {r['ttft_p95']:>9.3f} "
+                          f"{r['total_p95']:>10.2f}")
+            finally:
+                app.terminate()
+                app.wait()
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Late interaction (MaxSim) 批量打分
+索引以连续的 (N, T, D) 数组存储，按块做一次矩阵乘法完成打分
+"""
+
+import heapq
+import itertools
+from concurrent.futures import Executor
+from typing import List, Tuple
+
+import numpy as np
+
+# 每块处理的图片数量，(chunk_size * T, D) @ (D, Q) 的中间结果保持在几 MB 以内
+DEFAULT_CHUNK_SIZE = 1024
+# 分片并行打分时每个分片至少包含的图片数，太小的分片线程调度开销大于收益
+MIN_SHARD_SIZE = 4096
+
+
+def maxsim_scores(query_embed: np.ndarray, image_embeddings: np.ndarray,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+    """计算查询与所有图片的 MaxSim 分数
+
+    query_embed: (Q, D) 查询 token 向量
+    image_embeddings: (N, T, D) 图片 token 向量
+    返回 (N,) 分数：对每个查询 token 取与图片 token 的最大相似度再求和
+    """
+    n, t, d = image_embeddings.shape
+    scores = np.empty(n, dtype=np.float32)
+    query_t = np.ascontiguousarray(query_embed.T, dtype=image_embeddings.dtype)  # (D, Q)
+
+    for start in range(0, n, chunk_size):
+        chunk = image_embeddings[start:start + chunk_size]
+        m = chunk.shape[0]
+        # (m*T, D) @ (D, Q) -> (m, T, Q)
+        token_similarities = (chunk.reshape(m * t, d) @ query_t).reshape(m, t, -1)
+        scores[start:start + m] = token_similarities.max(axis=1).sum(axis=1)
+
+    return scores
+
+
+def maxsim_scores_batch(query_embeds: List[np.ndarray], image_embeddings: np.ndarray,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+    """多个查询一起打分，返回 (B, N)
+
+    所有查询的 token 拼成一个 (sum Q_i, D) 矩阵，每块图片只做一次矩阵乘法，再按查询分段求和
+    """
+    n, t, d = image_embeddings.shape
+    offsets = np.concatenate([[0], np.cumsum([len(q) for q in query_embeds])[:-1]])
+    query_t = np.ascontiguousarray(np.concatenate(query_embeds).T, dtype=image_embeddings.dtype)
+    scores = np.empty((len(query_embeds), n), dtype=np.float32)
+
+    for start in range(0, n, chunk_size):
+        chunk = image_embeddings[start:start + chunk_size]
+        m = chunk.shape[0]
+        token_similarities = (chunk.reshape(m * t, d) @ query_t).reshape(m, t, -1)
+        scores[:, start:start + m] = np.add.reduceat(token_similarities.max(axis=1), offsets, axis=1).T
+
+    return scores
+
+
+def top_k_indices(scores: np.ndarray, top_k: int, score_threshold: float = None) -> np.ndarray:
+    """返回分数最高的 top_k 个下标（降序），可选按阈值过滤
+
+    使用 argpartition 只对前 top_k 个结果排序，避免对全部分数排序
+    """
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    if score_threshold is not None:
+        candidates = np.flatnonzero(scores >= score_threshold)
+    else:
+        candidates = np.arange(len(scores))
+
+    if len(candidates) > top_k:
+        partitioned = np.argpartition(-scores[candidates], top_k - 1)[:top_k]
+        candidates = candidates[partitioned]
+
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def _shard_top_k(query_embed: np.ndarray, image_embeddings: np.ndarray, start: int, stop: int, top_k: int,
+                 score_threshold: float, exclude: np.ndarray) -> Tuple[List[Tuple[float, int]], int]:
+    scores = maxsim_scores(query_embed, image_embeddings[start:stop])
+    if exclude is not None:
+        scores[exclude[start:stop]] = -np.inf
+    if score_threshold is None:
+        # 墓碑行的分数是 -inf，不算匹配，也不进入结果
+        matched = int(np.count_nonzero(np.isfinite(scores)))
+    else:
+        matched = int(np.count_nonzero(scores >= score_threshold))
+    top = top_k_indices(scores, top_k, score_threshold)
+    return [(float(scores[i]), start + int(i)) for i in top if np.isfinite(scores[i])], matched
+
+
+def sharded_top_k(query_embed: np.ndarray, image_embeddings: np.ndarray, top_k: int,
+                  score_threshold: float = None, exclude: np.ndarray = None, executor: Executor = None,
+                  num_shards: int = 1) -> Tuple[np.ndarray, np.ndarray, int]:
+    """把 (N, T, D) 索引按行切成 num_shards 个分片并行打分，每个分片各取 top_k，再用堆归并
+    
+    numpy 的矩阵乘法和归约会释放 GIL，线程池即可利用多个核心；exclude 为 True 的行（墓碑）不参与排序
+    返回 (行号, 分数, 超过阈值的行数)，行号按分数降序，与 top_k_indices 的结果一致
+    """
+    n = len(image_embeddings)
+    num_shards = max(1, min(num_shards, n // MIN_SHARD_SIZE))
+    bounds = np.linspace(0, n, num_shards + 1).astype(int)
+    args = [(query_embed, image_embeddings, start, stop, top_k, score_threshold, exclude)
+            for start, stop in zip(bounds[:-1], bounds[1:])]
+    
+    if executor is None or num_shards == 1:
+        shard_results = [_shard_top_k(*a) for a in args]
+    else:
+        shard_results = list(executor.map(lambda a: _shard_top_k(*a), args))
+    
+    # 每个分片的结果已按分数降序（同分按行号升序），归并后取前 top_k
+    merged = list(itertools.islice(
+        heapq.merge(*(top for top, _ in shard_results), key=lambda item: (-item[0], item[1])), top_k))
+    indices = np.array([i for _, i in merged], dtype=np.int64)
+    scores = np.array([score for score, _ in merged], dtype=np.float32)
+    return indices, scores, sum(matched for _, matched in shard_results)
@@ -0,0 +1,397 @@
+"""
+Shared registry of OpenAI-compatible inference servers (LM Studio, Ollama, llama.cpp, ...)
+Each backend owns one pooled httpx.AsyncClient and AsyncOpenAI client for the whole process. Streams
+go to the healthy backend with the fewest outstanding requests that serves the model; a backend that
+refuses connections is skipped for a while and the request fails over to the next one. Identical
+streams requested while one is in flight share it (single_flight, MODEL_SINGLE_FLIGHT=0 turns it off),
+and every upstream call first waits for a generation slot of its priority class (model_scheduler).
+Callers that keep one OpenAI client (pydantic-ai agents) get router.openai_client(): its requests go
+through RouterTransport, which picks the backend per request with the same balancing, failover,
+outstanding accounting and scheduler slots; only single-flight sharing is left to chat_completion_stream.
+
+MODEL_BACKENDS="lmstudio=http://localhost:1234/v1,ollama=http://localhost:11434/v1"
+Without MODEL_BACKENDS there is one backend at OPENAI_BASE_URL (default LM Studio on localhost:1234).
+"""
+
+import asyncio
+import importlib.util
+import itertools
+import json
+import os
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from model_scheduler import Scheduler
+from single_flight import SingleFlight, request_key
+
+DEFAULT_BASE_URL = "http://localhost:1234/v1"
+# Remote endpoints go through the local proxy, LAN / localhost servers are reached directly
+LOCAL_HOSTS = ["localhost", "127.0.0.", "172.16.", "192.168."]
+PROXY = os.environ.get("MODEL_PROXY", "http://127.0.0.1:7890")
+
+MAX_CONNECTIONS = int(os.environ.get("CHAT_MAX_CONNECTIONS", "1000"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("CHAT_MAX_KEEPALIVE_CONNECTIONS", "100"))
+HEALTH_CHECK_INTERVAL = float(os.environ.get("MODEL_HEALTH_CHECK_INTERVAL", "10"))
+# A backend that failed is not tried again for this long, unless no other backend is left
+RETRY_AFTER = float(os.environ.get("MODEL_RETRY_AFTER", "5"))
+
+
+def is_local(base_url: str) -> bool:
+    return any(host in base_url for host in LOCAL_HOSTS)
+
+
+class Backend:
+    def __init__(self, name: str, base_url: str, api_key: str = "sk-xxx", max_retries: int = 2,
+                 client: AsyncOpenAI = None, http_client: httpx.AsyncClient = None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        # Raw HTTP client of the backend, used by RouterTransport; closed with the backend only if created here
+        self.http_client = http_client
+        self._owns_http_client = False
+        if client is None and http_client is None:
+            self._owns_http_client = True
+            self.http_client = httpx.AsyncClient(
+                # HTTP/2 multiplexes streams over one connection when the h2 package (httpx[http2]) is installed
+                http2=importlib.util.find_spec("h2") is not None,
+                proxy=None if is_local(base_url) else PROXY,
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                                    keepalive_expiry=30.0),
+                # Long read timeout: local models can pause for a while between tokens
+                timeout=httpx.Timeout(connect=5.0, read=300.0, write=30.0, pool=30.0),
+            )
+        if client is None:
+            client = AsyncOpenAI(api_key=api_key, base_url=self.base_url, max_retries=max_retries,
+                                 http_client=self.http_client)
+        self.client = client
+        # Requests currently streaming from this backend
+        self.outstanding = 0
+        self.healthy = True
+        self.down_until = 0.0
+        # Model ids reported by /models; None until the first health check
+        self.models: Optional[set] = None
+
+    def serves(self, model: Optional[str]) -> bool:
+        return model is None or self.models is None or model in self.models
+
+    def available(self, now: float) -> bool:
+        return self.healthy or now >= self.down_until
+
+    def mark_down(self, error: Exception):
+        if self.healthy:
+            print(f"Model backend {self.name} ({self.base_url}) is down: {error}")
+        self.healthy = False
+        self.down_until = time.monotonic() + RETRY_AFTER
+
+    def mark_up(self):
+        if not self.healthy:
+            print(f"Model backend {self.name} ({self.base_url}) is back")
+        self.healthy = True
+
+    async def check(self, timeout: float = 2.0):
+        """Health check: list the models, which also tells which backend serves what"""
+        try:
+            page = await self.client.with_options(timeout=timeout, max_retries=0).models.list()
+        except (openai.APIConnectionError, openai.InternalServerError) as e:
+            self.mark_down(e)
+            return
+        except openai.APIStatusError:
+            # Reachable, but without a model list: route every model here
+            self.models = None
+        else:
+            self.models = {model.id for model in page.data}
+        self.mark_up()
+
+    async def aclose(self):
+        if self._owns_http_client:
+            await self.http_client.aclose()
+
+
+class LeasedStream:
+    """Chunks of one upstream completion; reaching the end or closing it (also before the first chunk)
+    closes the HTTP response, which makes the inference server stop generating, and releases the backend"""
+
+    def __init__(self, backend: Backend, stream, release_slot: Callable[[], None] = None):
+        self.backend = backend
+        self._stream = stream
+        self._release_slot = release_slot
+        self._chunks = stream.__aiter__()
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._chunks.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if not self._released:
+            self._released = True
+            self.backend.outstanding -= 1
+            if self._release_slot is not None:
+                self._release_slot()
+            await self._stream.close()
+
+
+class ModelRouter:
+    def __init__(self, backends: List[Backend], single_flight: bool = True, scheduler: Scheduler = None):
+        if not backends:
+            raise ValueError("ModelRouter needs at least one backend")
+        self.backends = backends
+        self.flights = SingleFlight() if single_flight else None
+        self.scheduler = scheduler
+        # Rotates the starting point so equally loaded backends share the requests
+        self._turn = itertools.count()
+        self._health_task = None
+        # Routed clients handed out by openai_client(), one per (priority, tenant, max_retries)
+        self._openai_clients = {}
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        api_key = os.environ.get("OPENAI_API_KEY", "sk-xxx")
+        entries = [entry.strip() for entry in os.environ.get("MODEL_BACKENDS", "").split(",") if entry.strip()]
+        if not entries:
+            entries = [f"default={os.environ.get('OPENAI_BASE_URL', DEFAULT_BASE_URL)}"]
+        # With several backends the router fails over instead of retrying the same one
+        max_retries = 0 if len(entries) > 1 else 2
+        backends = []
+        for entry in entries:
+            name, _, base_url = entry.rpartition("=")
+            backends.append(Backend(name or base_url, base_url, api_key=api_key, max_retries=max_retries))
+        return cls(backends, single_flight=os.environ.get("MODEL_SINGLE_FLIGHT", "1") == "1",
+                   scheduler=Scheduler.from_env())
+
+    def candidates(self, model: Optional[str] = None) -> List[Backend]:
+        """Backends to try, in order: available ones by outstanding requests, then those still marked down"""
+        now = time.monotonic()
+        serving = [backend for backend in self.backends if backend.serves(model)] or self.backends
+        start = next(self._turn) % len(serving)
+        rotated = serving[start:] + serving[:start]
+        available = sorted((b for b in rotated if b.available(now)), key=lambda b: b.outstanding)
+        return available + [b for b in rotated if not b.available(now)]
+
+    def openai_client(self, priority: str = "interactive", tenant: str = "", max_retries: int = 2) -> AsyncOpenAI:
+        """OpenAI client whose every request is routed to a backend, for callers that keep one client
+        (pydantic-ai agents); the same settings always return the same client, closed by aclose()"""
+        key = (priority, tenant, max_retries)
+        client = self._openai_clients.get(key)
+        if client is None:
+            client = self._openai_clients[key] = AsyncOpenAI(
+                api_key=self.backends[0].api_key, base_url=RouterTransport.BASE_URL, max_retries=max_retries,
+                http_client=httpx.AsyncClient(transport=RouterTransport(self, priority, tenant), timeout=None))
+        return client
+
+    async def chat_completion_stream(self, priority: str = "interactive", tenant: str = "", **kwargs):
+        """Open a streaming chat completion on the least loaded backend, failing over on connection errors
+
+        Returns a LeasedStream, which holds the backend and the scheduler slot until it is read to the
+        end or closed, or with single-flight a FlightStream on the shared upstream of an identical request.
+        """
+        if self.flights is not None:
+            return await self.flights.stream(request_key(**kwargs),
+                                             lambda: self._open_stream(priority, tenant, kwargs))
+        return await self._open_stream(priority, tenant, kwargs)
+
+    async def chat_completion(self, body: dict, priority: str = "batch", tenant: str = "") -> dict:
+        """Non-streaming chat completion passed through as raw JSON (docling picture descriptions, VLM pages)"""
+        release_slot = await self._acquire_slot(priority, tenant)
+        try:
+            backend, response = await self._on_backend(
+                body.get("model"), lambda backend: backend.client.post("/chat/completions", body=body, cast_to=object))
+            backend.outstanding -= 1
+        finally:
+            release_slot()
+        return response
+
+    async def _acquire_slot(self, priority: str, tenant: str) -> Callable[[], None]:
+        if self.scheduler is None:
+            return lambda: None
+        return await self.scheduler.acquire(priority, tenant)
+
+    async def _open_stream(self, priority: str, tenant: str, kwargs: dict) -> LeasedStream:
+        release_slot = await self._acquire_slot(priority, tenant)
+        try:
+            backend, stream = await self._on_backend(
+                kwargs.get("model"), lambda backend: backend.client.chat.completions.create(stream=True, **kwargs))
+        except BaseException:
+            release_slot()
+            raise
+        return LeasedStream(backend, stream, release_slot)
+
+    async def _on_backend(self, model: Optional[str], call: Callable[[Backend], Awaitable]):
+        """Run call(backend) on the candidates in turn until one does not fail with a connection or 5xx error
+
+        Returns (backend, result) with backend.outstanding incremented; the caller decrements it when done.
+        """
+        last_error = None
+        for backend in self.candidates(model):
+            backend.outstanding += 1
+            try:
+                result = await call(backend)
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                backend.outstanding -= 1
+                if isinstance(e, openai.APIConnectionError):
+                    backend.mark_down(e)
+                last_error = e
+                continue
+            except BaseException:
+                backend.outstanding -= 1
+                raise
+            backend.mark_up()
+            return backend, result
+        raise last_error
+
+    def status(self) -> list:
+        return [{
+            "name": backend.name,
+            "base_url": backend.base_url,
+            "healthy": backend.healthy,
+            "outstanding": backend.outstanding,
+            "models": None if backend.models is None else sorted(backend.models),
+        } for backend in self.backends]
+
+    def single_flight_stats(self) -> Optional[dict]:
+        if self.flights is None:
+            return None
+        return {"in_flight": len(self.flights), "opened": self.flights.opened, "joined": self.flights.joined}
+
+    async def check_health(self):
+        await asyncio.gather(*(backend.check() for backend in self.backends))
+
+    async def _health_loop(self, interval: float):
+        while True:
+            await self.check_health()
+            await asyncio.sleep(interval)
+
+    def start_health_checks(self, interval: float = HEALTH_CHECK_INTERVAL):
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop(interval))
+
+    async def aclose(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.wait([self._health_task])
+            self._health_task = None
+        clients, self._openai_clients = list(self._openai_clients.values()), {}
+        await asyncio.gather(*(client.close() for client in clients))
+        await asyncio.gather(*(backend.aclose() for backend in self.backends))
+
+
+class _LeasedBody(httpx.AsyncByteStream):
+    """Body of a routed response; closing it closes the upstream response and releases the backend"""
+
+    def __init__(self, response: httpx.Response, release: Callable[[], None]):
+        self._response = response
+        self._release = release
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._response.stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self._released:
+            self._released = True
+            self._release()
+            await self._response.aclose()
+
+
+class RouterTransport(httpx.AsyncBaseTransport):
+    """httpx transport of router.openai_client(): sends each request to the least loaded backend serving
+    its model, failing over on connection errors and 5xx responses; the backend and the scheduler slot are
+    held until the response body is read or closed"""
+
+    BASE_URL = "http://model-router/v1"
+
+    def __init__(self, router: "ModelRouter", priority: str = "interactive", tenant: str = ""):
+        self.router = router
+        self.priority = priority
+        self.tenant = tenant
+
+    @staticmethod
+    def _model(request: httpx.Request) -> Optional[str]:
+        if not request.content:
+            return None
+        try:
+            body = json.loads(request.content)
+        except ValueError:
+            return None
+        return body.get("model") if isinstance(body, dict) else None
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.raw_path.decode()
+        prefix = httpx.URL(self.BASE_URL).raw_path.decode()
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+        headers = [(key, value) for key, value in request.headers.raw if key.lower() != b"host"]
+        release_slot = await self.router._acquire_slot(self.priority, self.tenant)
+        last_error = None
+        try:
+            candidates = [backend for backend in self.router.candidates(self._model(request))
+                          if backend.http_client is not None]
+            for backend in candidates:
+                upstream = backend.http_client.build_request(request.method, backend.base_url + path,
+                                                             headers=headers, content=request.content)
+                backend.outstanding += 1
+                try:
+                    response = await backend.http_client.send(upstream, stream=True)
+                except httpx.TransportError as e:
+                    backend.outstanding -= 1
+                    backend.mark_down(e)
+                    last_error = e
+                    continue
+                except BaseException:
+                    backend.outstanding -= 1
+                    raise
+                if response.status_code >= 500 and backend is not candidates[-1]:
+                    # Like InternalServerError in _on_backend: try the next backend, the last one's error is returned
+                    await response.aclose()
+                    backend.outstanding -= 1
+                    continue
+                backend.mark_up()
+
+                def release(backend=backend):
+                    backend.outstanding -= 1
+                    release_slot()
+
+                return httpx.Response(response.status_code, headers=response.headers,
+                                      stream=_LeasedBody(response, release), request=request,
+                                      extensions=response.extensions)
+        except BaseException:
+            release_slot()
+            raise
+        release_slot()
+        if last_error is None:
+            raise httpx.ConnectError("No model backend with an HTTP client", request=request)
+        raise last_error
+
+
+def openai_model(model_name: str, model_router: ModelRouter = None):
+    """pydantic-ai OpenAIModel whose requests are routed by ModelRouter, with the profile local servers need"""
+    from pydantic_ai.models.openai import OpenAIModel
+    from pydantic_ai.profiles import InlineDefsJsonSchemaTransformer
+    from pydantic_ai.profiles.openai import OpenAIModelProfile
+    from pydantic_ai.providers.openai import OpenAIProvider
+
+    return OpenAIModel(
+        model_name=model_name,
+        provider=OpenAIProvider(
+            openai_client=(model_router or router).openai_client(),
+        ),
+        profile=OpenAIModelProfile(
+            json_schema_transformer=InlineDefsJsonSchemaTransformer,  # Supported by any model class on a plain ModelProfile
+            openai_supports_strict_tool_definition=False  # Supported by OpenAIModel only, requires OpenAIModelProfile
+        )
+    )
+
+
+router = ModelRouter.from_env()
@@ -0,0 +1,109 @@
+"""
+Priority scheduler for requests to the local inference servers
+Interactive /api/chat streams, docling picture descriptions (background) and VLM OCR pages (batch)
+share the same generation slots. Each request waits for a slot in its priority class:
+- classes are served in priority order, each with its own concurrency limit
+- `reserved` slots are only ever given to interactive requests, so a chat never queues behind a
+  PDF conversion for longer than it takes one slot to free up
+- inside a class, tenants (one document, one client) take turns, so one big job does not starve the others
+"""
+
+import asyncio
+import functools
+import os
+from collections import OrderedDict, deque
+from typing import Callable, Dict
+
+PRIORITIES = ("interactive", "background", "batch")
+
+
+class Scheduler:
+    def __init__(self, slots: int = 4, limits: Dict[str, int] = None, reserved: int = 1):
+        if slots < 1 or not 0 <= reserved < slots:
+            raise ValueError(f"Scheduler needs at least one slot and fewer reserved slots, got {slots} / {reserved}")
+        self.slots = slots
+        self.reserved = reserved
+        self.limits = {priority: slots for priority in PRIORITIES}
+        for priority, limit in (limits or {}).items():
+            self._check(priority)
+            self.limits[priority] = limit
+        self.running = {priority: 0 for priority in PRIORITIES}
+        # priority -> tenant -> waiting futures; tenants are served round-robin
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}
+
+    @classmethod
+    def from_env(cls) -> "Scheduler":
+        """MODEL_SLOTS should match the parallel requests of the inference server (LM Studio: max concurrent
+        predictions); without MODEL_BACKGROUND_LIMIT / MODEL_BATCH_LIMIT background work may use every
+        slot but the reserved ones"""
+        limits = {}
+        for priority, name in (("background", "MODEL_BACKGROUND_LIMIT"), ("batch", "MODEL_BATCH_LIMIT")):
+            if os.environ.get(name):
+                limits[priority] = int(os.environ[name])
+        return cls(
+            slots=int(os.environ.get("MODEL_SLOTS", "4")),
+            limits=limits,
+            reserved=int(os.environ.get("MODEL_RESERVED_SLOTS", "1")),
+        )
+
+    @staticmethod
+    def _check(priority: str):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority}, expected one of {', '.join(PRIORITIES)}")
+
+    def _can_start(self, priority: str) -> bool:
+        if self.running[priority] >= self.limits[priority]:
+            return False
+        free = self.slots - sum(self.running.values())
+        return free > (0 if priority == "interactive" else self.reserved)
+
+    def _dispatch(self):
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue and self._can_start(priority):
+                tenant, waiters = next(iter(queue.items()))
+                future = waiters.popleft()
+                if waiters:
+                    queue.move_to_end(tenant)
+                else:
+                    del queue[tenant]
+                if future.done():
+                    # Cancelled waiter whose task has not run its cleanup yet
+                    continue
+                self.running[priority] += 1
+                future.set_result(None)
+
+    async def acquire(self, priority: str = "interactive", tenant: str = "") -> Callable[[], None]:
+        """Wait for a slot; returns the function that gives it back"""
+        self._check(priority)
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(tenant, deque()).append(future)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted in the same step it was cancelled
+                self.release(priority)
+            else:
+                waiters = self._queues[priority].get(tenant)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._queues[priority][tenant]
+            raise
+        return functools.partial(self.release, priority)
+
+    def release(self, priority: str):
+        self.running[priority] -= 1
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            priority: {
+                "running": self.running[priority],
+                "waiting": sum(len(waiters) for waiters in self._queues[priority].values()),
+                "limit": self.limits[priority],
+            }
+            for priority in PRIORITIES
+        }
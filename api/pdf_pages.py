@@ -0,0 +1,41 @@
+"""
+PDF 页面的基本信息（只依赖 pypdfium2，不需要 docling）：页数，以及与页在文档中位置无关的单页内容哈希
+"""
+
+import hashlib
+import io
+import re
+from pathlib import Path
+from typing import List, Union
+
+import pypdfium2
+
+# pdfium 每次保存都会生成新的 /ID 和 /CreationDate，哈希前去掉，否则同一页每次的哈希都不同
+_VOLATILE = re.compile(rb"/ID\s*\[\s*<[0-9A-Fa-f]*>\s*<[0-9A-Fa-f]*>\s*\]|/(?:CreationDate|ModDate)\s*\([^)]*\)")
+
+
+def page_count(source: Union[str, Path]) -> int:
+    pdf = pypdfium2.PdfDocument(str(source))
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def page_hashes(source: Union[str, Path]) -> List[str]:
+    """每一页单独导出成一个 PDF（去掉每次保存都会变的字段）后的 sha256"""
+    pdf = pypdfium2.PdfDocument(str(source))
+    try:
+        hashes = []
+        for index in range(len(pdf)):
+            single = pypdfium2.PdfDocument.new()
+            try:
+                single.import_pages(pdf, [index])
+                buffer = io.BytesIO()
+                single.save(buffer)
+            finally:
+                single.close()
+            hashes.append(hashlib.sha256(_VOLATILE.sub(b"", buffer.getvalue())).hexdigest())
+        return hashes
+    finally:
+        pdf.close()
@@ -0,0 +1,178 @@
+"""
+PDF 图片描述的并发请求
+docling 自带的 picture description 逐张图片串行请求 VLM。这里在转换之后统一处理文档里的图片
+（pipeline_options.do_picture_description = False，generate_picture_images = True）：
+- 最多 max_in_flight 个请求同时在途，默认在进程内经 model_router.router.chat_completion 以 background 优先级发出，
+  和同一进程的 /v1/chat/completions、/api/chat 共用调度器，聊天的保留槽位不会被图片描述占用；
+  设置了 url 时改为发给那个 OpenAI 兼容接口（带 X-Priority: background）
+- 内容相同的图片（PNG 字节的 sha256）只请求一次，正在请求中的也会被后来的文档复用
+- 描述按 (图片哈希, prompt, 模型, 参数) 缓存在磁盘上，重新转换同一文档时不再请求
+
+    describer = PictureDescriber("google/gemma-3-4b", params=dict(temperature=0.2, max_completion_tokens=250))
+    await describer.describe_document(doc, tenant="paper.pdf")
+/documents/convert 在设置了 PICTURE_DESCRIPTION_MODEL 时用它给每页的图片加描述（见 conversion_api.py）
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from response_cache import canonical_json
+
+_log = logging.getLogger(__name__)
+
+# 不设置时在进程内经模型路由器请求；也可以填另一个进程的 /v1/chat/completions（completions_api）
+# 或直接填 LM Studio 的 http://localhost:1234/v1/chat/completions
+PICTURE_DESCRIPTION_URL = os.environ.get("PICTURE_DESCRIPTION_URL")
+PICTURE_DESCRIPTION_MODEL = os.environ.get("PICTURE_DESCRIPTION_MODEL")
+PICTURE_DESCRIPTION_CONCURRENCY = int(os.environ.get("PICTURE_DESCRIPTION_CONCURRENCY", "4"))
+PICTURE_DESCRIPTION_CACHE_DIR = os.environ.get(
+    "PICTURE_DESCRIPTION_CACHE_DIR", os.path.join(os.environ.get("CONVERSION_CACHE_DIR", "conversion_cache"), "descriptions"))
+DEFAULT_PROMPT = """
+You are an assistant tasked with summarizing images for retrieval.
+These summaries will be embedded and used to retrieve the raw image.
+Give a concise summary of the image that is well optimized for retrieval.
+""".strip()
+
+
+class DescriptionCache:
+    """每条描述一个小文件：<key>.txt"""
+
+    def __init__(self, cache_dir: str = PICTURE_DESCRIPTION_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.cache_dir / f"{key}.txt"
+        return path.read_text(encoding="utf-8") if path.exists() else None
+
+    def set(self, key: str, text: str):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.cache_dir / f"{key}.txt"
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, path)
+
+
+class PictureDescriber:
+    def __init__(self, model: str, prompt: str = DEFAULT_PROMPT, params: dict = None,
+                 max_in_flight: int = PICTURE_DESCRIPTION_CONCURRENCY, cache: Optional[DescriptionCache] = None,
+                 url: Optional[str] = PICTURE_DESCRIPTION_URL, timeout: float = 180, client: httpx.AsyncClient = None,
+                 model_router=None):
+        self.model = model
+        self.prompt = prompt
+        self.params = params or {}
+        self.max_in_flight = max_in_flight
+        self.cache = cache if cache is not None else DescriptionCache()
+        self.url = url
+        self.client = client
+        if url is not None and client is None:
+            self.client = httpx.AsyncClient(timeout=timeout)
+        self.model_router = model_router
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        # key -> 正在请求的描述，同一张图片的后续请求直接等它
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.stats = {"requested": 0, "cached": 0, "deduplicated": 0, "failed": 0}
+
+    def key(self, image_hash: str) -> str:
+        return hashlib.sha256(canonical_json([image_hash, self.prompt, self.model, self.params]).encode()).hexdigest()
+
+    async def describe_images(self, images: List[bytes], tenant: str = "") -> List[Optional[str]]:
+        """images 为 PNG 字节；返回与之对应的描述，请求失败的为 None"""
+        keys = [self.key(hashlib.sha256(png).hexdigest()) for png in images]
+        futures = []
+        for key, png in zip(keys, images):
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = asyncio.ensure_future(self._describe(key, png, tenant))
+                future.add_done_callback(lambda _, key=key: self._pending.pop(key, None))
+            else:
+                self.stats["deduplicated"] += 1
+            futures.append(future)
+        # shield：一个调用方被取消时，别的文档可能还在等同一个请求
+        results = await asyncio.gather(*(asyncio.shield(future) for future in futures), return_exceptions=True)
+        descriptions = []
+        for result in results:
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            descriptions.append(None if isinstance(result, BaseException) else result)
+        return descriptions
+
+    async def _describe(self, key: str, png: bytes, tenant: str) -> str:
+        text = self.cache.get(key)
+        if text is not None:
+            self.stats["cached"] += 1
+            return text
+        image_url = f"data:image/png;base64,{base64.b64encode(png).decode()}"
+        body = {
+            **self.params,
+            "model": self.model,
+            "messages": [{"role": "user", "content": [
+                {"type": "text", "text": self.prompt},
+                {"type": "image_url", "image_url": {"url": image_url}},
+            ]}],
+        }
+        try:
+            async with self._in_flight:
+                self.stats["requested"] += 1
+                completion = await self._complete(body, tenant)
+            text = completion["choices"][0]["message"]["content"].strip()
+        except Exception as e:
+            _log.warning(f"Picture description failed: {e}")
+            self.stats["failed"] += 1
+            raise
+        self.cache.set(key, text)
+        return text
+
+    async def _complete(self, body: dict, tenant: str) -> dict:
+        if self.url is None:
+            if self.model_router is None:
+                # 延迟导入：model_router 导入时读取 MODEL_BACKENDS 等环境变量
+                from model_router import router
+                self.model_router = router
+            return await self.model_router.chat_completion(body, priority="background", tenant=tenant)
+        response = await self.client.post(self.url, json=body, headers={"X-Priority": "background", "X-Tenant": tenant})
+        response.raise_for_status()
+        return response.json()
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+
+    async def describe_document(self, doc, tenant: str = "") -> int:
+        """给 DoclingDocument 里有图片的 PictureItem 加上描述注释，返回加上描述的图片数"""
+        pictures, images = picture_images(doc)
+        descriptions = await self.describe_images(images, tenant=tenant)
+        return annotate(pictures, descriptions, self.model)
+
+
+def picture_images(doc) -> Tuple[list, List[bytes]]:
+    """文档里有图片的 PictureItem 和它们的 PNG 字节；编码较慢，在事件循环之外调用"""
+    pictures, images = [], []
+    for picture in doc.pictures:
+        image = picture.get_image(doc)
+        if image is None:
+            continue
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        pictures.append(picture)
+        images.append(buffer.getvalue())
+    return pictures, images
+
+
+def annotate(pictures: list, descriptions: List[Optional[str]], model: str) -> int:
+    # docling_core 只在转换环境里安装，延迟导入
+    from docling_core.types.doc import PictureDescriptionData
+
+    described = 0
+    for picture, text in zip(pictures, descriptions):
+        if text is not None:
+            picture.annotations.append(PictureDescriptionData(text=text, provenance=model))
+            described += 1
+    return described
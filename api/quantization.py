@@ -0,0 +1,175 @@
+"""
+压缩的多向量存储
+    Int8Codes         每个 token 向量按自身最大绝对值缩放到 int8，另存一个 float32 缩放系数（约 4 倍压缩）
+    ProductQuantizer  乘积量化：向量切成 m 段，每段用 256 个码字中的一个表示，每个 token 只占 m 字节
+两者都直接在压缩形式上计算 MaxSim（非对称距离：查询保持 float32，不解压整个索引）
+"""
+
+import numpy as np
+
+from maxsim import DEFAULT_CHUNK_SIZE
+
+
+def _rows(array: np.ndarray, rows: np.ndarray, start: int, chunk_size: int) -> np.ndarray:
+    if rows is None:
+        return array[start:start + chunk_size]
+    return array[rows[start:start + chunk_size]]
+
+
+class Int8Codes:
+    kind = "int8"
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray):
+        self.codes = codes      # (N, T, D) int8
+        self.scales = scales    # (N, T) float32
+
+    @classmethod
+    def encode(cls, embeddings: np.ndarray, chunk_size: int = DEFAULT_CHUNK_SIZE) -> "Int8Codes":
+        n, t, d = embeddings.shape
+        codes = np.empty((n, t, d), dtype=np.int8)
+        scales = np.empty((n, t), dtype=np.float32)
+        for start in range(0, n, chunk_size):
+            chunk = np.asarray(embeddings[start:start + chunk_size], dtype=np.float32)
+            chunk_scales = np.maximum(np.abs(chunk).max(axis=2), 1e-12) / 127.0
+            codes[start:start + chunk_size] = np.rint(chunk / chunk_scales[..., None])
+            scales[start:start + chunk_size] = chunk_scales
+        return cls(codes, scales)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+    def maxsim_scores(self, query_embed: np.ndarray, rows: np.ndarray = None,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        """在 int8 编码上计算 MaxSim，rows 为空时对所有图片打分"""
+        n = len(self) if rows is None else len(rows)
+        _, t, d = self.codes.shape
+        scores = np.empty(n, dtype=np.float32)
+        query_t = np.ascontiguousarray(query_embed.T, dtype=np.float32)  # (D, Q)
+
+        for start in range(0, n, chunk_size):
+            codes = _rows(self.codes, rows, start, chunk_size)
+            m = codes.shape[0]
+            # 每个 token 的点积乘以它自己的缩放系数
+            token_similarities = (codes.reshape(m * t, d).astype(np.float32) @ query_t).reshape(m, t, -1)
+            token_similarities *= _rows(self.scales, rows, start, chunk_size)[..., None]
+            scores[start:start + m] = token_similarities.max(axis=1).sum(axis=1)
+        return scores
+
+    def append(self, embeddings: np.ndarray):
+        encoded = Int8Codes.encode(embeddings)
+        self.codes = np.concatenate([self.codes, encoded.codes])
+        self.scales = np.concatenate([self.scales, encoded.scales])
+
+    def arrays(self) -> dict:
+        return {'codes': self.codes, 'scales': self.scales}
+
+
+def _subspace_kmeans(vectors: np.ndarray, ks: int, iterations: int, rng) -> np.ndarray:
+    centroids = vectors[rng.choice(len(vectors), ks, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest(vectors, centroids)
+        counts = np.bincount(assignments, minlength=ks)
+        sums = np.stack([np.bincount(assignments, weights=vectors[:, k], minlength=ks)
+                         for k in range(vectors.shape[1])], axis=1)
+        empty = counts == 0
+        centroids = np.where(empty[:, None], centroids, sums / np.maximum(counts, 1)[:, None])
+    return centroids
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin ||x - c||^2 = argmax (x·c - ||c||^2 / 2)
+    return np.argmax(vectors @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+
+
+class ProductQuantizer:
+    kind = "pq"
+
+    def __init__(self, codebooks: np.ndarray, codes: np.ndarray):
+        self.codebooks = codebooks  # (m, 256, D/m) float32
+        self.codes = codes          # (N, T, m) uint8
+
+    @property
+    def subspaces(self) -> int:
+        return self.codebooks.shape[0]
+
+    @classmethod
+    def train(cls, embeddings: np.ndarray, subspaces: int = 16, iterations: int = 10,
+              train_size: int = 32768, seed: int = 0) -> "ProductQuantizer":
+        """在采样的 token 向量上为每个子空间训练 256 个码字，并编码全部图片"""
+        n, t, d = embeddings.shape
+        if d % subspaces != 0:
+            raise ValueError(f"Embedding dim {d} is not divisible by {subspaces} subspaces")
+        rng = np.random.default_rng(seed)
+        sample_images = rng.choice(n, min(n, max(1, train_size // t)), replace=False)
+        sample = np.asarray(embeddings[np.sort(sample_images)], dtype=np.float32).reshape(-1, d)
+        ks = min(256, len(sample))
+        sub_dim = d // subspaces
+        codebooks = np.stack([
+            _subspace_kmeans(sample[:, j * sub_dim:(j + 1) * sub_dim], ks, iterations, rng)
+            for j in range(subspaces)
+        ])
+        quantizer = cls(codebooks, np.empty((0, t, subspaces), dtype=np.uint8))
+        quantizer.append(embeddings)
+        return quantizer
+
+    def _encode(self, embeddings: np.ndarray, chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        n, t, d = embeddings.shape
+        sub_dim = d // self.subspaces
+        codes = np.empty((n, t, self.subspaces), dtype=np.uint8)
+        for start in range(0, n, chunk_size):
+            chunk = np.asarray(embeddings[start:start + chunk_size], dtype=np.float32).reshape(-1, d)
+            for j in range(self.subspaces):
+                nearest = _nearest(chunk[:, j * sub_dim:(j + 1) * sub_dim], self.codebooks[j])
+                codes[start:start + chunk_size, :, j] = nearest.reshape(-1, t)
+        return codes
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.codebooks.nbytes
+
+    def maxsim_scores(self, query_embed: np.ndarray, rows: np.ndarray = None,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        """用查找表在 PQ 编码上计算 MaxSim，rows 为空时对所有图片打分"""
+        n = len(self) if rows is None else len(rows)
+        _, t, m = self.codes.shape
+        q = query_embed.shape[0]
+        # lut[j, i, c] = 查询 token i 的第 j 段与码字 c 的点积
+        lut = np.einsum('qjs,jcs->jqc', query_embed.reshape(q, m, -1).astype(np.float32), self.codebooks)
+        scores = np.empty(n, dtype=np.float32)
+
+        for start in range(0, n, chunk_size):
+            codes = _rows(self.codes, rows, start, chunk_size)
+            chunk = codes.shape[0]
+            flat = codes.reshape(chunk * t, m)
+            token_similarities = np.zeros((q, chunk * t), dtype=np.float32)
+            for j in range(m):
+                token_similarities += lut[j][:, flat[:, j]]
+            scores[start:start + chunk] = token_similarities.reshape(q, chunk, t).max(axis=2).sum(axis=0)
+        return scores
+
+    def append(self, embeddings: np.ndarray):
+        self.codes = np.concatenate([self.codes, self._encode(embeddings)])
+
+    def arrays(self) -> dict:
+        return {'codes': self.codes, 'codebooks': self.codebooks}
+
+
+def save_quantized(path: str, quantized):
+    np.savez(path, kind=np.array(quantized.kind), **quantized.arrays())
+
+
+def load_quantized(path: str):
+    with np.load(path) as data:
+        kind = str(data['kind'])
+        if kind == Int8Codes.kind:
+            return Int8Codes(data['codes'], data['scales'])
+        if kind == ProductQuantizer.kind:
+            return ProductQuantizer(data['codebooks'], data['codes'])
+    raise ValueError(f"Unknown quantization kind {kind} in {path}")
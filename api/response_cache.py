@@ -0,0 +1,68 @@
+"""
+TTL + size-bounded LRU cache for /api/chat, with hit-rate and latency counters
+Used for tool results (keyed by tool name + canonical arguments) and for deterministic
+completions (keyed by model, messages, tools and temperature 0), see chat_stream / tool_executor.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+
+def canonical_json(value) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def completion_key(model: str, messages: list, tools: list, temperature) -> str:
+    return hashlib.sha256(canonical_json([model, messages, tools, temperature]).encode()).hexdigest()
+
+
+class TTLCache:
+    def __init__(self, max_entries: int = 256, ttl: float = 3600.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        # Summed latency of requests served from the cache / computed on a miss
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= self.clock():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        self._entries[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def record_latency(self, hit: bool, seconds: float):
+        if hit:
+            self.hit_seconds += seconds
+        else:
+            self.miss_seconds += seconds
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "avg_hit_seconds": self.hit_seconds / self.hits if self.hits else None,
+            "avg_miss_seconds": self.miss_seconds / self.misses if self.misses else None,
+        }
@@ -2,10 +2,6 @@ import asyncio
 from collections.abc import AsyncIterable
 from datetime import date
 from typing import Union
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.profiles import InlineDefsJsonSchemaTransformer
-from pydantic_ai.profiles.openai import OpenAIModelProfile
-from pydantic_ai.providers.openai import OpenAIProvider
 from pydantic_ai import Agent
 from pydantic_ai.messages import (
     AgentStreamEvent,
@@ -20,33 +16,9 @@ from pydantic_ai.messages import (
     ToolCallPartDelta,
 )
 from pydantic_ai.tools import RunContext
-from openai import AsyncOpenAI
-import httpx
+from model_router import openai_model
 
-base_url='http://localhost:1234/v1'
-
-local_ips = ['localhost', '127.0.0.', '172.16.', '192.168.']
-if any(ip in base_url for ip in local_ips):
-    http_client = httpx.AsyncClient()
-else:
-    http_client = httpx.AsyncClient(proxy="http://127.0.0.1:7890")
-
-openai_client = AsyncOpenAI(
-    api_key='sk-xxx',
-    base_url=base_url,
-    max_retries=3,
-    http_client=http_client,
-)
-model = OpenAIModel(
-    model_name='google/gemma-3n-e4b',
-    provider=OpenAIProvider(
-        openai_client=openai_client,
-    ),
-    profile=OpenAIModelProfile(
-        json_schema_transformer=InlineDefsJsonSchemaTransformer,  # Supported by any model class on a plain ModelProfile
-        openai_supports_strict_tool_definition=False  # Supported by OpenAIModel only, requires OpenAIModelProfile
-    )
-)
+model = openai_model('google/gemma-3n-e4b')
 weather_agent = Agent(
     model=model,
     system_prompt='Providing a weather forecast at the locations the user provides.',
@@ -0,0 +1,130 @@
+"""
+Single-flight for streamed model calls: identical requests that are in flight at the same time share
+one upstream stream. The first caller opens it, later callers join and get every chunk from the
+start, then follow along. The upstream is closed when the last caller closes its stream; once the
+flight ends, the next identical request opens a new one (caching finished answers is response_cache's job).
+"""
+
+import asyncio
+import hashlib
+from typing import Awaitable, Callable
+
+from response_cache import canonical_json
+
+
+def request_key(**kwargs) -> str:
+    return hashlib.sha256(canonical_json(kwargs).encode()).hexdigest()
+
+
+class Flight:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.opened = asyncio.get_running_loop().create_future()
+        # Set and cleared on every chunk, which wakes every waiting subscriber
+        self.changed = asyncio.Event()
+        self.task = None
+
+    def notify(self):
+        self.changed.set()
+        self.changed.clear()
+
+
+class FlightStream:
+    """One caller's view of a flight; closing it before the end leaves the flight to the other callers"""
+
+    def __init__(self, group: "SingleFlight", key: str, flight: Flight):
+        self._group = group
+        self._key = key
+        self._flight = flight
+        self._index = 0
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        flight = self._flight
+        try:
+            while self._index >= len(flight.chunks):
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    raise StopAsyncIteration
+                await flight.changed.wait()
+        except BaseException:
+            await self.aclose()
+            raise
+        chunk = flight.chunks[self._index]
+        self._index += 1
+        return chunk
+
+    async def aclose(self):
+        if not self._released:
+            self._released = True
+            await self._group.release(self._key, self._flight)
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        # Upstream streams opened / requests that joined one already in flight
+        self.opened = 0
+        self.joined = 0
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def stream(self, key: str, open_stream: Callable[[], Awaitable]) -> FlightStream:
+        """Join the flight for key, or start it with open_stream(); raises what opening the upstream raised"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = Flight()
+            flight.task = asyncio.create_task(self._pump(key, flight, open_stream))
+            self.opened += 1
+        else:
+            self.joined += 1
+        flight.subscribers += 1
+        try:
+            await asyncio.shield(flight.opened)
+        except BaseException:
+            await self.release(key, flight)
+            raise
+        return FlightStream(self, key, flight)
+
+    async def _pump(self, key: str, flight: Flight, open_stream: Callable[[], Awaitable]):
+        stream = None
+        try:
+            stream = await open_stream()
+            flight.opened.set_result(None)
+            async for chunk in stream:
+                flight.chunks.append(chunk)
+                flight.notify()
+        except asyncio.CancelledError:
+            if not flight.opened.done():
+                flight.opened.cancel()
+            raise
+        except Exception as e:
+            flight.error = e
+            if not flight.opened.done():
+                flight.opened.set_exception(e)
+        finally:
+            flight.done = True
+            flight.notify()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            # LeasedStream / async generators have aclose(), a bare openai AsyncStream has close()
+            close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+            if close is not None:
+                await close()
+
+    async def release(self, key: str, flight: Flight):
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.done:
+            # Nobody is reading any more: stop the upstream
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.task.cancel()
+            await asyncio.wait([flight.task])
@@ -0,0 +1,291 @@
+"""
+AI SDK data stream protocol encoder
+https://ai-sdk.dev/docs/ai-sdk-ui/stream-protocol#data-stream-protocol
+
+Each part is one line `<type>:<json>\n`:
+    0:  text delta
+    9:  tool call
+    a:  tool result
+    e:  finish step (one per model call in the tool loop)
+    d:  finish message (reason + usage)
+Parts are encoded straight to bytes with orjson and coalesced into larger frames,
+so a long answer is written in a few hundred sends instead of one per token.
+Every generator here closes the one it reads from when it stops early, down to the upstream
+response, so an abandoned response does not keep the model generating.
+"""
+
+import asyncio
+import json
+import time
+from contextlib import aclosing
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Optional
+
+from tool_executor import run_tool_calls
+
+try:
+    import orjson
+
+    def dumps(value) -> bytes:
+        return orjson.dumps(value)
+except ImportError:  # orjson is optional, stdlib json gives the same protocol output
+    def dumps(value) -> bytes:
+        return json.dumps(value, separators=(",", ":")).encode()
+
+
+# Default frame budget: flush at least every 16 ms or once 4 KB is buffered
+FRAME_MAX_BYTES = 4096
+FRAME_MAX_DELAY = 0.016
+
+
+def text_part(text: str) -> bytes:
+    return b"0:" + dumps(text) + b"\n"
+
+
+def _raw_args(args) -> bytes:
+    # Tool call arguments arrive from the model as a JSON string and are passed through unparsed
+    if isinstance(args, str):
+        return args.encode() if args else b"{}"
+    return dumps(args)
+
+
+def tool_call_part(tool_call_id: str, tool_name: str, args) -> bytes:
+    return (b'9:{"toolCallId":' + dumps(tool_call_id) + b',"toolName":' + dumps(tool_name)
+            + b',"args":' + _raw_args(args) + b"}\n")
+
+
+def tool_result_part(tool_call_id: str, tool_name: str, args, result) -> bytes:
+    return (b'a:{"toolCallId":' + dumps(tool_call_id) + b',"toolName":' + dumps(tool_name)
+            + b',"args":' + _raw_args(args) + b',"result":' + dumps(result) + b"}\n")
+
+
+def finish_part(reason: str, prompt_tokens: int, completion_tokens: int) -> bytes:
+    return b"d:" + dumps({
+        "finishReason": reason,
+        "usage": {"promptTokens": prompt_tokens, "completionTokens": completion_tokens},
+    }) + b"\n"
+
+
+def finish_step_part(reason: str, prompt_tokens: int, completion_tokens: int) -> bytes:
+    return b"e:" + dumps({
+        "finishReason": reason,
+        "usage": {"promptTokens": prompt_tokens, "completionTokens": completion_tokens},
+        "isContinued": False,
+    }) + b"\n"
+
+
+async def aclose_stream(stream):
+    """Close an upstream chunk stream or part generator that may not have been read to the end"""
+    aclose = getattr(stream, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+class Step:
+    """One model call: the streamed text, tool calls, their results and token usage"""
+
+    def __init__(self):
+        self.text = []
+        self.tool_calls = []
+        self.tool_results = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @property
+    def finish_reason(self) -> str:
+        return "tool-calls" if self.tool_calls else "stop"
+
+    def messages(self) -> list:
+        """The assistant tool-call message and one tool message per result, to continue the conversation"""
+        messages = [{
+            "role": "assistant",
+            "content": "".join(self.text) or None,
+            "tool_calls": [
+                {"id": tool_call["id"], "type": "function",
+                 "function": {"name": tool_call["name"], "arguments": tool_call["arguments"]}}
+                for tool_call in self.tool_calls
+            ],
+        }]
+        for tool_call in self.tool_calls:
+            messages.append({
+                "role": "tool",
+                "tool_call_id": tool_call["id"],
+                "content": dumps(self.tool_results.get(tool_call["id"])).decode(),
+            })
+        return messages
+
+
+async def step_parts(stream, available_tools: dict, step: Step) -> AsyncIterator[bytes]:
+    """Translate the OpenAI chat completion chunks of one model call into data stream parts, recording them in step"""
+    try:
+        async for part in _step_parts(stream, available_tools, step):
+            yield part
+    finally:
+        await aclose_stream(stream)
+
+
+async def _step_parts(stream, available_tools: dict, step: Step) -> AsyncIterator[bytes]:
+    draft_tool_calls = step.tool_calls
+    draft_tool_calls_index = -1
+
+    async for chunk in stream:
+        for choice in chunk.choices:
+            if choice.finish_reason == "stop":
+                continue
+
+            elif choice.finish_reason == "tool_calls":
+                for tool_call in draft_tool_calls:
+                    yield tool_call_part(tool_call["id"], tool_call["name"], tool_call["arguments"])
+
+                # Independent calls run concurrently, each result is sent as soon as it is ready
+                async for tool_call, tool_result in run_tool_calls(draft_tool_calls, available_tools):
+                    step.tool_results[tool_call["id"]] = tool_result
+                    yield tool_result_part(tool_call["id"], tool_call["name"], tool_call["arguments"], tool_result)
+
+            elif choice.delta.tool_calls:
+                for tool_call in choice.delta.tool_calls:
+                    id = tool_call.id
+                    name = tool_call.function.name
+                    arguments = tool_call.function.arguments
+
+                    if (id is not None):
+                        draft_tool_calls_index += 1
+                        draft_tool_calls.append(
+                            {"id": id, "name": name, "arguments": arguments or ""})
+
+                    else:
+                        draft_tool_calls[draft_tool_calls_index]["arguments"] += arguments
+
+            elif choice.delta.content:
+                step.text.append(choice.delta.content)
+                yield text_part(choice.delta.content)
+
+        if chunk.choices == [] and chunk.usage is not None:
+            step.prompt_tokens = chunk.usage.prompt_tokens
+            step.completion_tokens = chunk.usage.completion_tokens
+
+
+async def agent_stream_parts(create_stream: Callable[[list], Awaitable], messages: list, available_tools: dict,
+                             max_steps: int, new_messages: list = None) -> AsyncIterator[bytes]:
+    """Tool loop inside one response
+
+    After a step that called tools, the tool results are appended to the conversation and the model
+    is called again, up to max_steps model calls. Each step ends with an e: part, the response with
+    one d: part carrying the usage summed over all steps. The OpenAI messages generated by the loop
+    are appended to new_messages.
+    """
+    if new_messages is None:
+        new_messages = []
+    prompt_tokens = completion_tokens = 0
+    for step_number in range(1, max_steps + 1):
+        step = Step()
+        async with aclosing(step_parts(await create_stream(messages), available_tools, step)) as parts:
+            async for part in parts:
+                yield part
+        prompt_tokens += step.prompt_tokens
+        completion_tokens += step.completion_tokens
+        yield finish_step_part(step.finish_reason, step.prompt_tokens, step.completion_tokens)
+        if not step.tool_calls:
+            new_messages.append({"role": "assistant", "content": "".join(step.text)})
+            break
+        new_messages.extend(step.messages())
+        messages = messages + step.messages()
+    yield finish_part(step.finish_reason, prompt_tokens, completion_tokens)
+
+
+class FrameCoalescer:
+    """Buffers encoded parts and releases them as frames on a byte/time budget
+
+    A frame is released when the buffer reaches max_bytes, when max_delay has passed since the
+    last frame, or when the caller asks for it (tool and finish parts). The first part after an
+    idle period therefore goes out immediately; only bursts of fast deltas get merged.
+    """
+
+    def __init__(self, max_bytes: int = FRAME_MAX_BYTES, max_delay: float = FRAME_MAX_DELAY,
+                 clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.clock = clock
+        self._parts = []
+        self._size = 0
+        self._last_flush = float("-inf")
+
+    def __len__(self) -> int:
+        return self._size
+
+    def deadline(self) -> float:
+        """Time by which the buffered parts should go out"""
+        return self._last_flush + self.max_delay
+
+    def add(self, part: bytes, flush: bool = False) -> Optional[bytes]:
+        """Buffer a part, returns a frame when the budget is exceeded"""
+        self._parts.append(part)
+        self._size += len(part)
+        if flush or self._size >= self.max_bytes or self.clock() - self._last_flush >= self.max_delay:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[bytes]:
+        self._last_flush = self.clock()
+        if not self._parts:
+            return None
+        frame = b"".join(self._parts)
+        self._parts.clear()
+        self._size = 0
+        return frame
+
+
+# Parts read ahead of the coalescer; bounded so a fast upstream is not buffered without limit:
+# with the queue full the pump stops reading, and the upstream socket applies TCP backpressure
+COALESCE_READ_AHEAD = 16
+_END = object()
+
+
+async def _pump(parts: AsyncIterable[bytes], queue: asyncio.Queue):
+    try:
+        async for part in parts:
+            await queue.put(part)
+    except Exception as e:
+        await queue.put(e)
+    else:
+        await queue.put(_END)
+    finally:
+        # Cancelled while waiting on a full queue: parts is suspended and must be closed explicitly
+        await aclose_stream(parts)
+
+
+async def coalesce(parts: AsyncIterable[bytes], max_bytes: int = FRAME_MAX_BYTES,
+                   max_delay: float = FRAME_MAX_DELAY, clock=time.monotonic) -> AsyncIterator[bytes]:
+    """Merge a stream of encoded parts into frames; non-text parts flush the buffer immediately
+
+    The upstream is read by a separate task into a small queue. While deltas are buffered the queue
+    is read with a timeout, so a stalled upstream never holds already-generated text for longer
+    than max_delay.
+    """
+    coalescer = FrameCoalescer(max_bytes, max_delay, clock)
+    queue = asyncio.Queue(maxsize=COALESCE_READ_AHEAD)
+    pump = asyncio.create_task(_pump(parts, queue))
+    try:
+        while True:
+            if len(coalescer) and queue.empty():
+                try:
+                    async with asyncio.timeout(coalescer.deadline() - clock()):
+                        part = await queue.get()
+                except TimeoutError:
+                    yield coalescer.flush()
+                    continue
+            else:
+                part = await queue.get()
+            if part is _END:
+                break
+            if isinstance(part, Exception):
+                raise part
+            frame = coalescer.add(part, flush=not part.startswith(b"0:"))
+            if frame:
+                yield frame
+    finally:
+        # Wait for the pump, so the upstream is closed before the response ends
+        pump.cancel()
+        await asyncio.wait([pump])
+    frame = coalescer.flush()
+    if frame:
+        yield frame
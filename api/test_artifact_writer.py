@@ -0,0 +1,142 @@
+"""
+ArtifactWriter checks with fake PIL-like images: bounded number of bitmaps alive while the
+background threads write, content-hash dedup, bitmaps released after writing, write errors
+
+python test_artifact_writer.py
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+from artifact_writer import ArtifactWriter
+
+
+class FakeImage:
+    alive = 0
+    max_alive = 0
+    lock = threading.Lock()
+
+    def __init__(self, data: bytes, delay: float = 0.0, fail: bool = False):
+        self.mode = "RGB"
+        self.size = (len(data), 1)
+        self.data = data
+        self.delay = delay
+        self.fail = fail
+        self.closed = False
+        self.saved_with = None
+        with FakeImage.lock:
+            FakeImage.alive += 1
+            FakeImage.max_alive = max(FakeImage.max_alive, FakeImage.alive)
+
+    def tobytes(self) -> bytes:
+        return self.data
+
+    def save(self, f, format: str, **params):
+        time.sleep(self.delay)
+        if self.fail:
+            raise OSError("disk full")
+        self.saved_with = (format, params)
+        f.write(self.data)
+
+    def close(self):
+        self.closed = True
+        with FakeImage.lock:
+            FakeImage.alive -= 1
+
+
+def test_bounded_pending_and_release():
+    FakeImage.alive = FakeImage.max_alive = 0
+    images = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        with ArtifactWriter(output_dir, workers=2, max_pending=3) as writer:
+            # Like a converter producing pages: each bitmap exists only from here until it is written
+            for i in range(30):
+                image = FakeImage(f"page-{i}".encode(), delay=0.002)
+                images.append(image)
+                writer.submit(image)
+        assert len(os.listdir(output_dir)) == 30 and writer.stats["written"] == 30
+    assert all(image.closed for image in images) and FakeImage.alive == 0
+    # The producer's own image plus at most max_pending in the writer
+    assert FakeImage.max_alive <= 4
+
+
+def test_dedup_by_content():
+    with tempfile.TemporaryDirectory() as output_dir:
+        with ArtifactWriter(output_dir, image_format="png") as writer:
+            paths = [writer.submit(FakeImage(b"logo")) for _ in range(5)]
+            other = writer.submit(FakeImage(b"chart"))
+        assert len(set(paths)) == 1 and paths[0] != other and paths[0].endswith(".png")
+        assert writer.stats == {"written": 2, "deduplicated": 4, "bytes": 9}
+        # A second writer on the same directory finds the files already there
+        with ArtifactWriter(output_dir, image_format="png") as writer:
+            writer.submit(FakeImage(b"logo"))
+        assert writer.stats["deduplicated"] == 1 and sorted(os.listdir(output_dir)) == sorted(
+            os.path.basename(path) for path in (paths[0], other))
+
+
+def test_encoder_options_and_errors():
+    with tempfile.TemporaryDirectory() as output_dir:
+        image = FakeImage(b"figure")
+        with ArtifactWriter(output_dir, quality=70) as writer:
+            writer.submit(image, close=False)
+        assert image.saved_with == ("WEBP", {"quality": 70, "method": 0}) and not image.closed
+
+        writer = ArtifactWriter(output_dir)
+        broken = FakeImage(b"broken", fail=True)
+        writer.submit(broken)
+        try:
+            writer.close()
+        except OSError:
+            pass
+        else:
+            raise AssertionError("write error was not raised")
+        assert broken.closed and not any(name.endswith(".tmp") for name in os.listdir(output_dir))
+
+
+def test_writer_recovers_after_a_failed_write():
+    with tempfile.TemporaryDirectory() as output_dir:
+        with ArtifactWriter(output_dir) as writer:
+            writer.submit(FakeImage(b"page", fail=True))
+            try:
+                writer.flush()
+            except OSError:
+                pass
+            else:
+                raise AssertionError("write error was not raised")
+            # The error is reported once: the next range of a long-lived worker writer flushes cleanly
+            writer.submit(FakeImage(b"next page"))
+            writer.flush()
+            # The failed image was not written, so submitting it again writes it instead of deduplicating
+            path = writer.submit(FakeImage(b"page"))
+            writer.flush()
+            assert os.path.exists(path) and writer.stats["deduplicated"] == 0 and writer.stats["written"] == 2
+
+
+def test_submit_after_close_does_not_block_flush():
+    with tempfile.TemporaryDirectory() as output_dir:
+        writer = ArtifactWriter(output_dir, workers=1, max_pending=1)
+        writer.close()
+        for _ in range(2):
+            # Refused by the closed pool, without holding the only pending slot
+            try:
+                writer.submit(FakeImage(b"late"))
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError("submit after close should fail")
+        finished = threading.Event()
+        threading.Thread(target=lambda: (writer.flush(), finished.set()), daemon=True).start()
+        assert finished.wait(1)
+
+
+def main():
+    for test in (test_bounded_pending_and_release, test_dedup_by_content, test_encoder_options_and_errors,
+                 test_writer_recovers_after_a_failed_write, test_submit_after_close_does_not_block_flush):
+        test()
+        print(f"{test.__name__}: ok")
+
+
+if __name__ == "__main__":
+    main()
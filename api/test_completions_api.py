@@ -0,0 +1,73 @@
+"""
+Scheduled /v1/chat/completions passthrough on the app the desktop sidecar runs (app.py), with the
+process's model router pointed at an in-process fake backend: requests hold a slot of their
+X-Priority class while upstream, streaming and unknown priorities are rejected
+
+python test_completions_api.py
+"""
+
+import asyncio
+import json
+
+import httpx
+
+import app
+from model_router import Backend, router
+from model_scheduler import Scheduler
+
+
+class FakeBackend:
+    def __init__(self):
+        self.requests = []
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        # Scheduler state while this request is upstream
+        self.requests.append((body, dict(router.scheduler.running)))
+        return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": "ok"}}]})
+
+
+def with_fake_backend(test):
+    def run():
+        backend = FakeBackend()
+        saved = router.backends, router.scheduler
+        router.backends = [Backend("fake", "http://fake/v1", max_retries=0,
+                                   http_client=httpx.AsyncClient(transport=httpx.MockTransport(backend.handle)))]
+        router.scheduler = Scheduler(slots=2, reserved=1)
+        try:
+            asyncio.run(test(backend, httpx.AsyncClient(transport=httpx.ASGITransport(app.app), base_url="http://app")))
+        finally:
+            router.backends, router.scheduler = saved
+    run.__name__ = test.__name__
+    return run
+
+
+@with_fake_backend
+async def test_background_request_takes_a_background_slot(backend, client):
+    response = await client.post("/v1/chat/completions", json={"model": "vlm", "messages": []},
+                                 headers={"X-Priority": "background", "X-Tenant": "paper.pdf"})
+    assert response.status_code == 200 and response.json()["choices"][0]["message"]["content"] == "ok"
+    body, running = backend.requests[0]
+    assert body["model"] == "vlm" and running["background"] == 1
+    assert router.scheduler.running == {"interactive": 0, "background": 0, "batch": 0}
+    models = (await client.get("/api/models")).json()
+    assert models["backends"][0]["name"] == "fake" and models["scheduler"] is not None
+
+
+@with_fake_backend
+async def test_rejected_requests(backend, client):
+    streaming = await client.post("/v1/chat/completions", json={"model": "vlm", "messages": [], "stream": True})
+    unknown = await client.post("/v1/chat/completions", json={"model": "vlm", "messages": []},
+                                headers={"X-Priority": "urgent"})
+    assert streaming.status_code == 400 and unknown.status_code == 400
+    assert backend.requests == []
+
+
+def main():
+    for test in (test_background_request_takes_a_background_slot, test_rejected_requests):
+        test()
+        print(f"{test.__name__}: ok")
+
+
+if __name__ == "__main__":
+    main()
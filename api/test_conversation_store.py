@@ -0,0 +1,122 @@
+"""
+Server-side chat history checks: only new client messages are converted, committed responses are
+kept as sent upstream, and the history is reset on regenerate or an edit (shorter history, or the
+same length with a changed last message) but not by an empty request
+
+python test_conversation_store.py
+"""
+
+from types import SimpleNamespace
+
+from conversation_store import ConversationStore
+
+
+class Converter:
+    """Stand-in for convert_to_openai_messages that records what it was asked to convert"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, messages: list) -> list:
+        self.calls.append([message["content"] for message in messages])
+        return [{"role": message["role"], "content": f"converted {message['content']}"} for message in messages]
+
+
+def user(text: str) -> dict:
+    return {"role": "user", "content": text}
+
+
+def assistant(text: str) -> dict:
+    return {"role": "assistant", "content": text}
+
+
+# What the tool loop sent upstream for one answer: more than the single assistant message the client shows
+GENERATED = [
+    {"role": "assistant", "tool_calls": [{"id": "call-1"}]},
+    {"role": "tool", "tool_call_id": "call-1", "content": "18°C"},
+    {"role": "assistant", "content": "It is 18°C"},
+]
+
+
+def test_sync_converts_only_new_messages():
+    store, convert = ConversationStore(), Converter()
+    assert store.sync("chat", [user("weather?")], convert) == [{"role": "user", "content": "converted weather?"}]
+    store.commit("chat", GENERATED)
+    history = [user("weather?"), assistant("It is 18°C"), user("tomorrow?")]
+    prompt = store.sync("chat", history, convert)
+    assert convert.calls == [["weather?"], ["tomorrow?"]]
+    assert prompt == [{"role": "user", "content": "converted weather?"}, *GENERATED,
+                      {"role": "user", "content": "converted tomorrow?"}]
+
+
+def test_append_and_commit():
+    store, convert = ConversationStore(), Converter()
+    store.append("chat", user("weather?"), convert)
+    store.commit("chat", GENERATED)
+    prompt = store.append("chat", user("tomorrow?"), convert)
+    assert prompt[1:4] == GENERATED and prompt[-1]["content"] == "converted tomorrow?"
+    assert store.get("chat").client_count == 3
+    # A full history that agrees with what append stored converts nothing again
+    store.sync("chat", [user("weather?"), assistant("It is 18°C"), user("tomorrow?")], convert)
+    assert convert.calls == [["weather?"], ["tomorrow?"]]
+
+
+def test_shorter_history_resets():
+    store, convert = ConversationStore(), Converter()
+    store.sync("chat", [user("weather?")], convert)
+    store.commit("chat", GENERATED)
+    # Regenerate: the client drops its last assistant message and sends the history again
+    prompt = store.sync("chat", [user("weather?")], convert)
+    assert prompt == [{"role": "user", "content": "converted weather?"}]
+    assert convert.calls == [["weather?"], ["weather?"]]
+
+
+def test_edit_of_the_last_message_resets():
+    store, convert = ConversationStore(), Converter()
+    store.sync("chat", [user("weather?")], convert)
+    store.commit("chat", GENERATED)
+    store.sync("chat", [user("weather?"), assistant("It is 18°C"), user("tomorow?")], convert)
+    # The answer failed, the user fixes the typo: same number of messages, different last message
+    prompt = store.sync("chat", [user("weather?"), assistant("It is 18°C"), user("tomorrow?")], convert)
+    assert prompt[-1] == {"role": "user", "content": "converted tomorrow?"}
+    assert "converted tomorow?" not in [message.get("content") for message in prompt]
+    assert convert.calls[-1] == ["weather?", "It is 18°C", "tomorrow?"]
+
+
+def test_empty_history_keeps_the_conversation():
+    store, convert = ConversationStore(), Converter()
+    store.sync("chat", [user("weather?")], convert)
+    store.commit("chat", GENERATED)
+    stored = store.sync("chat", [], convert)
+    assert stored == [{"role": "user", "content": "converted weather?"}, *GENERATED]
+    assert store.get("chat").client_count == 2
+
+
+def test_fingerprint_of_message_objects():
+    # benchmark_conversation.py passes plain objects, index.py pydantic models
+    store = ConversationStore()
+    convert = lambda messages: [{"role": m.role, "content": m.content} for m in messages]
+    store.sync("chat", [SimpleNamespace(role="user", content="hi")], convert)
+    assert store.sync("chat", [SimpleNamespace(role="user", content="hi")], convert) == [{"role": "user", "content": "hi"}]
+    assert store.sync("chat", [SimpleNamespace(role="user", content="hello")], convert) == [
+        {"role": "user", "content": "hello"}]
+
+
+def test_least_recently_used_conversation_is_evicted():
+    store, convert = ConversationStore(max_conversations=2), Converter()
+    for chat_id in ("a", "b", "c"):
+        store.sync(chat_id, [user(chat_id)], convert)
+    assert len(store) == 2
+    assert store.get("a").client_count == 0 and store.get("c").client_count == 1
+
+
+def main():
+    for test in (test_sync_converts_only_new_messages, test_append_and_commit, test_shorter_history_resets,
+                 test_edit_of_the_last_message_resets, test_empty_history_keeps_the_conversation,
+                 test_fingerprint_of_message_objects, test_least_recently_used_conversation_is_evicted):
+        test()
+        print(f"{test.__name__}: ok")
+
+
+if __name__ == "__main__":
+    main()
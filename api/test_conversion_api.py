@@ -0,0 +1,112 @@
+"""
+PDF conversion API checks without docling: the converter starts on first use and a failed start
+stays a 503, the event stream is encoded as NDJSON, and closing the stream early (client gone)
+closes the conversion and removes the uploaded file once the running step has finished
+
+python test_conversion_api.py
+"""
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+import orjson
+from fastapi import HTTPException
+
+from conversion_api import DocumentConversionService
+
+
+def upload(content: bytes = b"%PDF-1.7") -> str:
+    path = os.path.join(tempfile.mkdtemp(prefix="document-"), "paper.pdf")
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def test_start_on_first_request():
+    service = DocumentConversionService(workers=1)
+    loads = []
+
+    def failing_load():
+        loads.append(threading.get_ident())
+        time.sleep(0.01)
+        service.error, service.state = "No module named 'docling'", "error"
+
+    service._load = failing_load
+    assert service.state == "not_loaded"
+
+    async def run():
+        results = await asyncio.gather(*(service.ensure_started() for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, HTTPException) and r.status_code == 503 for r in results)
+        try:
+            await service.ensure_started()
+        except HTTPException as e:
+            assert "docling" in e.detail
+        else:
+            raise AssertionError("expected 503")
+
+    asyncio.run(run())
+    # Concurrent first requests share one start, a failed start is not retried per request
+    assert len(loads) == 1
+
+
+def test_events_are_ndjson_and_upload_is_removed():
+    service = DocumentConversionService(workers=1)
+    service._events = lambda path, include_images, loop, tenant: (event for event in [{"type": "start", "pages": 1}, {"type": "done"}])
+    path = upload()
+
+    async def run():
+        return [line async for line in service.convert_events(path, include_images=False)]
+
+    lines = asyncio.run(run())
+    assert [orjson.loads(line)["type"] for line in lines] == ["start", "done"] and all(line.endswith(b"\n") for line in lines)
+    assert not os.path.exists(os.path.dirname(path)) and service.active == 0
+
+
+def test_client_disconnect_closes_conversion():
+    service = DocumentConversionService(workers=1)
+    closed = threading.Event()
+    converting = threading.Event()
+
+    def events(path, include_images, loop, tenant):
+        try:
+            yield {"type": "start", "pages": 3}
+            converting.set()
+            time.sleep(0.05)  # a page being converted when the client goes away
+            yield {"type": "page", "page_no": 1}
+            yield {"type": "page", "page_no": 2}
+        finally:
+            closed.set()
+
+    service._events = events
+    path = upload()
+
+    async def run():
+        stream = service.convert_events(path, include_images=False)
+        assert orjson.loads(await stream.__anext__())["type"] == "start"
+        reader = asyncio.ensure_future(stream.__anext__())
+        await asyncio.to_thread(converting.wait)
+        # What ChatStreamingResponse does on disconnect: cancel the send, close the body iterator
+        reader.cancel()
+        await asyncio.wait([reader])
+        await stream.aclose()
+        assert os.path.exists(path) and not closed.is_set()
+        # The running step finishes, then the conversion is closed instead of continuing to page 2
+        await asyncio.to_thread(closed.wait, 1)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert closed.is_set() and not os.path.exists(os.path.dirname(path)) and service.active == 0
+
+
+def main():
+    for test in (test_start_on_first_request, test_events_are_ndjson_and_upload_is_removed,
+                 test_client_disconnect_closes_conversion):
+        test()
+        print(f"{test.__name__}: ok")
+
+
+if __name__ == "__main__":
+    main()
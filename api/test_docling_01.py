@@ -46,7 +46,11 @@ def main():
     pipeline_options.do_picture_description = True
     pipeline_options.enable_remote_services=True  # <-- this is required!
     pipeline_options.picture_description_options = PictureDescriptionApiOptions(
-        url="http://localhost:1234/v1/chat/completions",
+        # Through the api on port 60316 (sidecar app.py or index.py, both mount completions_api) so
+        # descriptions only use the slots chat leaves free;
+        # use http://localhost:1234/v1/chat/completions directly when the app is not running
+        url="http://127.0.0.1:60316/v1/chat/completions",
+        headers={"X-Priority": "background", "X-Tenant": "layout-parser-paper.pdf"},
         params=dict(
             model="google/gemma-3-4b",
             # model="mlx-community/qwen2.5-vl-7b-instruct",
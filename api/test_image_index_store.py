@@ -0,0 +1,139 @@
+"""
+Image index store checks on small random indexes (numpy only, no model): incremental append,
+rows past the header count left by an interrupted append, compaction with ANN/quantized
+sidecars that cover all or only some rows, and directory matching for incremental updates
+
+python test_image_index_store.py
+"""
+
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import image_index_store as store
+from ivf_index import IVFIndex
+from quantization import Int8Codes, load_quantized, save_quantized
+
+TOKENS, DIM = 4, 8
+
+
+def random_rows(count: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, TOKENS, DIM)).astype(np.float32)
+
+
+def metadata_for(paths: list) -> dict:
+    metadata = store.empty_metadata()
+    for path in paths:
+        store.append_record(metadata, {"path": path, "filename": os.path.basename(path), "mtime": 1.0,
+                                       "size": 10, "sha256": "", "deleted": False})
+    return metadata
+
+
+def test_append_to_index():
+    with tempfile.TemporaryDirectory() as tmp:
+        index_dir = os.path.join(tmp, "index")
+        first, second = random_rows(3, 0), random_rows(2, 1)
+        store.write_index(index_dir, first, metadata_for(["a", "b", "c"]), "model")
+        metadata = metadata_for(["a", "b", "c", "d", "e"])
+        metadata["deleted"][1] = True
+        store.append_to_index(index_dir, second, metadata)
+
+        header, read_metadata, embeddings = store.read_index(index_dir, "model")
+        assert header["count"] == 5
+        assert read_metadata["path"] == ["a", "b", "c", "d", "e"]
+        assert read_metadata["deleted"] == [False, True, False, False, False]
+        np.testing.assert_array_equal(embeddings, np.concatenate([first, second]))
+
+
+def test_read_index_ignores_rows_past_the_header_count():
+    with tempfile.TemporaryDirectory() as tmp:
+        index_dir = os.path.join(tmp, "index")
+        rows = random_rows(3, 0)
+        store.write_index(index_dir, rows, metadata_for(["a", "b", "c"]), "model")
+        # An append interrupted before the header was written: rows and metadata past count
+        embeddings_path = os.path.join(index_dir, store.EMBEDDINGS_FILE)
+        np.save(embeddings_path, np.concatenate([rows, random_rows(2, 1)]))
+        with open(os.path.join(index_dir, store.METADATA_FILE), "w", encoding="utf-8") as f:
+            json.dump(metadata_for(["a", "b", "c", "d", "e"]), f)
+
+        header, metadata, embeddings = store.read_index(index_dir)
+        assert header["count"] == 3 and len(embeddings) == 3
+        assert metadata["path"] == ["a", "b", "c"]
+        np.testing.assert_array_equal(embeddings, rows)
+
+        # The next append overwrites the leftover rows instead of keeping them
+        extra = random_rows(1, 2)
+        store.append_to_index(index_dir, extra, metadata_for(["a", "b", "c", "f"]))
+        _, metadata, embeddings = store.read_index(index_dir)
+        assert metadata["path"] == ["a", "b", "c", "f"]
+        np.testing.assert_array_equal(embeddings, np.concatenate([rows, extra]))
+
+
+def test_compact_index_with_partial_sidecars():
+    with tempfile.TemporaryDirectory() as tmp:
+        index_dir = os.path.join(tmp, "index")
+        rows = random_rows(5, 0)
+        metadata = metadata_for(["a", "b", "c", "d", "e"])
+        metadata["deleted"][1] = metadata["deleted"][3] = True
+        store.write_index(index_dir, rows, metadata, "model")
+        # The quantized codes cover every row, the ANN index only the first 4 (built before an append)
+        quantized = Int8Codes.encode(rows)
+        save_quantized(os.path.join(index_dir, store.QUANT_FILE), quantized)
+        IVFIndex.train(rows[:4, :2], nlist=2).save(os.path.join(index_dir, store.ANN_FILE))
+
+        store.compact_index(index_dir)
+
+        header, metadata, embeddings = store.read_index(index_dir, "model")
+        keep = [0, 2, 4]
+        assert header["count"] == 3 and metadata["path"] == ["a", "c", "e"]
+        assert not any(metadata["deleted"])
+        np.testing.assert_array_equal(embeddings, rows[keep])
+        compacted = load_quantized(os.path.join(index_dir, store.QUANT_FILE))
+        np.testing.assert_array_equal(compacted.codes, quantized.codes[keep])
+        np.testing.assert_array_equal(compacted.scales, quantized.scales[keep])
+        # Rows of a partial sidecar cannot be remapped: it is dropped and rebuilt on demand
+        assert not os.path.exists(os.path.join(index_dir, store.ANN_FILE))
+
+
+def test_live_rows_match_however_the_directory_is_written():
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            os.makedirs("imgs")
+            metadata = metadata_for(["imgs/a.png", os.path.abspath("imgs/b.png"), "./imgs/a.png",
+                                     "imgs2/c.png", "imgs/d.png"])
+            metadata["deleted"][4] = True
+            rows, duplicates = store.live_rows(metadata, "./imgs")
+            assert rows == {os.path.abspath("imgs/a.png"): 2, os.path.abspath("imgs/b.png"): 1}
+            # The older duplicate of a.png is reported, the sibling directory is left alone
+            assert duplicates == [0]
+            # A reader: the index is not changed
+            assert metadata["deleted"] == [False, False, False, False, True]
+            assert store.live_rows(metadata, os.path.abspath("imgs")) == (rows, duplicates)
+        finally:
+            os.chdir(cwd)
+
+
+def test_same_model():
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = os.path.join(tmp, "colqwen")
+        os.makedirs(model_dir)
+        relative = os.path.relpath(model_dir)
+        assert store.same_model(relative, model_dir)
+        assert store.same_model("vidore/colqwen2.5", "vidore/colqwen2.5")
+        assert not store.same_model(model_dir, "vidore/colqwen2.5")
+
+
+def main():
+    for test in (test_append_to_index, test_read_index_ignores_rows_past_the_header_count,
+                 test_compact_index_with_partial_sidecars, test_live_rows_match_however_the_directory_is_written,
+                 test_same_model):
+        test()
+        print(f"{test.__name__}: ok")
+
+
+if __name__ == "__main__":
+    main()
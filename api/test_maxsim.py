@@ -0,0 +1,54 @@
+"""
+Sharded MaxSim checks on random embeddings: the merged top-k matches scoring the whole index at once,
+and tombstoned rows are neither counted as matches nor returned, with or without a score threshold
+
+python test_maxsim.py
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from maxsim import MIN_SHARD_SIZE, maxsim_scores, sharded_top_k, top_k_indices
+
+
+def random_index(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n, 4, 16)).astype(np.float32)
+    query = rng.standard_normal((3, 16)).astype(np.float32)
+    return query, embeddings
+
+
+def test_sharded_matches_whole_index():
+    query, embeddings = random_index(3 * MIN_SHARD_SIZE)
+    expected = top_k_indices(maxsim_scores(query, embeddings), 10)
+    with ThreadPoolExecutor(3) as pool:
+        indices, scores, matched = sharded_top_k(query, embeddings, 10, executor=pool, num_shards=3)
+    np.testing.assert_array_equal(indices, expected)
+    assert matched == len(embeddings)
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_tombstones_are_not_matched():
+    query, embeddings = random_index(2 * MIN_SHARD_SIZE)
+    exclude = np.zeros(len(embeddings), dtype=bool)
+    exclude[5:] = True
+    with ThreadPoolExecutor(2) as pool:
+        indices, _, matched = sharded_top_k(query, embeddings, 10, exclude=exclude, executor=pool, num_shards=2)
+        # Fewer live rows than top_k: only the live ones come back
+        assert matched == 5 and sorted(indices) == [0, 1, 2, 3, 4]
+        scores = maxsim_scores(query, embeddings[:5])
+        threshold = float(np.median(scores))
+        indices, _, matched = sharded_top_k(query, embeddings, 10, score_threshold=threshold, exclude=exclude,
+                                            executor=pool, num_shards=2)
+        assert matched == int(np.count_nonzero(scores >= threshold)) == len(indices)
+
+
+def main():
+    for test in (test_sharded_matches_whole_index, test_tombstones_are_not_matched):
+        test()
+        print(f"{test.__name__}: ok")
+
+
+if __name__ == "__main__":
+    main()
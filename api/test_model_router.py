@@ -0,0 +1,287 @@
+"""
+Model router checks with fake OpenAI-compatible backends: least-outstanding balancing, model-aware
+routing, failover on refused connections, release of the backend when a stream is closed and
+single-flight sharing of identical concurrent requests, the priority scheduler, and the routed OpenAI
+client that pydantic-ai agents keep (per-request balancing, failover and release through RouterTransport)
+
+python test_model_router.py
+"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from model_router import Backend, ModelRouter
+from model_scheduler import Scheduler
+from single_flight import SingleFlight
+
+
+class FakeStream:
+    def __init__(self, chunks: int, delay: float = 0):
+        self.chunks = chunks
+        self.delay = delay
+        self.produced = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for i in range(self.chunks):
+            await asyncio.sleep(self.delay)
+            self.produced += 1
+            yield i
+
+    async def close(self):
+        self.closed = True
+
+
+def fake_client(name: str, log: list, refuse: bool = False):
+    async def create(**kwargs):
+        log.append(name)
+        if refuse:
+            raise openai.APIConnectionError(request=httpx.Request("POST", f"http://{name}/v1/chat/completions"))
+        return FakeStream(3)
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def test_least_outstanding_balancing():
+    log = []
+    router = ModelRouter([Backend(name, f"http://{name}/v1", client=fake_client(name, log))
+                          for name in ("a", "b", "c")], single_flight=False)
+
+    async def run():
+        # Three open streams land on three different backends, the fourth on any of them
+        streams = [await router.chat_completion_stream(model="m", messages=[]) for _ in range(3)]
+        assert sorted(log) == ["a", "b", "c"]
+        assert [backend.outstanding for backend in router.backends] == [1, 1, 1]
+        await streams[1].aclose()
+        # b finished its stream and is now the least loaded
+        await router.chat_completion_stream(model="m", messages=[])
+        assert log[-1] == "b"
+
+    asyncio.run(run())
+
+
+def test_model_aware_routing():
+    log = []
+    a = Backend("a", "http://a/v1", client=fake_client("a", log))
+    b = Backend("b", "http://b/v1", client=fake_client("b", log))
+    a.models, b.models = {"qwen"}, {"gemma"}
+    router = ModelRouter([a, b], single_flight=False)
+
+    async def run():
+        for _ in range(3):
+            await router.chat_completion_stream(model="gemma", messages=[])
+        # Unknown model: every backend is a candidate
+        await router.chat_completion_stream(model="other", messages=[])
+
+    asyncio.run(run())
+    assert log[:3] == ["b", "b", "b"] and log[3] == "a"
+
+
+def test_failover_and_release():
+    log = []
+    down = Backend("down", "http://down/v1", client=fake_client("down", log, refuse=True))
+    up = Backend("up", "http://up/v1", client=fake_client("up", log))
+    router = ModelRouter([down, up], single_flight=False)
+
+    async def run():
+        chunks = []
+        for _ in range(2):
+            stream = await router.chat_completion_stream(model="m", messages=[])
+            chunks.append([chunk async for chunk in stream])
+        return chunks
+
+    assert asyncio.run(run()) == [[0, 1, 2], [0, 1, 2]]
+    # The refused backend was tried once, then skipped until its retry delay passed
+    assert log.count("down") <= 1 and log.count("up") == 2
+    assert not down.healthy and down.outstanding == 0 and up.outstanding == 0
+
+
+def test_single_flight_shares_identical_requests():
+    log = []
+    router = ModelRouter([Backend("a", "http://a/v1", client=fake_client("a", log))])
+
+    async def read(messages):
+        stream = await router.chat_completion_stream(model="m", messages=messages)
+        return [chunk async for chunk in stream]
+
+    async def run():
+        same = [read([{"role": "user", "content": "describe"}]) for _ in range(5)]
+        return await asyncio.gather(*same, read([{"role": "user", "content": "other"}]))
+
+    results = asyncio.run(run())
+    assert results == [[0, 1, 2]] * 6
+    assert log == ["a", "a"] and router.flights.joined == 4
+    assert len(router.flights) == 0 and router.backends[0].outstanding == 0
+
+
+def test_single_flight_closes_upstream_after_last_reader():
+    upstream = FakeStream(100, delay=0.005)
+
+    async def open_stream():
+        return upstream
+
+    async def run():
+        flights = SingleFlight()
+        first = await flights.stream("k", open_stream)
+        second = await flights.stream("k", open_stream)
+        assert [await first.__anext__() for _ in range(3)] == [0, 1, 2]
+        # A late joiner starts from the first chunk
+        assert await second.__anext__() == 0
+        await first.aclose()
+        assert await second.__anext__() == 1 and not upstream.closed
+        produced = upstream.produced
+        await second.aclose()
+        await asyncio.sleep(0.05)
+        assert upstream.closed and upstream.produced - produced <= 1 and len(flights) == 0
+
+    asyncio.run(run())
+
+
+def test_scheduler_keeps_a_slot_for_chat():
+    async def run():
+        scheduler = Scheduler(slots=3, limits={"batch": 2}, reserved=1)
+        batch = [asyncio.ensure_future(scheduler.acquire("batch", "doc")) for _ in range(5)]
+        await asyncio.sleep(0)
+        # Two batch jobs run, the third slot stays free for chat even though batch is still queued
+        assert scheduler.stats()["batch"] == {"running": 2, "waiting": 3, "limit": 2}
+        release_chat = await asyncio.wait_for(scheduler.acquire("interactive"), 0.1)
+        assert sum(task.done() for task in batch) == 2
+        release_chat()
+        (await batch[0])()
+        await asyncio.sleep(0)
+        assert sum(task.done() for task in batch) == 3
+        for task in batch:
+            task.cancel()
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+
+
+def test_scheduler_round_robin_between_tenants():
+    order = []
+
+    async def job(scheduler, tenant, i):
+        release = await scheduler.acquire("batch", tenant)
+        order.append((tenant, i))
+        await asyncio.sleep(0.001)
+        release()
+
+    async def run():
+        scheduler = Scheduler(slots=2, limits={"batch": 1}, reserved=1)
+        big = [job(scheduler, "big.pdf", i) for i in range(20)]
+        small = [job(scheduler, "small.pdf", i) for i in range(3)]
+        await asyncio.gather(*big, *small)
+
+    asyncio.run(run())
+    # The small document does not wait for the 20 pages queued before it: after the first page of
+    # big.pdf, which got the free slot right away, the two documents alternate
+    small_positions = [n for n, (tenant, _) in enumerate(order) if tenant == "small.pdf"]
+    assert small_positions == [2, 4, 6]
+
+
+def test_scheduler_cancelled_waiter_leaves_queue():
+    async def run():
+        scheduler = Scheduler(slots=2, reserved=1)
+        release = await scheduler.acquire("background")
+        waiter = asyncio.ensure_future(scheduler.acquire("background"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        # Released before the cancelled waiter ran its cleanup: the slot must not go to it
+        release()
+        await asyncio.sleep(0)
+        assert scheduler.stats()["background"]["waiting"] == 0
+        assert scheduler.running == {"interactive": 0, "background": 0, "batch": 0}
+
+    asyncio.run(run())
+
+
+def http_backend(name: str, log: list, refuse: bool = False, status: int = 200) -> Backend:
+    """Backend with a raw HTTP client on an in-process fake server, as used by router.openai_client()"""
+    def handle(request: httpx.Request) -> httpx.Response:
+        log.append((name, request.url.path))
+        if refuse:
+            raise httpx.ConnectError("refused", request=request)
+        if status != 200:
+            return httpx.Response(status, json={"error": "overloaded"})
+        body = json.loads(request.content)
+        if body.get("stream"):
+            chunk = {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                     "choices": [{"index": 0, "delta": {"content": name}, "finish_reason": None}]}
+            events = f"data: {json.dumps(chunk)}\n\n" * 3 + "data: [DONE]\n\n"
+            return httpx.Response(200, content=events.encode(), headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json={
+            "id": "c", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": name}}],
+        })
+
+    return Backend(name, f"http://{name}/v1", max_retries=0,
+                   http_client=httpx.AsyncClient(transport=httpx.MockTransport(handle)))
+
+
+def test_routed_client_balances_each_request():
+    log = []
+    router = ModelRouter([http_backend(name, log) for name in ("a", "b")], single_flight=False)
+    client = router.openai_client()
+
+    async def run():
+        # An open stream keeps its backend busy, so the next request goes to the other one
+        stream = await client.chat.completions.create(model="m", messages=[], stream=True)
+        first = await stream.__anext__()
+        assert sorted(backend.outstanding for backend in router.backends) == [0, 1]
+        completion = await client.chat.completions.create(model="m", messages=[])
+        assert completion.choices[0].message.content != first.choices[0].delta.content
+        await stream.close()
+        assert [backend.outstanding for backend in router.backends] == [0, 0]
+        # One routed client per settings for the router's lifetime, closed with the router
+        assert router.openai_client() is client and router.openai_client(priority="batch") is not client
+        await router.aclose()
+        assert client.is_closed()
+
+    asyncio.run(run())
+    assert [path for _, path in log] == ["/v1/chat/completions"] * 2
+
+
+def test_routed_client_model_aware_failover():
+    log = []
+    down, overloaded = http_backend("down", log, refuse=True), http_backend("busy", log, status=503)
+    up, other = http_backend("up", log), http_backend("other", log)
+    for backend in (down, overloaded, up):
+        backend.models = {"gemma"}
+    other.models = {"qwen"}
+    router = ModelRouter([down, overloaded, up, other], single_flight=False,
+                         scheduler=Scheduler(slots=2, reserved=1))
+    client = router.openai_client()
+
+    async def run():
+        completion = await client.chat.completions.create(model="gemma", messages=[])
+        assert completion.choices[0].message.content == "up"
+        chunks = [chunk async for chunk in await client.chat.completions.create(model="gemma", messages=[],
+                                                                                stream=True)]
+        assert len(chunks) == 3
+
+    asyncio.run(run())
+    assert "other" not in [name for name, _ in log]
+    assert not down.healthy and overloaded.healthy
+    assert all(backend.outstanding == 0 for backend in router.backends)
+    # Every request gave its scheduler slot back
+    assert router.scheduler.running == {"interactive": 0, "background": 0, "batch": 0}
+
+
+def main():
+    for test in (test_least_outstanding_balancing, test_model_aware_routing, test_failover_and_release,
+                 test_single_flight_shares_identical_requests, test_single_flight_closes_upstream_after_last_reader,
+                 test_scheduler_keeps_a_slot_for_chat, test_scheduler_round_robin_between_tenants,
+                 test_scheduler_cancelled_waiter_leaves_queue, test_routed_client_balances_each_request,
+                 test_routed_client_model_aware_failover):
+        test()
+        print(f"{test.__name__}: ok")
+
+
+if __name__ == "__main__":
+    main()
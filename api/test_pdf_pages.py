@@ -0,0 +1,52 @@
+"""
+Page hash checks on small generated PDFs: the hash of a page is the same on every call (pdfium
+writes a new /ID and /CreationDate on each save) and does not depend on where the page is
+
+python test_pdf_pages.py
+"""
+
+import os
+import tempfile
+import time
+
+import pypdfium2
+
+from pdf_pages import page_count, page_hashes
+
+
+def write_pdf(path: str, heights: list):
+    pdf = pypdfium2.PdfDocument.new()
+    for height in heights:
+        pdf.new_page(200, height)
+    pdf.save(path)
+    pdf.close()
+
+
+def test_hashes_are_stable_across_calls():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "doc.pdf")
+        write_pdf(path, [100, 200, 300])
+        first = page_hashes(path)
+        # Next second: a different CreationDate if it were part of the hash
+        time.sleep(1.05)
+        assert page_hashes(path) == first
+        assert len(set(first)) == 3 and page_count(path) == 3
+
+
+def test_hash_follows_the_page_not_its_position():
+    with tempfile.TemporaryDirectory() as tmp:
+        original, edited = os.path.join(tmp, "a.pdf"), os.path.join(tmp, "b.pdf")
+        write_pdf(original, [100, 200, 300])
+        write_pdf(edited, [300, 150, 100])
+        a, b = page_hashes(original), page_hashes(edited)
+        assert b[0] == a[2] and b[2] == a[0] and b[1] not in a
+
+
+def main():
+    for test in (test_hashes_are_stable_across_calls, test_hash_follows_the_page_not_its_position):
+        test()
+        print(f"{test.__name__}: ok")
+
+
+if __name__ == "__main__":
+    main()
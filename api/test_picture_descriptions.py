@@ -0,0 +1,150 @@
+"""
+Picture description checks against a fake OpenAI-compatible backend: bounded concurrency,
+deduplication of identical images, the on-disk description cache and failed requests; and the
+describer /documents/convert uses, in-process through the model router and over HTTP against the
+app the desktop sidecar runs (app.py), both as background work of the router's scheduler
+
+python test_picture_descriptions.py
+"""
+
+import asyncio
+import json
+import tempfile
+
+import httpx
+
+import app
+from model_router import Backend, ModelRouter, router
+from model_scheduler import Scheduler
+from picture_descriptions import DescriptionCache, PictureDescriber
+
+
+class FakeServer:
+    def __init__(self, delay: float = 0.01, fail: str = None):
+        self.delay = delay
+        self.fail = fail
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        body["headers"] = {name: request.headers.get(name) for name in ("x-priority", "x-tenant")}
+        self.requests.append(body)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        image_url = body["messages"][0]["content"][1]["image_url"]["url"]
+        if self.fail is not None and image_url.endswith(self.fail):
+            return httpx.Response(500, json={"error": "bad image"})
+        return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": f" {image_url[-8:]} "}}]})
+
+
+def describer(server: FakeServer, cache_dir: str, max_in_flight: int = 3) -> PictureDescriber:
+    client = httpx.AsyncClient(transport=httpx.MockTransport(server.handle))
+    return PictureDescriber("vlm", params={"temperature": 0.2}, max_in_flight=max_in_flight,
+                            cache=DescriptionCache(cache_dir), url="http://api/v1/chat/completions", client=client)
+
+
+def test_bounded_concurrency_and_dedup():
+    server = FakeServer()
+    images = [f"image-{i % 8}".encode() for i in range(20)]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        pictures = describer(server, cache_dir)
+        descriptions = asyncio.run(pictures.describe_images(images, tenant="paper.pdf"))
+    # 8 distinct images: 8 requests, never more than 3 at once, every duplicate gets the same text
+    assert len(server.requests) == 8 and server.max_active == 3
+    assert descriptions[0] == descriptions[8] == descriptions[16] != descriptions[1]
+    assert pictures.stats["deduplicated"] == 12
+    assert server.requests[0]["temperature"] == 0.2 and server.requests[0]["model"] == "vlm"
+    # Sent to the other process's scheduler as background work
+    assert server.requests[0]["headers"] == {"x-priority": "background", "x-tenant": "paper.pdf"}
+
+
+def test_cache_across_runs():
+    server = FakeServer()
+    images = [b"chart", b"photo"]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        first = asyncio.run(describer(server, cache_dir).describe_images(images))
+        again = describer(server, cache_dir)
+        assert asyncio.run(again.describe_images(images)) == first
+        assert len(server.requests) == 2 and again.stats["cached"] == 2
+        # Another prompt is another cache key
+        other = describer(server, cache_dir)
+        other.prompt = "Describe the chart axes."
+        asyncio.run(other.describe_images(images))
+        assert len(server.requests) == 4
+
+
+def test_failed_request_is_none():
+    server = FakeServer(fail="YmFk")  # base64 of b"bad"
+    with tempfile.TemporaryDirectory() as cache_dir:
+        pictures = describer(server, cache_dir)
+        descriptions = asyncio.run(pictures.describe_images([b"ok", b"bad"]))
+        assert descriptions[0] is not None and descriptions[1] is None
+        assert pictures.stats["failed"] == 1
+        # Failures are not cached: the next run asks again
+        asyncio.run(pictures.describe_images([b"bad"]))
+        assert len(server.requests) == 3
+
+
+class SlotRecorder(FakeServer):
+    """Upstream inference server that records the scheduler state of the router in front of it"""
+
+    def __init__(self, model_router: ModelRouter):
+        super().__init__()
+        self.model_router = model_router
+        self.running = []
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.running.append(dict(self.model_router.scheduler.running))
+        return await super().handle(request)
+
+
+def fake_router_backend(server: FakeServer) -> Backend:
+    return Backend("fake", "http://fake/v1", max_retries=0,
+                   http_client=httpx.AsyncClient(transport=httpx.MockTransport(server.handle)))
+
+
+def test_in_process_through_the_router():
+    server = SlotRecorder(None)
+    server.model_router = ModelRouter([fake_router_backend(server)], single_flight=False,
+                                      scheduler=Scheduler(slots=2, reserved=1))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        pictures = PictureDescriber("vlm", cache=DescriptionCache(cache_dir), url=None,
+                                    model_router=server.model_router)
+        descriptions = asyncio.run(pictures.describe_images([b"chart", b"photo"], tenant="paper.pdf"))
+    assert None not in descriptions and len(server.requests) == 2
+    # Background work: one at a time with 2 slots, the reserved one stays free for chat
+    assert all(running["background"] == 1 and running["interactive"] == 0 for running in server.running)
+
+
+def test_through_the_sidecar_app():
+    server = SlotRecorder(router)
+    saved = router.backends, router.scheduler
+    router.backends = [fake_router_backend(server)]
+    router.scheduler = Scheduler(slots=2, reserved=1)
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app.app))
+            pictures = PictureDescriber("vlm", cache=DescriptionCache(cache_dir),
+                                        url="http://127.0.0.1:60316/v1/chat/completions", client=client)
+            descriptions = asyncio.run(pictures.describe_images([b"chart"], tenant="paper.pdf"))
+    finally:
+        router.backends, router.scheduler = saved
+    assert descriptions[0] is not None and pictures.stats["failed"] == 0
+    assert server.running == [{"interactive": 0, "background": 1, "batch": 0}]
+
+
+def main():
+    for test in (test_bounded_concurrency_and_dedup, test_cache_across_runs, test_failed_request_is_none,
+                 test_in_process_through_the_router, test_through_the_sidecar_app):
+        test()
+        print(f"{test.__name__}: ok")
+
+
+if __name__ == "__main__":
+    main()
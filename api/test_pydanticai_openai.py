@@ -1,39 +1,13 @@
-from openai import AsyncOpenAI
 from pydantic_ai import Agent, RunContext
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.profiles import InlineDefsJsonSchemaTransformer
-from pydantic_ai.profiles.openai import OpenAIModelProfile
-from pydantic_ai.providers.openai import OpenAIProvider
 from pydantic import BaseModel, ValidationError, Field
 import httpx
 from datetime import date
 from typing import List, Annotated
 from typing_extensions import TypedDict, NotRequired
+from model_router import openai_model, router
 
-base_url='http://localhost:1234/v1'
-
-local_ips = ['localhost', '127.0.0.', '172.16.', '192.168.']
-if any(ip in base_url for ip in local_ips):
-    http_client = httpx.AsyncClient()
-else:
-    http_client = httpx.AsyncClient(proxy="http://127.0.0.1:7890")
-
-openai_client = AsyncOpenAI(
-    api_key='sk-xxx',
-    base_url=base_url,
-    max_retries=3,
-    http_client=http_client,
-)
-model = OpenAIModel(
-    model_name='google/gemma-3n-e4b',
-    provider=OpenAIProvider(
-        openai_client=openai_client,
-    ),
-    profile=OpenAIModelProfile(
-        json_schema_transformer=InlineDefsJsonSchemaTransformer,  # Supported by any model class on a plain ModelProfile
-        openai_supports_strict_tool_definition=False  # Supported by OpenAIModel only, requires OpenAIModelProfile
-    )
-)
+openai_client = router.openai_client()
+model = openai_model('google/gemma-3n-e4b')
 
 def sync_main():
     class CityLocation(BaseModel):
@@ -0,0 +1,387 @@
+"""
+Replays recorded /v1/chat/completions streams (LM Studio, qwen3-30b-a3b) through the data stream encoder
+and checks the protocol parts and frame coalescing
+
+python test_stream_protocol.py
+"""
+
+import asyncio
+import functools
+import json
+import time
+from types import SimpleNamespace
+
+import chat_metrics
+from chat_response import ChatStreamingResponse
+from stream_protocol import (COALESCE_READ_AHEAD, FRAME_MAX_BYTES, FrameCoalescer, Step, agent_stream_parts,
+                             coalesce, step_parts, text_part)
+from response_cache import TTLCache
+from tool_executor import cache_result, run_tool, run_tool_calls, tool_cache, with_timeout
+
+# Recorded chunk payloads, trimmed to the fields the encoder reads
+TEXT_STREAM = [
+    {"choices": [{"delta": {"role": "assistant", "content": ""}, "finish_reason": None}]},
+    {"choices": [{"delta": {"content": "你好"}, "finish_reason": None}]},
+    {"choices": [{"delta": {"content": "! Say \"hi\"\n"}, "finish_reason": None}]},
+    {"choices": [{"delta": {"content": "\\path\t✓"}, "finish_reason": None}]},
+    {"choices": [{"delta": {}, "finish_reason": "stop"}]},
+    {"choices": [], "usage": {"prompt_tokens": 12, "completion_tokens": 7}},
+]
+
+TOOL_STREAM = [
+    {"choices": [{"delta": {"role": "assistant", "content": None, "tool_calls": [
+        {"index": 0, "id": "call_1", "function": {"name": "get_current_weather", "arguments": ""}}]},
+        "finish_reason": None}]},
+    {"choices": [{"delta": {"tool_calls": [
+        {"index": 0, "id": None, "function": {"name": None, "arguments": "{\"location\": \"Paris\", "}}]},
+        "finish_reason": None}]},
+    {"choices": [{"delta": {"tool_calls": [
+        {"index": 0, "id": None, "function": {"name": None, "arguments": "\"unit\": \"celsius\"}"}}]},
+        "finish_reason": None}]},
+    {"choices": [{"delta": {}, "finish_reason": "tool_calls"}]},
+    {"choices": [], "usage": {"prompt_tokens": 80, "completion_tokens": 21}},
+]
+
+
+def _namespace(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: _namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_namespace(v) for v in value]
+    return value
+
+
+async def _replay(recorded):
+    for payload in recorded:
+        for choice in payload["choices"]:
+            choice["delta"].setdefault("content", None)
+            choice["delta"].setdefault("tool_calls", None)
+        payload.setdefault("usage", None)
+        yield _namespace(payload)
+
+
+def _collect(stream) -> list:
+    async def collect():
+        return [item async for item in stream]
+    return asyncio.run(collect())
+
+
+def _parse(body: bytes):
+    parts = []
+    for line in body.decode().splitlines():
+        kind, payload = line.split(":", 1)
+        parts.append((kind, json.loads(payload)))
+    return parts
+
+
+def get_current_weather(location, unit):
+    return {"location": location, "temperature": 18, "unit": unit}
+
+
+def test_text_stream():
+    async def create_stream(messages):
+        return _replay(TEXT_STREAM)
+
+    body = b"".join(_collect(agent_stream_parts(create_stream, [], {}, max_steps=5)))
+    usage = {"promptTokens": 12, "completionTokens": 7}
+    assert _parse(body) == [
+        ("0", "你好"),
+        ("0", "! Say \"hi\"\n"),
+        ("0", "\\path\t✓"),
+        ("e", {"finishReason": "stop", "usage": usage, "isContinued": False}),
+        ("d", {"finishReason": "stop", "usage": usage}),
+    ]
+
+
+def test_tool_stream():
+    tools = {"get_current_weather": get_current_weather}
+    step = Step()
+    body = b"".join(_collect(step_parts(_replay(TOOL_STREAM), tools, step)))
+    args = {"location": "Paris", "unit": "celsius"}
+    assert _parse(body) == [
+        ("9", {"toolCallId": "call_1", "toolName": "get_current_weather", "args": args}),
+        ("a", {"toolCallId": "call_1", "toolName": "get_current_weather", "args": args,
+               "result": get_current_weather(**args)}),
+    ]
+    # The step keeps what the next model call and the finish parts need
+    assert step.finish_reason == "tool-calls"
+    assert (step.prompt_tokens, step.completion_tokens) == (80, 21)
+    assert step.tool_results == {"call_1": get_current_weather(**args)}
+
+
+def test_coalescing_keeps_bytes_and_respects_budget():
+    parts = [text_part(f"token{i} " * 20) for i in range(400)]
+
+    async def upstream():
+        for i, part in enumerate(parts):
+            if i < 200:
+                await asyncio.sleep(0.001)  # ~1 ms between deltas, then a burst
+            yield part
+
+    frames = _collect(coalesce(upstream(), max_bytes=4096, max_delay=0.016))
+    assert b"".join(frames) == b"".join(parts)
+    assert all(frame.endswith(b"\n") for frame in frames)
+    assert all(len(frame) < 4096 + max(map(len, parts)) for frame in frames)
+    # Paced deltas are merged per 16 ms frame, the burst per 4 KB frame
+    assert len(frames) < len(parts) / 4
+
+
+def test_first_delta_and_control_parts_are_not_delayed():
+    now = [0.0]
+    coalescer = FrameCoalescer(max_bytes=4096, max_delay=0.016, clock=lambda: now[0])
+    assert coalescer.add(text_part("first")) == text_part("first")
+    assert coalescer.add(text_part("second")) is None
+    assert coalescer.add(b"d:{}\n", flush=True) == text_part("second") + b"d:{}\n"
+    now[0] = 1.0
+    assert coalescer.add(text_part("later")) == text_part("later")
+
+
+def test_stalled_upstream_flushes_on_deadline():
+    # Two quick deltas, then the upstream stalls for 100 ms: the buffered delta must not wait for it
+    async def parts():
+        yield text_part("a")
+        yield text_part("b")
+        await asyncio.sleep(0.1)
+        yield text_part("c")
+
+    async def collect():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        return [(frame, loop.time() - start) async for frame in coalesce(parts(), max_delay=0.016)]
+
+    frames = asyncio.run(collect())
+    assert [frame for frame, _ in frames] == [text_part("a"), text_part("b"), text_part("c")]
+    assert frames[1][1] < 0.05
+
+
+def test_tool_calls_run_concurrently_and_stream_as_completed():
+    def slow_weather(location, unit):
+        time.sleep(0.2)
+        return {"location": location}
+
+    async def fast_lookup(query):
+        await asyncio.sleep(0.05)
+        return {"query": query}
+
+    @with_timeout(0.1)
+    def hanging(**kwargs):
+        time.sleep(0.5)
+
+    tools = {"slow_weather": slow_weather, "fast_lookup": fast_lookup, "hanging": hanging}
+    tool_calls = [
+        {"id": "1", "name": "slow_weather", "arguments": '{"location": "Paris", "unit": "celsius"}'},
+        {"id": "2", "name": "fast_lookup", "arguments": '{"query": "x"}'},
+        {"id": "3", "name": "hanging", "arguments": ""},
+        {"id": "4", "name": "missing", "arguments": "{}"},
+        {"id": "5", "name": "fast_lookup", "arguments": "{not json"},
+    ]
+
+    async def collect():
+        start = time.perf_counter()
+        return [(tool_call["id"], result, time.perf_counter() - start)
+                async for tool_call, result in run_tool_calls(tool_calls, tools)]
+
+    results = asyncio.run(collect())
+    order = [tool_id for tool_id, _, _ in results]
+    assert set(order[:2]) == {"4", "5"} and order[2:] == ["2", "3", "1"]
+    by_id = {tool_id: (result, elapsed) for tool_id, result, elapsed in results}
+    assert by_id["2"][0] == {"query": "x"} and by_id["2"][1] < 0.15
+    assert "timed out" in by_id["3"][0]["error"]
+    assert "Unknown tool" in by_id["4"][0]["error"]
+    assert "Invalid arguments" in by_id["5"][0]["error"]
+    # All calls ran in parallel: total time is the slowest tool, not the sum
+    assert by_id["1"][1] < 0.4
+
+
+def test_agent_loop_feeds_tool_results_back():
+    tools = {"get_current_weather": get_current_weather}
+    requests = []
+
+    async def create_stream(messages):
+        requests.append(messages)
+        return _replay(TOOL_STREAM if len(requests) == 1 else TEXT_STREAM)
+
+    history = [{"role": "user", "content": "Weather in Paris?"}]
+    body = b"".join(_collect(agent_stream_parts(create_stream, history, tools, max_steps=5)))
+    kinds = [kind for kind, _ in _parse(body)]
+    assert kinds == ["9", "a", "e", "0", "0", "0", "e", "d"]
+    assert _parse(body)[-1][1] == {"finishReason": "stop", "usage": {"promptTokens": 92, "completionTokens": 28}}
+
+    # The second model call sees the assistant tool call and its result, the caller's history is untouched
+    assert len(requests) == 2 and history == requests[0]
+    assistant, tool = requests[1][1:]
+    assert assistant["tool_calls"][0]["function"]["name"] == "get_current_weather"
+    assert tool["tool_call_id"] == "call_1"
+    assert json.loads(tool["content"]) == get_current_weather("Paris", "celsius")
+
+    # Step limit: with one step the response ends after the tool results, as before
+    requests.clear()
+    body = b"".join(_collect(agent_stream_parts(create_stream, history, tools, max_steps=1)))
+    assert [kind for kind, _ in _parse(body)] == ["9", "a", "e", "d"] and len(requests) == 1
+    assert _parse(body)[-1][1]["finishReason"] == "tool-calls"
+
+
+def test_tool_results_are_cached_by_canonical_args():
+    calls = []
+
+    @cache_result(ttl=60)
+    def weather(location, unit):
+        calls.append(location)
+        return {"location": location, "unit": unit}
+
+    tools = {"weather": weather}
+    results = [asyncio.run(run_tool(tools, "weather", arguments)) for arguments in (
+        '{"location": "Paris", "unit": "celsius"}',
+        '{"unit":"celsius","location":"Paris"}',
+        '{"location": "Rome", "unit": "celsius"}',
+    )]
+    assert calls == ["Paris", "Rome"] and results[0] == results[1]
+    assert tool_cache.hits >= 1
+
+
+def test_ttl_cache_expiry_and_lru():
+    now = [0.0]
+    cache = TTLCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=100)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # evicts b, the least recently used
+    assert cache.get("b") is None and cache.get("c") == 3
+    now[0] = 11
+    assert cache.get("a") is None and len(cache) == 1
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+
+def test_trace_records_ttft_tools_and_usage():
+    tools = {"get_current_weather": get_current_weather}
+    requests = []
+
+    async def create_stream(messages):
+        requests.append(messages)
+        return _replay(TOOL_STREAM if len(requests) == 1 else TEXT_STREAM)
+
+    trace = chat_metrics.RequestTrace()
+
+    async def run():
+        chat_metrics.current_trace.set(trace)
+        create = functools.partial(trace.create, create_stream)
+        history = [{"role": "user", "content": "Weather in Paris?"}]
+        return [part async for part in agent_stream_parts(create, history, tools, max_steps=5)]
+
+    asyncio.run(run())
+    trace.finish()
+    assert len(trace.steps) == 2 and trace.first_token is not None
+    assert [tool["name"] for tool in trace.tools] == ["get_current_weather"]
+    assert (trace.prompt_tokens, trace.completion_tokens) == (92, 28)
+
+    exposition = chat_metrics.render()
+    assert 'chat_tool_seconds_count{tool="get_current_weather"}' in exposition
+    assert 'chat_requests_total{status="completed"}' in exposition
+    assert 'chat_time_to_first_token_seconds_bucket{le="+Inf"}' in exposition
+
+
+def test_tokens_per_second_excludes_the_first_token():
+    trace = chat_metrics.RequestTrace()
+    # 11 tokens, the first at t=10 s and the last at t=12 s: 10 tokens generated in 2 s
+    trace.first_token, trace.last_token, trace.completion_tokens = 10.0, 12.0, 11
+    assert trace.tokens_per_second() == 5.0
+    # Without a usage chunk the streamed chunks are counted; a one-token reply has no rate
+    trace.completion_tokens, trace.chunks = 0, 1
+    assert trace.tokens_per_second() is None
+
+
+def _endless_upstream(produced: list, closed: list, delay: float):
+    """Fake upstream that generates until it is closed, counting the chunks it produced"""
+    async def create_stream(messages):
+        async def chunks():
+            try:
+                i = 0
+                while True:
+                    if delay:
+                        await asyncio.sleep(delay)
+                    produced.append(i)
+                    yield _namespace({"choices": [{"delta": {"content": f"token{i} ", "tool_calls": None},
+                                                   "finish_reason": None}], "usage": None})
+                    i += 1
+            finally:
+                closed.append(len(produced))
+        return chunks()
+    return create_stream
+
+
+def _serve(response, send_delay: float, disconnect_after: int, produced: list, closed: list):
+    """Run the ASGI response; the client disconnects after receiving disconnect_after body messages
+
+    Returns the body messages and (chunks produced, upstream closes) shortly after the response returned,
+    before asyncio.run finalizes any generator that was left open.
+    """
+    sent = []
+    disconnected = asyncio.Event()
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message["body"]:
+            await asyncio.sleep(send_delay)
+            sent.append(message["body"])
+            if len(sent) == disconnect_after:
+                disconnected.set()
+
+    async def receive():
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def run():
+        await response({"type": "http", "asgi": {"spec_version": "2.3"}}, receive, send)
+        # Anything still generating after the response returned would show up here
+        await asyncio.sleep(0.05)
+        return len(produced), list(closed)
+
+    return sent, asyncio.run(run())
+
+
+def test_disconnect_stops_upstream_within_one_chunk():
+    produced, closed = [], []
+    create_stream = _endless_upstream(produced, closed, delay=0.005)
+    at_disconnect = []
+
+    class Response(ChatStreamingResponse):
+        async def listen_for_disconnect(self, receive):
+            await super().listen_for_disconnect(receive)
+            at_disconnect.append(len(produced))
+
+    # Client leaves while the server waits for the model, then while a frame is being written
+    for send_delay in (0, 0.02):
+        for record in (produced, closed, at_disconnect):
+            record.clear()
+        response = Response(coalesce(agent_stream_parts(create_stream, [], {}, max_steps=1)))
+        _, (total, closes) = _serve(response, send_delay, 5, produced, closed)
+        # The upstream was closed at most one chunk after the disconnect and nothing was generated afterwards
+        assert closes == [total]
+        assert total - at_disconnect[0] <= 1
+
+
+def test_slow_client_bounds_read_ahead():
+    produced, closed = [], []
+    create_stream = _endless_upstream(produced, closed, delay=0)
+    response = ChatStreamingResponse(coalesce(agent_stream_parts(create_stream, [], {}, max_steps=1)))
+    sent, (total, closes) = _serve(response, 0.01, 10, produced, closed)
+    sent_parts = sum(frame.count(b"\n") for frame in sent)
+    # Besides what was written, at most the read-ahead queue and one frame being filled were generated
+    part_size = len(text_part("token99999 "))
+    assert closes == [total]
+    assert total - sent_parts <= COALESCE_READ_AHEAD + FRAME_MAX_BYTES // part_size + 2
+
+
+def main():
+    for test in (test_text_stream, test_tool_stream, test_coalescing_keeps_bytes_and_respects_budget,
+                 test_first_delta_and_control_parts_are_not_delayed, test_stalled_upstream_flushes_on_deadline,
+                 test_tool_calls_run_concurrently_and_stream_as_completed, test_agent_loop_feeds_tool_results_back,
+                 test_tool_results_are_cached_by_canonical_args, test_ttl_cache_expiry_and_lru,
+                 test_trace_records_ttft_tools_and_usage, test_tokens_per_second_excludes_the_first_token,
+                 test_disconnect_stops_upstream_within_one_chunk,
+                 test_slow_client_bounds_read_ahead):
+        test()
+        print(f"{test.__name__}: ok")
+
+
+if __name__ == "__main__":
+    main()
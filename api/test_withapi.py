@@ -21,9 +21,12 @@ from docling.datamodel.settings import (
 )
 from random import randint
 
-def lms_vlm_options(model: str, prompt: str, format: ResponseFormat):
+def lms_vlm_options(model: str, prompt: str, format: ResponseFormat, tenant: str = ""):
     options = ApiVlmOptions(
-        url="http://127.0.0.1:1234/v1/chat/completions",  # the default LM Studio
+        # LM Studio (127.0.0.1:1234) behind the scheduler of the api on port 60316 (the desktop sidecar
+        # app.py, or index.py; both mount completions_api), so OCR pages run as batch work
+        url="http://127.0.0.1:60316/v1/chat/completions",
+        headers={"X-Priority": "batch", "X-Tenant": tenant},
         params=dict(
             model=model,
         ),
@@ -141,6 +144,7 @@ def main():
         # model="qwen/qwen2.5-vl-7b",
         prompt="OCR the full page to markdown.",
         format=ResponseFormat.MARKDOWN,
+        tenant=input_doc_path.name,
     ) 
     # ! 结果是中文PDF解析到一半出错了
 
@@ -0,0 +1,105 @@
+"""
+Runs the tool calls of one model turn concurrently
+Async tools are awaited on the event loop, sync tools (get_current_weather, ...) run in a bounded
+thread pool. Results are yielded in completion order, so a slow tool does not hold back the others.
+"""
+
+import asyncio
+import functools
+import inspect
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Tuple
+
+import chat_metrics
+from response_cache import TTLCache, canonical_json
+
+DEFAULT_TOOL_TIMEOUT = float(os.environ.get("TOOL_TIMEOUT", "30"))
+
+# Results of tools marked with @cache_result, keyed by (tool name, canonical arguments)
+tool_cache = TTLCache(max_entries=int(os.environ.get("TOOL_CACHE_SIZE", "1024")))
+
+_MISSING = object()
+
+# Shared by all chats; a sync tool that times out keeps its thread until it returns
+_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("TOOL_THREADS", "8")), thread_name_prefix="tool")
+
+
+def with_timeout(seconds: float) -> Callable:
+    """Decorator setting a per-tool timeout, used instead of DEFAULT_TOOL_TIMEOUT"""
+    def decorate(fn):
+        fn.timeout = seconds
+        return fn
+    return decorate
+
+
+def cache_result(ttl: float) -> Callable:
+    """Opt a deterministic tool into the result cache; results are reused for ttl seconds"""
+    def decorate(fn):
+        fn.cache_ttl = ttl
+        return fn
+    return decorate
+
+
+async def run_tool(available_tools: dict, name: str, arguments: str):
+    """Run one tool call; errors and timeouts become {"error": ...} results instead of ending the stream"""
+    start = time.perf_counter()
+    result = await _run_tool(available_tools, name, arguments)
+    chat_metrics.observe_tool(name, time.perf_counter() - start)
+    return result
+
+
+async def _run_tool(available_tools: dict, name: str, arguments: str):
+    fn = available_tools.get(name)
+    if fn is None:
+        return {"error": f"Unknown tool {name}"}
+    try:
+        kwargs = json.loads(arguments or "{}")
+    except json.JSONDecodeError as e:
+        return {"error": f"Invalid arguments for {name}: {e}"}
+
+    cache_ttl = getattr(fn, "cache_ttl", None)
+    start = time.perf_counter()
+    if cache_ttl is not None:
+        cache_key = (name, canonical_json(kwargs))
+        cached = tool_cache.get(cache_key, _MISSING)
+        if cached is not _MISSING:
+            tool_cache.record_latency(True, time.perf_counter() - start)
+            return cached
+
+    timeout = getattr(fn, "timeout", DEFAULT_TOOL_TIMEOUT)
+    try:
+        if inspect.iscoroutinefunction(fn):
+            result = await asyncio.wait_for(fn(**kwargs), timeout)
+        else:
+            loop = asyncio.get_running_loop()
+            result = await asyncio.wait_for(loop.run_in_executor(_pool, functools.partial(fn, **kwargs)), timeout)
+    except TimeoutError:
+        return {"error": f"Tool {name} timed out after {timeout:g}s"}
+    except Exception as e:
+        print(f"Error running tool {name}: {e}")
+        return {"error": f"Tool {name} failed: {e}"}
+
+    if cache_ttl is not None:
+        tool_cache.set(cache_key, result, cache_ttl)
+        tool_cache.record_latency(False, time.perf_counter() - start)
+    return result
+
+
+async def run_tool_calls(tool_calls: list, available_tools: dict) -> AsyncIterator[Tuple[dict, object]]:
+    """Start all tool calls at once and yield (tool_call, result) as each one finishes"""
+    tasks = {
+        asyncio.ensure_future(run_tool(available_tools, tool_call["name"], tool_call["arguments"])): tool_call
+        for tool_call in tool_calls
+    }
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield tasks[task], task.result()
+    finally:
+        for task in tasks:
+            task.cancel()